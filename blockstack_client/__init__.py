@@ -33,6 +33,8 @@ import user
 import snv
 import rpc
 import storage
+import atlas
+import prewarm
 import backend
 
 from proxy import BlockstackRPCClient, get_default_proxy, set_default_proxy, json_traceback
@@ -55,7 +57,10 @@ from data import blockstack_url_fetch as fetch_data
 from data import data_get, data_put, data_delete, data_list
 from data import set_data_pubkey
 from storage import get_announcement, put_announcement, verify_zonefile
-from profile import get_name_profile, get_name_zonefile, get_and_migrate_profile
+from profile import get_name_profile, get_name_profiles, get_name_zonefile, get_and_migrate_profile, get_negative_cache_stats, \
+        convert_legacy_profile, convert_legacy_profiles
+from atlas import atlas_sync, atlas_mirror_get_zonefile, atlas_crawl, atlas_get_ranked_peers
+from prewarm import prewarm_namespace
 from accounts import list_accounts, get_account, put_account, delete_account, create_app_account
 
 from config import get_logger, get_config, CONFIG_PATH, CONFIG_FILENAME, get_utxo_provider_client, get_tx_broadcaster, default_bitcoind_opts
@@ -65,7 +70,7 @@ from storage import blockstack_immutable_data_url as make_immutable_data_url
 
 from storage import blockstack_data_url_parse as parse_data_url
 from storage import blockstack_data_url as make_data_url
-from storage import get_storage_handlers, hash_zonefile
+from storage import get_storage_handlers, hash_zonefile, parse_zonefile, get_zonefile_cache_stats
 
 from storage import BlockstackURLHandle, BlockstackHandler, get_data_hash, get_blockchain_compat_hash, get_zonefile_data_hash
 from storage import parse_mutable_data as parse_signed_data
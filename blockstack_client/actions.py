@@ -103,16 +103,19 @@ from blockstack_client import \
     put_immutable, \
     put_mutable
 
-from blockstack_client.profile import profile_update, zonefile_data_replicate
+from blockstack_client.profile import profile_update, zonefile_data_replicate, convert_legacy_profiles
 
 from rpc import local_rpc_connect, local_rpc_status, local_rpc_stop, start_rpc_endpoint
 import rpc as local_rpc
 import config
 from .config import WALLET_PATH, WALLET_PASSWORD_LENGTH, CONFIG_PATH, CONFIG_DIR, configure, FIRST_BLOCK_TIME_UTC, get_utxo_provider_client, set_advanced_mode, \
-        APPROX_PREORDER_TX_LEN, APPROX_REGISTER_TX_LEN, APPROX_UPDATE_TX_LEN, APPROX_TRANSFER_TX_LEN, APPROX_REVOKE_TX_LEN, APPROX_RENEWAL_TX_LEN, configure_zonefile
+        APPROX_PREORDER_TX_LEN, APPROX_REGISTER_TX_LEN, APPROX_UPDATE_TX_LEN, APPROX_TRANSFER_TX_LEN, APPROX_REVOKE_TX_LEN, APPROX_RENEWAL_TX_LEN, configure_zonefile, \
+        DEFAULT_STORAGE_WORKERS
 
 from .storage import is_valid_hash, is_b40, get_drivers_for_url
 from .user import add_user_zonefile_url, remove_user_zonefile_url
+from .atlas import atlas_sync, atlas_crawl
+from .prewarm import prewarm_namespace
 
 from pybitcoin import is_b58check_address
 
@@ -1099,7 +1102,7 @@ def cli_update( args, config_path=CONFIG_PATH, password=None, interactive=True,
     else:
         user_data_txt = user_data_res['zonefile']
         user_data_hash = storage.get_zonefile_data_hash( user_data_res['zonefile'] )
-        user_zonefile_dict = blockstack_zones.parse_zone_file( user_data_res['zonefile'] )
+        user_zonefile_dict = storage.parse_zonefile( user_data_res['zonefile'] )
 
     # open the zonefile editor
     data_pubkey = wallet_keys['data_pubkey']
@@ -1437,7 +1440,7 @@ def cli_migrate( args, config_path=CONFIG_PATH, password=None, proxy=None, inter
 
         # try to parse
         try:
-            user_zonefile = blockstack_zones.parse_zone_file( user_zonefile_txt )
+            user_zonefile = storage.parse_zonefile( user_zonefile_txt )
             legacy = blockstack_profiles.is_profile_in_legacy_format( user_zonefile )
         except:
             log.warning("Non-standard zonefile %s" % user_zonefile_hash)
@@ -2294,6 +2297,58 @@ def cli_advanced_get_nameops_at( args, config_path=CONFIG_PATH ):
     return result
 
 
+def cli_advanced_sync_zonefiles( args, config_path=CONFIG_PATH ):
+    """
+    command: sync_zonefiles norpc
+    help: Sync the local Atlas zonefile mirror with the Atlas network
+    opt: peers (str) "A comma-separated list of host:port Atlas peers to sync from"
+    """
+    peers = None
+    if getattr(args, 'peers', None) is not None:
+        peers = [str(p).strip() for p in str(args.peers).split(',') if len(p.strip()) > 0]
+
+    result = atlas_sync( config_path=config_path, peers=peers )
+    return result
+
+
+def cli_advanced_crawl_atlas_peers( args, config_path=CONFIG_PATH ):
+    """
+    command: crawl_atlas_peers norpc
+    help: Crawl the Atlas peer graph, and rank the peers found by latency and zonefile inventory
+    opt: max_peers (int) "The maximum number of peers to probe"
+    opt: fanout (int) "The maximum number of new neighbors to follow from each peer"
+    """
+    max_peers = None
+    fanout = None
+
+    if getattr(args, 'max_peers', None) is not None:
+        max_peers = int(args.max_peers)
+
+    if getattr(args, 'fanout', None) is not None:
+        fanout = int(args.fanout)
+
+    result = atlas_crawl( config_path=config_path, max_peers=max_peers, fanout=fanout )
+    return result
+
+
+def cli_advanced_prewarm_namespace( args, config_path=CONFIG_PATH ):
+    """
+    command: prewarm_namespace norpc
+    help: Fetch the zonefile and profile of every name in a namespace into the local caches
+    arg: namespace_id (str) "The ID of the namespace to pre-warm"
+    opt: workers (int) "The number of concurrent lookups per batch"
+    opt: restart (str) "If true, then ignore any checkpoint and start from the first name"
+    """
+    max_workers = DEFAULT_STORAGE_WORKERS
+    if getattr(args, 'workers', None) is not None:
+        max_workers = max(1, int(args.workers))
+
+    restart = str(getattr(args, 'restart', 'false')).lower() in ['1', 'true', 'yes']
+
+    result = prewarm_namespace( str(args.namespace_id), config_path=config_path, max_workers=max_workers, restart=restart )
+    return result
+
+
 def cli_advanced_set_zonefile_hash( args, config_path=CONFIG_PATH, password=None ):
     """
     command: set_zonefile_hash norpc
@@ -2577,6 +2632,39 @@ def cli_advanced_convert_legacy_profile( args, config_path=CONFIG_PATH ):
     return profile
 
 
+def cli_advanced_convert_legacy_profiles( args, config_path=CONFIG_PATH ):
+    """
+    command: convert_legacy_profiles norpc
+    help: Convert the legacy profiles of a list of names ahead of time, and cache the conversions.
+    arg: names (str) "A CSV of names, or the path to a file with one name per line"
+    opt: workers (int) "The number of concurrent lookups"
+    """
+
+    names = None
+    if os.path.exists(str(args.names)):
+        try:
+            with open(str(args.names), "r") as f:
+                names = [line.strip() for line in f.readlines()]
+        except:
+            return {'error': 'Failed to read names from "%s"' % args.names}
+
+    else:
+        names = str(args.names).split(",")
+
+    names = [name.strip() for name in names if len(name.strip()) > 0]
+    for name in names:
+        error = check_valid_name(name)
+        if error:
+            return {'error': '%s: %s' % (name, error)}
+
+    max_workers = DEFAULT_STORAGE_WORKERS
+    if getattr(args, 'workers', None) is not None:
+        max_workers = max(1, int(args.workers))
+
+    result = convert_legacy_profiles( names, max_workers=max_workers )
+    return result
+
+
 def cli_advanced_app_register( args, config_path=CONFIG_PATH, password=None, proxy=None, interactive=True ):
     """
     command: app_register norpc
@@ -0,0 +1,819 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Local Atlas zonefile mirror.
+#
+# Atlas peers describe which zonefiles they have with an inventory bit vector:
+# bit i is set if the peer has the zonefile of the i-th zonefile-setting name
+# operation (NAME_UPDATE or NAME_IMPORT), in blockchain order.  We keep the same
+# index locally, built from the name operation history, along with the zonefiles
+# we have.  Syncing diffs each peer's inventory against ours, and fetches the
+# missing zonefiles in parallel batches from the peers that have them.
+#
+# We also keep a table of Atlas peers, ranked by latency and inventory
+# completeness, which is filled in by crawling the peer graph.  Zonefile
+# reads and writes use it to pick which peers to talk to.
+
+import os
+import sys
+import sqlite3
+import random
+import binascii
+import threading
+import time
+
+from .proxy import get_default_proxy, getinfo, get_zonefile_inventory, get_zonefiles, get_atlas_peers, get_nameops_at, \
+        make_thread_proxy_factory
+from .storage import run_parallel
+from .config import get_logger, get_config, CONFIG_PATH, FIRST_BLOCK_MAINNET, DEFAULT_STORAGE_WORKERS, \
+        DEFAULT_ATLAS_CRAWL_INTERVAL, DEFAULT_ATLAS_CRAWL_MAX_PEERS, DEFAULT_ATLAS_CRAWL_FANOUT
+
+log = get_logger("blockstack-client-atlas")
+
+ATLAS_SQL = """
+CREATE TABLE zonefiles( inv_index INTEGER PRIMARY KEY NOT NULL,
+                        zonefile_hash STRING NOT NULL,
+                        name STRING NOT NULL,
+                        txid STRING NOT NULL,
+                        block_height INTEGER NOT NULL,
+                        present INTEGER NOT NULL );
+CREATE INDEX zonefiles_zonefile_hash ON zonefiles(zonefile_hash);
+CREATE TABLE zonefile_data( zonefile_hash STRING PRIMARY KEY NOT NULL,
+                            zonefile TEXT NOT NULL );
+CREATE TABLE sync_state( key STRING PRIMARY KEY NOT NULL,
+                         value STRING NOT NULL );
+"""
+
+ATLAS_PEERS_SQL = """
+CREATE TABLE peers( hostport STRING PRIMARY KEY NOT NULL,
+                    latency REAL,
+                    num_zonefiles INTEGER,
+                    inv_bits INTEGER,
+                    failures INTEGER NOT NULL,
+                    last_probe INTEGER NOT NULL,
+                    last_success INTEGER );
+CREATE TABLE crawl_state( key STRING PRIMARY KEY NOT NULL,
+                          value STRING NOT NULL );
+"""
+
+# name operations whose value_hash is a new zonefile hash
+ATLAS_ZONEFILE_OPCODES = ["NAME_UPDATE", "NAME_IMPORT"]
+
+# inventory bits to ask a peer for at once
+ATLAS_INV_RANGE_BITS = 32768
+
+# most zonefiles to ask a peer for at once
+ATLAS_ZONEFILES_PER_REQUEST = 100
+
+# blocks to scan for name operations before checkpointing the index
+ATLAS_INDEX_BLOCKS_PER_BATCH = 100
+
+# crawler: how long to wait for a peer, and how much of its inventory to read
+ATLAS_CRAWL_TIMEOUT = 10
+ATLAS_CRAWL_MAX_INV_BITS = 1 << 21
+
+# peers with at least this fraction of the best peer's zonefiles are "complete"
+ATLAS_PEER_MIN_COMPLETENESS = 0.9
+
+# forget peers that have failed this many probes in a row
+ATLAS_PEER_MAX_FAILURES = 3
+
+
+def get_atlas_mirror_path( config_path=CONFIG_PATH ):
+    """
+    Get the path to the local Atlas mirror database
+    """
+    conf = get_config( config_path )
+    if conf is not None and conf.has_key('atlas_mirror_path'):
+        return conf['atlas_mirror_path']
+
+    return os.path.join( os.path.dirname(config_path), "atlas.db" )
+
+
+def atlasdb_create( path, sql=ATLAS_SQL ):
+    """
+    Create a sqlite3 db at the given path.
+    Create all the tables and indexes we need.
+    """
+
+    if os.path.exists( path ):
+        raise Exception("Database '%s' already exists" % path)
+
+    lines = [l + ";" for l in sql.split(";")]
+    con = sqlite3.connect( path, isolation_level=None )
+
+    for line in lines:
+        con.execute(line)
+
+    con.row_factory = atlasdb_row_factory
+    con.text_factory = str
+    return con
+
+
+def atlasdb_open( path, sql=ATLAS_SQL ):
+    """
+    Open a connection to our database
+    """
+    if not os.path.exists( path ):
+        con = atlasdb_create( path, sql=sql )
+    else:
+        con = sqlite3.connect( path, isolation_level=None )
+        con.row_factory = atlasdb_row_factory
+        con.text_factory = str
+    return con
+
+
+def atlasdb_row_factory( cursor, row ):
+    """
+    Row factory: make rows into dicts
+    """
+    d = {}
+    for idx, col in enumerate( cursor.description ):
+        d[col[0]] = row[idx]
+
+    return d
+
+
+def atlasdb_get_last_block( con ):
+    """
+    Get the last block whose name operations are in the index.
+    Return None if we haven't indexed any
+    """
+    rows = con.execute( "SELECT value FROM sync_state WHERE key = 'last_block';" ).fetchall()
+    if len(rows) == 0:
+        return None
+
+    return int(rows[0]['value'])
+
+
+def atlasdb_get_num_zonefiles( con ):
+    """
+    Get the number of zonefiles in the index (i.e. the length of the inventory, in bits)
+    """
+    rows = con.execute( "SELECT COUNT(*) AS num_zonefiles FROM zonefiles;" ).fetchall()
+    return rows[0]['num_zonefiles']
+
+
+def atlasdb_add_blocks( con, block_nameops, last_block ):
+    """
+    Append the zonefile hashes set by each block's name operations to the index,
+    and checkpoint the last indexed block, all at once.
+    @block_nameops is a list of (block height, [nameops sorted by vtxindex]), in block order.
+    Return the number of zonefiles added
+    """
+    num_added = 0
+    next_index = atlasdb_get_num_zonefiles( con )
+
+    con.execute( "BEGIN;" )
+    try:
+        for block_height, nameops in block_nameops:
+            for nameop in nameops:
+                if nameop.get('opcode', None) not in ATLAS_ZONEFILE_OPCODES or nameop.get('value_hash', None) is None:
+                    continue
+
+                zonefile_hash = str(nameop['value_hash'])
+                present = con.execute( "SELECT COUNT(*) AS present FROM zonefile_data WHERE zonefile_hash = ?;", (zonefile_hash,) ).fetchall()[0]['present']
+
+                con.execute( "INSERT INTO zonefiles VALUES (?,?,?,?,?,?);", \
+                             (next_index, zonefile_hash, nameop.get('name', ''), nameop['txid'], block_height, 1 if present > 0 else 0) )
+
+                next_index += 1
+                num_added += 1
+
+        con.execute( "INSERT OR REPLACE INTO sync_state VALUES ('last_block', ?);", (str(last_block),) )
+        con.execute( "COMMIT;" )
+
+    except:
+        con.rollback()
+        raise
+
+    return num_added
+
+
+def atlasdb_get_inventory( con, bit_offset, bit_count ):
+    """
+    Get our zonefile inventory for a range of bits.
+    Return the inventory as a bytearray
+    """
+    inv = bytearray( (bit_count + 7) / 8 )
+    rows = con.execute( "SELECT inv_index FROM zonefiles WHERE present = 1 AND inv_index >= ? AND inv_index < ?;", (bit_offset, bit_offset + bit_count) )
+    for row in rows:
+        i = row['inv_index'] - bit_offset
+        inv[i / 8] |= (1 << (7 - (i % 8)))
+
+    return inv
+
+
+def atlasdb_get_zonefile_hashes( con, inv_indexes ):
+    """
+    Get the zonefile hashes at the given inventory indexes.
+    Return {inv_index: zonefile hash}
+    """
+    ret = {}
+    inv_indexes = list(inv_indexes)
+    for i in xrange(0, len(inv_indexes), 500):
+        batch = inv_indexes[i:i+500]
+        rows = con.execute( "SELECT inv_index, zonefile_hash FROM zonefiles WHERE inv_index IN (%s);" % ",".join(["?"] * len(batch)), batch )
+        for row in rows:
+            ret[row['inv_index']] = row['zonefile_hash']
+
+    return ret
+
+
+def atlasdb_store_zonefiles( con, zonefiles ):
+    """
+    Store fetched zonefiles, and mark them as present in the inventory.
+    @zonefiles is {zonefile hash: zonefile text}, and must already be verified.
+    """
+    con.execute( "BEGIN;" )
+    try:
+        for zonefile_hash, zonefile_txt in zonefiles.items():
+            con.execute( "INSERT OR REPLACE INTO zonefile_data VALUES (?,?);", (zonefile_hash, zonefile_txt) )
+            con.execute( "UPDATE zonefiles SET present = 1 WHERE zonefile_hash = ?;", (zonefile_hash,) )
+
+        con.execute( "COMMIT;" )
+
+    except:
+        con.rollback()
+        raise
+
+
+def atlasdb_get_zonefile( con, zonefile_hash ):
+    """
+    Get a zonefile from the mirror.
+    Return the zonefile text on success
+    Return None if we don't have it
+    """
+    rows = con.execute( "SELECT zonefile FROM zonefile_data WHERE zonefile_hash = ?;", (zonefile_hash,) ).fetchall()
+    if len(rows) == 0:
+        return None
+
+    return rows[0]['zonefile']
+
+
+def inventory_diff( remote_inv, local_inv ):
+    """
+    Find the bits that are set in @remote_inv but not in @local_inv.
+    The inventories are compared as big integers, so the AND-NOT runs
+    word-at-a-time instead of bit-at-a-time; only the bytes of the
+    result that are non-zero are scanned for bit positions.
+
+    Return the list of bit indexes (relative to the start of the inventories)
+    """
+    remote_inv = str(remote_inv)
+    if len(remote_inv) == 0:
+        return []
+
+    local_inv = str(local_inv)[:len(remote_inv)]
+    local_inv += "\x00" * (len(remote_inv) - len(local_inv))
+
+    missing = int(binascii.hexlify(remote_inv), 16) & ~int(binascii.hexlify(local_inv), 16)
+    if missing == 0:
+        return []
+
+    missing_inv = bytearray( binascii.unhexlify( "%0*x" % (2 * len(remote_inv), missing) ) )
+
+    bits = []
+    for byte_index, byte in enumerate(missing_inv):
+        if byte == 0:
+            continue
+
+        for bit_index in xrange(0, 8):
+            if byte & (1 << (7 - bit_index)):
+                bits.append( byte_index * 8 + bit_index )
+
+    return bits
+
+
+def atlas_index_update( con, end_block, proxy=None, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Bring the local inventory index up to @end_block (exclusive),
+    by scanning the name operations of each new block.  Blocks are
+    fetched concurrently, and the index is checkpointed every
+    ATLAS_INDEX_BLOCKS_PER_BATCH blocks, so an interrupted scan resumes
+    where it left off.
+
+    Return {'status': True, 'last_block': ..., 'added': ...} on success
+    Return {'error': ...} on error
+    """
+    if proxy is None:
+        proxy = get_default_proxy()
+
+    get_thread_proxy = make_thread_proxy_factory( proxy )
+
+    last_block = atlasdb_get_last_block( con )
+    start_block = FIRST_BLOCK_MAINNET if last_block is None else last_block + 1
+    num_added = 0
+
+    def fetch_nameops( block_height ):
+        nameops = get_nameops_at( block_height, proxy=get_thread_proxy() )
+        if type(nameops) == dict and 'error' in nameops:
+            log.error("Failed to get name operations at %s: %s" % (block_height, nameops['error']))
+            return None
+
+        return nameops
+
+    for batch_start in xrange(start_block, end_block, ATLAS_INDEX_BLOCKS_PER_BATCH):
+        batch_end = min(batch_start + ATLAS_INDEX_BLOCKS_PER_BATCH, end_block)
+        block_heights = range(batch_start, batch_end)
+
+        results = run_parallel( fetch_nameops, [(block_height,) for block_height in block_heights], max_workers=max_workers )
+        if None in results:
+            return {'error': 'Failed to get name operations at block %s' % block_heights[results.index(None)], 'last_block': batch_start - 1, 'added': num_added}
+
+        num_added += atlasdb_add_blocks( con, zip(block_heights, results), batch_end - 1 )
+        log.debug("Indexed blocks %s-%s (%s zonefiles so far)" % (batch_start, batch_end - 1, num_added))
+
+    return {'status': True, 'last_block': max(end_block - 1, start_block - 1), 'added': num_added}
+
+
+def atlas_fetch_missing( con, wanted, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Fetch missing zonefiles from the peers that have them.
+    @wanted is {zonefile hash: [peer hostports that have it]}.
+
+    Each round asks each peer for a batch of the zonefiles we still need from it
+    (at most ATLAS_ZONEFILES_PER_REQUEST per request), with all requests
+    in parallel.  Zonefiles a peer fails to give us are asked of the
+    next peer that has them in the following round.
+
+    Return the number of zonefiles fetched
+    """
+    candidates = dict( [(zfh, list(peers)) for (zfh, peers) in wanted.items()] )
+    num_fetched = 0
+
+    def fetch_batch( peer_hostport, zonefile_hashes ):
+        res = get_zonefiles( peer_hostport, zonefile_hashes )
+        if 'error' in res:
+            log.debug("Failed to get zonefiles from {}: {}".format(peer_hostport, res['error']))
+            return {}
+
+        return res['zonefiles']
+
+    while len(candidates) > 0:
+
+        # spread the zonefiles over the peers that have them
+        assignments = {}
+        for i, (zonefile_hash, peers) in enumerate(candidates.items()):
+            peer_hostport = peers[i % len(peers)]
+            assignments.setdefault( peer_hostport, [] ).append( zonefile_hash )
+
+        requests = []
+        for peer_hostport, zonefile_hashes in assignments.items():
+            for i in xrange(0, len(zonefile_hashes), ATLAS_ZONEFILES_PER_REQUEST):
+                requests.append( (peer_hostport, zonefile_hashes[i:i+ATLAS_ZONEFILES_PER_REQUEST]) )
+
+        results = run_parallel( fetch_batch, requests, max_workers=max_workers )
+
+        fetched = {}
+        for (peer_hostport, zonefile_hashes), zonefiles in zip(requests, results):
+            for zonefile_hash in zonefile_hashes:
+                if zonefiles is not None and zonefiles.has_key(zonefile_hash):
+                    fetched[zonefile_hash] = zonefiles[zonefile_hash]
+
+                else:
+                    # try someone else next time
+                    candidates[zonefile_hash].remove( peer_hostport )
+
+        if len(fetched) > 0:
+            atlasdb_store_zonefiles( con, fetched )
+            num_fetched += len(fetched)
+
+        candidates = dict( [(zfh, peers) for (zfh, peers) in candidates.items() if zfh not in fetched and len(peers) > 0] )
+
+    return num_fetched
+
+
+def atlas_sync( config_path=CONFIG_PATH, peers=None, proxy=None, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Sync the local Atlas mirror:
+    * index the zonefile hashes of any new blocks
+    * for each range of ATLAS_INV_RANGE_BITS inventory bits, get every peer's
+      inventory in parallel and diff it against ours
+    * fetch the zonefiles we're missing from the peers that have them
+
+    @peers is a list of "host:port" strings.  If not given, our Atlas node and its peers are used.
+
+    Return {'status': True, 'last_block': ..., 'inventory_bits': ..., 'missing': ..., 'fetched': ...} on success
+    Return {'error': ...} on error
+    """
+    if proxy is None:
+        proxy = get_default_proxy( config_path=config_path )
+
+    conf = proxy.conf
+    server_hostport = '{}:{}'.format( conf['server'], conf['port'] )
+
+    info = getinfo( proxy=proxy )
+    if 'error' in info:
+        return {'error': 'Failed to get server info: %s' % info['error']}
+
+    current_block = int(info['last_block_processed'])
+
+    if peers is None:
+        peers = [server_hostport]
+        res = get_atlas_peers( server_hostport )
+        if 'error' in res:
+            log.warning("Failed to get Atlas peers of {}: {}".format(server_hostport, res['error']))
+        else:
+            peers += [str(peer) for peer in res['peers'] if str(peer) != server_hostport]
+
+    con = atlasdb_open( get_atlas_mirror_path(config_path) )
+
+    try:
+        res = atlas_index_update( con, current_block + 1, proxy=proxy, max_workers=max_workers )
+        if 'error' in res:
+            return res
+
+        inventory_bits = atlasdb_get_num_zonefiles( con )
+        num_missing = 0
+        num_fetched = 0
+
+        for bit_offset in xrange(0, inventory_bits, ATLAS_INV_RANGE_BITS):
+            bit_count = min(ATLAS_INV_RANGE_BITS, inventory_bits - bit_offset)
+
+            local_inv = atlasdb_get_inventory( con, bit_offset, bit_count )
+            remote_invs = run_parallel( get_zonefile_inventory, [(peer, bit_offset, bit_count) for peer in peers], max_workers=max_workers )
+
+            # which peers have which of the zonefiles we're missing?
+            missing_bits = {}
+            for peer, remote_inv in zip(peers, remote_invs):
+                if remote_inv is None or 'error' in remote_inv:
+                    log.debug("No inventory from {}".format(peer))
+                    continue
+
+                for bit in inventory_diff( remote_inv['inv'], local_inv ):
+                    if bit < bit_count:
+                        missing_bits.setdefault( bit_offset + bit, [] ).append( peer )
+
+            if len(missing_bits) == 0:
+                continue
+
+            zonefile_hashes = atlasdb_get_zonefile_hashes( con, missing_bits.keys() )
+            wanted = {}
+            for inv_index, zonefile_hash in zonefile_hashes.items():
+                wanted.setdefault( zonefile_hash, [] )
+                wanted[zonefile_hash] += [peer for peer in missing_bits[inv_index] if peer not in wanted[zonefile_hash]]
+
+            num_missing += len(wanted)
+            num_fetched += atlas_fetch_missing( con, wanted, max_workers=max_workers )
+
+            log.debug("Synced inventory bits {}-{}: {} missing, {} fetched so far".format(bit_offset, bit_offset + bit_count - 1, num_missing, num_fetched))
+
+    finally:
+        con.close()
+
+    return {'status': True, 'last_block': current_block, 'inventory_bits': inventory_bits, 'missing': num_missing, 'fetched': num_fetched}
+
+
+def atlas_mirror_get_zonefile( zonefile_hash, config_path=CONFIG_PATH ):
+    """
+    Get a zonefile from the local Atlas mirror.
+    Return the zonefile text on success
+    Return None if we don't have it
+    """
+    return atlas_mirror_get_zonefiles( [zonefile_hash], config_path=config_path ).get( str(zonefile_hash), None )
+
+
+def atlas_mirror_get_zonefiles( zonefile_hashes, config_path=CONFIG_PATH ):
+    """
+    Get many zonefiles from the local Atlas mirror.
+    Return {zonefile hash: zonefile text} for each one we have
+    """
+    path = get_atlas_mirror_path( config_path )
+    if not os.path.exists( path ):
+        return {}
+
+    ret = {}
+    try:
+        con = atlasdb_open( path )
+        try:
+            for zonefile_hash in zonefile_hashes:
+                zonefile_txt = atlasdb_get_zonefile( con, str(zonefile_hash) )
+                if zonefile_txt is not None:
+                    ret[str(zonefile_hash)] = zonefile_txt
+
+        finally:
+            con.close()
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to read Atlas mirror {}".format(path))
+
+    return ret
+
+
+def atlas_mirror_put_zonefiles( zonefiles, config_path=CONFIG_PATH ):
+    """
+    Store zonefiles to the local Atlas mirror.
+    @zonefiles is {zonefile hash: zonefile text}, and must already be verified.
+    Return True on success
+    Return False on error
+    """
+    path = get_atlas_mirror_path( config_path )
+    try:
+        con = atlasdb_open( path )
+        try:
+            atlasdb_store_zonefiles( con, zonefiles )
+        finally:
+            con.close()
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to write Atlas mirror {}".format(path))
+        return False
+
+    return True
+
+
+def get_atlas_peers_path( config_path=CONFIG_PATH ):
+    """
+    Get the path to the on-disk Atlas peer table
+    """
+    conf = get_config( config_path )
+    if conf is not None and conf.has_key('atlas_peers_path'):
+        return conf['atlas_peers_path']
+
+    return os.path.join( os.path.dirname(config_path), "atlas-peers.db" )
+
+
+def atlas_peerdb_get_peers( con ):
+    """
+    Get all peers in the peer table.
+    Return a list of rows
+    """
+    return con.execute( "SELECT * FROM peers;" ).fetchall()
+
+
+def atlas_peerdb_get_last_crawl( con ):
+    """
+    Get the time of the last crawl.
+    Return None if we never crawled
+    """
+    rows = con.execute( "SELECT value FROM crawl_state WHERE key = 'last_crawl';" ).fetchall()
+    if len(rows) == 0:
+        return None
+
+    return int(rows[0]['value'])
+
+
+def atlas_peerdb_store_probes( con, probes ):
+    """
+    Record the outcome of a crawl's probes (see atlas_peer_probe()).
+    Peers that fail ATLAS_PEER_MAX_FAILURES probes in a row are dropped.
+    """
+    now = int(time.time())
+
+    con.execute( "BEGIN;" )
+    try:
+        for probe in probes:
+            if 'error' in probe:
+                rows = con.execute( "SELECT failures FROM peers WHERE hostport = ?;", (probe['hostport'],) ).fetchall()
+                if len(rows) == 0:
+                    con.execute( "INSERT INTO peers (hostport, failures, last_probe) VALUES (?,?,?);", (probe['hostport'], 1, now) )
+                else:
+                    con.execute( "UPDATE peers SET failures = failures + 1, last_probe = ? WHERE hostport = ?;", (now, probe['hostport']) )
+
+            else:
+                con.execute( "INSERT OR REPLACE INTO peers VALUES (?,?,?,?,?,?,?);", \
+                             (probe['hostport'], probe['latency'], probe['num_zonefiles'], probe['inv_bits'], 0, now, now) )
+
+        con.execute( "DELETE FROM peers WHERE failures >= ?;", (ATLAS_PEER_MAX_FAILURES,) )
+        con.execute( "INSERT OR REPLACE INTO crawl_state VALUES ('last_crawl', ?);", (str(now),) )
+        con.execute( "COMMIT;" )
+
+    except:
+        con.rollback()
+        raise
+
+
+def atlas_peer_probe( hostport, max_inv_bits=ATLAS_CRAWL_MAX_INV_BITS ):
+    """
+    Probe an Atlas peer: time a request for its neighbors, and count the
+    zonefiles in its inventory (read ATLAS_INV_RANGE_BITS bits at a time,
+    until the peer returns a short range).
+
+    Return {'hostport': ..., 'latency': ..., 'num_zonefiles': ..., 'inv_bits': ..., 'peers': [...]} on success
+    Return {'hostport': ..., 'error': ...} on error
+    """
+    begin = time.time()
+    try:
+        res = get_atlas_peers( hostport, timeout=ATLAS_CRAWL_TIMEOUT )
+    except Exception, e:
+        log.exception(e)
+        res = {'error': 'Failed to contact {}'.format(hostport)}
+
+    latency = time.time() - begin
+    if 'error' in res:
+        log.debug("Failed to get Atlas peers of {}: {}".format(hostport, res['error']))
+        return {'hostport': hostport, 'error': res['error']}
+
+    num_zonefiles = 0
+    inv_bits = 0
+    for bit_offset in xrange(0, max_inv_bits, ATLAS_INV_RANGE_BITS):
+        try:
+            inv_res = get_zonefile_inventory( hostport, bit_offset, ATLAS_INV_RANGE_BITS, timeout=ATLAS_CRAWL_TIMEOUT )
+        except Exception, e:
+            log.exception(e)
+            inv_res = {'error': 'Failed to contact {}'.format(hostport)}
+
+        if 'error' in inv_res:
+            log.debug("Failed to get zonefile inventory of {}: {}".format(hostport, inv_res['error']))
+            return {'hostport': hostport, 'error': inv_res['error']}
+
+        inv = inv_res['inv']
+        if len(inv) > 0:
+            num_zonefiles += bin( int(binascii.hexlify(inv), 16) ).count('1')
+
+        inv_bits = bit_offset + len(inv) * 8
+        if len(inv) * 8 < ATLAS_INV_RANGE_BITS:
+            break
+
+    return {'hostport': hostport, 'latency': latency, 'num_zonefiles': num_zonefiles, 'inv_bits': inv_bits, 'peers': [str(p) for p in res['peers']]}
+
+
+def atlas_peer_rank_rows( rows ):
+    """
+    Rank peer table rows: peers that have at least ATLAS_PEER_MIN_COMPLETENESS
+    of the zonefiles the best peer has come first, fastest first; then the
+    rest, most complete first.  Peers whose last probe failed are left out.
+
+    Return the list of "host:port" strings, best first
+    """
+    rows = [row for row in rows if row['failures'] == 0 and row['num_zonefiles'] is not None]
+    if len(rows) == 0:
+        return []
+
+    most_zonefiles = max([row['num_zonefiles'] for row in rows])
+
+    def rank( row ):
+        completeness = float(row['num_zonefiles']) / most_zonefiles if most_zonefiles > 0 else 1.0
+        if completeness >= ATLAS_PEER_MIN_COMPLETENESS:
+            return (0, row['latency'])
+
+        return (1, -completeness)
+
+    return [row['hostport'] for row in sorted(rows, key=rank)]
+
+
+def atlas_get_ranked_peers( config_path=CONFIG_PATH, count=None ):
+    """
+    Get the best Atlas peers found by the last crawl (see atlas_crawl()).
+
+    Return up to @count "host:port" strings, best first.
+    Return [] if we have never crawled.
+    """
+    path = get_atlas_peers_path( config_path )
+    if not os.path.exists( path ):
+        return []
+
+    try:
+        con = atlasdb_open( path, sql=ATLAS_PEERS_SQL )
+        try:
+            peers = atlas_peer_rank_rows( atlas_peerdb_get_peers(con) )
+        finally:
+            con.close()
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to read Atlas peer table {}".format(path))
+        return []
+
+    if count is not None:
+        peers = peers[:count]
+
+    return peers
+
+
+def atlas_peer_note_failure( hostport, config_path=CONFIG_PATH ):
+    """
+    Record that a read from a peer in the peer table failed.
+    It won't be ranked again until the next crawl reaches it,
+    and is dropped after ATLAS_PEER_MAX_FAILURES failures in a row.
+    Return True on success
+    Return False on error
+    """
+    path = get_atlas_peers_path( config_path )
+    if not os.path.exists( path ):
+        return True
+
+    try:
+        con = atlasdb_open( path, sql=ATLAS_PEERS_SQL )
+        try:
+            con.execute( "UPDATE peers SET failures = failures + 1 WHERE hostport = ?;", (hostport,) )
+            con.execute( "DELETE FROM peers WHERE hostport = ? AND failures >= ?;", (hostport, ATLAS_PEER_MAX_FAILURES) )
+        finally:
+            con.close()
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to update Atlas peer table {}".format(path))
+        return False
+
+    return True
+
+
+def atlas_crawl( config_path=CONFIG_PATH, seeds=None, max_peers=None, fanout=None, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Walk the Atlas peer graph breadth-first, starting from @seeds (by default,
+    our Atlas node and every peer we already know).  Each level of the walk
+    is probed concurrently (see atlas_peer_probe()); from each reachable peer
+    we follow at most @fanout randomly-chosen new neighbors, and we probe at
+    most @max_peers peers in all.  The results go to the on-disk peer table.
+
+    Return {'status': True, 'probed': ..., 'reachable': ..., 'peers': [ranked "host:port" strings]} on success
+    """
+    conf = get_config( config_path )
+    if max_peers is None:
+        max_peers = int(conf.get('atlas_crawl_max_peers', DEFAULT_ATLAS_CRAWL_MAX_PEERS))
+
+    if fanout is None:
+        fanout = int(conf.get('atlas_crawl_fanout', DEFAULT_ATLAS_CRAWL_FANOUT))
+
+    con = atlasdb_open( get_atlas_peers_path(config_path), sql=ATLAS_PEERS_SQL )
+
+    try:
+        if seeds is None:
+            seeds = ['{}:{}'.format(conf['server'], conf['port'])] + [row['hostport'] for row in atlas_peerdb_get_peers(con)]
+
+        frontier = []
+        for hostport in seeds:
+            if hostport not in frontier:
+                frontier.append( hostport )
+
+        visited = set()
+        probes = []
+
+        while len(frontier) > 0 and len(visited) < max_peers:
+            batch = frontier[:max_peers - len(visited)]
+            visited.update( batch )
+
+            results = run_parallel( atlas_peer_probe, [(hostport,) for hostport in batch], max_workers=max_workers )
+
+            frontier = []
+            for hostport, probe in zip(batch, results):
+                if probe is None:
+                    probe = {'hostport': hostport, 'error': 'Probe failed'}
+
+                probes.append( probe )
+                if 'error' in probe:
+                    continue
+
+                neighbors = [p for p in probe['peers'] if p not in visited and p not in frontier]
+                random.shuffle( neighbors )
+                frontier += neighbors[:fanout]
+
+        atlas_peerdb_store_probes( con, probes )
+        ranked = atlas_peer_rank_rows( atlas_peerdb_get_peers(con) )
+
+    finally:
+        con.close()
+
+    num_reachable = len([probe for probe in probes if 'error' not in probe])
+    log.debug("Crawled {} Atlas peers ({} reachable)".format(len(probes), num_reachable))
+
+    return {'status': True, 'probed': len(probes), 'reachable': num_reachable, 'peers': ranked}
+
+
+def atlas_crawl_if_stale( config_path=CONFIG_PATH ):
+    """
+    Re-crawl the Atlas peer graph if the peer table is older than
+    the configured crawl interval.
+
+    Return the atlas_crawl() result if we crawled
+    Return None if the table is still fresh
+    """
+    conf = get_config( config_path )
+    crawl_interval = int(conf.get('atlas_crawl_interval', DEFAULT_ATLAS_CRAWL_INTERVAL))
+
+    path = get_atlas_peers_path( config_path )
+    if os.path.exists( path ):
+        con = atlasdb_open( path, sql=ATLAS_PEERS_SQL )
+        try:
+            last_crawl = atlas_peerdb_get_last_crawl( con )
+        finally:
+            con.close()
+
+        if last_crawl is not None and last_crawl + crawl_interval > time.time():
+            return None
+
+    return atlas_crawl( config_path=config_path )
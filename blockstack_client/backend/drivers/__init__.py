@@ -27,3 +27,4 @@ import s3
 import blockstack_resolver
 import blockstack_server
 import http
+import sqlite
@@ -28,6 +28,8 @@ import sys
 import traceback
 import logging
 import xmlrpclib
+import httplib
+import threading
 import json
 import re
 import base64
@@ -56,6 +58,49 @@ else:
 log = get_logger("blockstack-storage-driver-blockstack-server")
 log.setLevel(logging.DEBUG)
 
+SERVER_TIMEOUT = 30
+
+# max number of zonefiles the server will return in one request
+MAX_ZONEFILES_PER_REQUEST = 100
+
+# each thread keeps its own persistent connection to the server
+RPC_SESSIONS = threading.local()
+
+
+class PersistentTransport( xmlrpclib.Transport ):
+    """
+    XMLRPC transport that keeps its HTTP connection open
+    between requests (reconnecting if the server closed it),
+    and that times out.
+    """
+    def __init__(self, timeout=SERVER_TIMEOUT, **kw):
+        xmlrpclib.Transport.__init__(self, **kw)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        self._connection = host, httplib.HTTPConnection(chost, timeout=self.timeout)
+        return self._connection[1]
+
+
+def get_session():
+    """
+    Get this thread's connection to the server.
+    """
+    global RPC_SESSIONS, SERVER_NAME, SERVER_PORT, SERVER_TIMEOUT
+
+    url = "http://%s:%s/RPC2" % (SERVER_NAME, SERVER_PORT)
+    ses = getattr(RPC_SESSIONS, 'ses', None)
+    if ses is None or getattr(RPC_SESSIONS, 'url', None) != url:
+        ses = xmlrpclib.ServerProxy( url, transport=PersistentTransport(timeout=SERVER_TIMEOUT), allow_none=True )
+        RPC_SESSIONS.ses = ses
+        RPC_SESSIONS.url = url
+
+    return ses
+
 
 def is_zonefile_hash( data_id ):
     """
@@ -74,8 +119,7 @@ def get_data( data_id, zonefile=False ):
         log.debug("Do not get_data from ourselves")
         return None
 
-    url = "http://%s:%s/RPC2" % (SERVER_NAME, SERVER_PORT)
-    ses = xmlrpclib.ServerProxy( url, allow_none=True )
+    ses = get_session()
     
     if zonefile:
         log.debug("Get zonefile for %s" % data_id)
@@ -126,6 +170,60 @@ def get_data( data_id, zonefile=False ):
             return None
 
 
+def get_zonefiles( zonefile_hashes ):
+    """
+    Get many zonefiles from the server by hash, in as few requests as possible.
+    A batch that fails does not lose the batches that succeeded.
+    Return {'zonefiles': {zonefile hash: zonefile}, 'failed': [zonefile hash]}, where
+    'zonefiles' has each zonefile the server had (the caller must verify them),
+    and 'failed' lists the hashes whose batch could not be fetched (so the server
+    may still have them)
+    Return None on error
+    """
+
+    if os.environ.get("BLOCKSTACK_RPC_PID", None) == str(os.getpid()):
+        # don't talk to ourselves 
+        log.debug("Do not get_zonefiles from ourselves")
+        return None
+
+    ses = get_session()
+    zonefiles = {}
+    failed = []
+
+    for i in xrange(0, len(zonefile_hashes), MAX_ZONEFILES_PER_REQUEST):
+        batch = zonefile_hashes[i:i+MAX_ZONEFILES_PER_REQUEST]
+        log.debug("Get %s zonefile(s)" % len(batch))
+
+        try:
+            res = ses.get_zonefiles( batch )
+            data = json.loads(res)
+        except Exception, e:
+            log.exception(e)
+            log.error("Failed to get zonefiles")
+            failed += batch
+            continue
+
+        if type(data) != dict or 'error' in data:
+            log.error("Get zonefiles: %s" % data)
+            failed += batch
+            continue
+
+        try:
+            batch_zonefiles = {}
+            for zonefile_hash, zonefile_b64 in data['zonefiles'].items():
+                batch_zonefiles[str(zonefile_hash)] = base64.b64decode( zonefile_b64 )
+
+        except Exception, e:
+            log.exception(e)
+            log.error("Failed to parse zonefiles")
+            failed += batch
+            continue
+
+        zonefiles.update( batch_zonefiles )
+
+    return {'zonefiles': zonefiles, 'failed': failed}
+
+
 def put_data( data_id, data_txt, zonefile=False, fqu=None ):
     """
     Put data or a zonefile to the server.
@@ -138,8 +236,7 @@ def put_data( data_id, data_txt, zonefile=False, fqu=None ):
         log.debug("Do not put_data to ourselves")
         return False
 
-    url = "http://%s:%s/RPC2" % (SERVER_NAME, SERVER_PORT)
-    ses = xmlrpclib.ServerProxy( url, allow_none=True )
+    ses = get_session()
 
     if zonefile:
         # must be a zonefile 
@@ -205,7 +302,7 @@ def put_data( data_id, data_txt, zonefile=False, fqu=None ):
 
 def storage_init(conf):
     # read config options from the config file, if given 
-    global SERVER_NAME, SERVER_PORT
+    global SERVER_NAME, SERVER_PORT, SERVER_TIMEOUT
 
     config_path = conf['path']
     if os.path.exists( config_path ):
@@ -225,6 +322,9 @@ def storage_init(conf):
                 
             if parser.has_option('blockstack-server-storage', 'port'):
                 SERVER_PORT = int(parser.get('blockstack-server-storage', 'port'))
+
+            if parser.has_option('blockstack-server-storage', 'timeout'):
+                SERVER_TIMEOUT = float(parser.get('blockstack-server-storage', 'timeout'))
            
     else:
         raise Exception("No such file or directory: %s" % config_path)
@@ -260,6 +360,27 @@ def get_immutable_handler( key, **kw ):
     return get_data( fqu, zonefile=zonefile )
 
 
+def get_immutable_batch_handler( keys, **kw ):
+    """
+    Batched version of get_immutable_handler, for zonefile hashes.
+    If @failed is given, the keys that could not be looked up
+    (as opposed to not found) are appended to it.
+    Return {key: data} for the keys found
+    Return None on error
+    """
+    if not kw.get("zonefile", False):
+        return None
+
+    res = get_zonefiles( [key for key in keys if is_zonefile_hash(key)] )
+    if res is None:
+        return None
+
+    if kw.get("failed", None) is not None:
+        kw["failed"].extend( res['failed'] )
+
+    return res['zonefiles']
+
+
 def get_mutable_handler( url, **kw ):
     parts = url.split("#")
     if len(parts) != 2:
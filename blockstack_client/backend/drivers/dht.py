@@ -27,8 +27,13 @@ import traceback
 
 import types
 import re
+import hashlib
 import pybitcoin
 import socket
+import threading
+import time
+import Queue
+from ConfigParser import SafeConfigParser
 from basicrpc import Proxy
 
 """ this module contains the plugin to blockstack that makes the DHT useful as
@@ -46,6 +51,23 @@ DEFAULT_DHT_SERVERS = [('dht.blockstack.org', DHT_SERVER_PORT),
 
 DEFAULT_MIRROR = 'mirror.blockstack.org'
 
+# DHT nodes and/or mirrors to talk to.  Reads go to all of them at once,
+# and the first valid reply wins.  Writes go to all of them at once.
+# Set with the 'servers' option in the [dht] section, as host:port,host:port,...
+#
+# For mutable data, "valid" only means "non-empty": this driver can't check
+# signatures, so it can't tell which of several replies is the newest one.
+# Picking the reply with the newest (unverified) timestamp would let a single
+# bad endpoint shadow the honest ones, so the first reply wins, and the caller
+# verifies it.  Writes go to every endpoint, which keeps stale replies rare.
+DHT_ENDPOINTS = [(DEFAULT_MIRROR, MIRROR_TCP_PORT)]
+
+# idle connections kept per endpoint
+DHT_POOL_SIZE = 4
+
+# how long to wait for replies, in seconds
+DHT_TIMEOUT = 30
+
 # 3 years
 STORAGE_TTL = 3 * 60 * 60 * 24 * 365
 
@@ -67,6 +89,11 @@ def hostname_to_ip(servers):
 # client to the DHT
 dht_server = None
 
+# idle clients, per endpoint.  A client is used by one thread at a time:
+# it is taken out of the pool for a request, and put back afterwards.
+dht_client_pool = {}
+dht_client_pool_lock = threading.Lock()
+
 
 def dht_data_hash(data):
     """
@@ -75,6 +102,18 @@ def dht_data_hash(data):
     return pybitcoin.hash.hex_hash160(data)
 
 
+def dht_is_valid_data(data_key, data):
+    """
+    Does the data match its key?
+    Immutable data is keyed by either its sha256 or its hash160.
+    """
+    if type(data) not in [str, unicode]:
+        return False
+
+    data = str(data)
+    return data_key in [dht_data_hash(data), hashlib.sha256(data).hexdigest()]
+
+
 def dht_init(local_server=False):
     """
     Establish our connection to the DHT, and give
@@ -92,43 +131,147 @@ def dht_init(local_server=False):
     return True
 
 
-def get_dht_client(local_server=False):
+def get_dht_client(local_server=False, endpoint=None):
     """
-    Get a new connection to DHT
+    Get a connection to the DHT.
+    Connections are pooled: reuse an idle one to the endpoint if there is one.
+    Hand it back with put_dht_client() when done.
     """
-    if local_server:
-        return Proxy(DEFAULT_DHT_SERVERS[0], DHT_SERVER_PORT)
-    else:
-        return Proxy(DEFAULT_MIRROR, MIRROR_TCP_PORT)
+    global dht_client_pool, dht_client_pool_lock
+
+    if endpoint is None:
+        if local_server:
+            endpoint = (DEFAULT_DHT_SERVERS[0][0], DHT_SERVER_PORT)
+        else:
+            endpoint = DHT_ENDPOINTS[0]
+
+    with dht_client_pool_lock:
+        idle = dht_client_pool.get(endpoint, [])
+        if len(idle) > 0:
+            return idle.pop()
+
+    return Proxy(endpoint[0], endpoint[1])
 
 
-def dht_get_key(data_key):
+def put_dht_client(endpoint, dht_client):
     """
-    Given a key (a hash of data), go fetch the data.
+    Return a connection to the pool, once its request has succeeded.
+    (Connections that failed are just dropped, so the next request reconnects.)
     """
+    global dht_client_pool, dht_client_pool_lock
+
+    with dht_client_pool_lock:
+        idle = dht_client_pool.setdefault(endpoint, [])
+        if len(idle) < DHT_POOL_SIZE:
+            idle.append(dht_client)
 
-    dht_client = get_dht_client()
 
+def dht_endpoint_get(endpoint, data_key):
+    """
+    Get a key from one endpoint.
+    Return the value, or None if not found.
+    """
+    dht_client = get_dht_client(endpoint=endpoint)
     ret = dht_client.get(data_key)
+    put_dht_client(endpoint, dht_client)
+
     if ret is not None:
         if type(ret) == types.ListType:
+            if len(ret) == 0:
+                return None
+
             ret = ret[0]
 
         if type(ret) == types.DictType and ret.has_key("value"):
             ret = ret["value"]
-    
-    else:
-        raise Exception("No data returned from %s" % data_key)
 
     return ret
 
 
+def dht_endpoint_put(endpoint, data_key, data_value):
+    """
+    Put a key/value pair to one endpoint.
+    """
+    dht_client = get_dht_client(endpoint=endpoint)
+    ret = dht_client.set(data_key, data_value)
+    put_dht_client(endpoint, dht_client)
+    return ret
+
+
+def dht_get_key(data_key, validate=True):
+    """
+    Given a key (a hash of data), go fetch the data.
+    Ask every endpoint at once, and return the first reply
+    (that matches the key, if @validate is True) that arrives
+    within DHT_TIMEOUT seconds.
+    """
+
+    endpoints = DHT_ENDPOINTS[:]
+    replies = Queue.Queue()
+
+    def getter(endpoint):
+        try:
+            replies.put( (endpoint, dht_endpoint_get(endpoint, data_key)) )
+        except Exception, e:
+            traceback.print_exc()
+            replies.put( (endpoint, None) )
+
+    for endpoint in endpoints:
+        t = threading.Thread(target=getter, args=(endpoint,))
+        t.daemon = True
+        t.start()
+
+    deadline = time.time() + DHT_TIMEOUT
+    for i in xrange(0, len(endpoints)):
+        try:
+            endpoint, ret = replies.get(timeout=max(0, deadline - time.time()))
+        except Queue.Empty:
+            break
+
+        if ret is None:
+            continue
+
+        if validate and not dht_is_valid_data(data_key, ret):
+            print >> sys.stderr, "Invalid data for %s from %s:%s" % (data_key, endpoint[0], endpoint[1])
+            continue
+
+        return ret
+
+    raise Exception("No data returned from %s" % data_key)
+
+
 def dht_put_data(data_key, data_value):
     """
     Given a key and value, put it into the DHT.
+    Send it to every endpoint at once, and wait up to DHT_TIMEOUT
+    seconds for them.
+    Return True if at least one endpoint accepted it.
     """
-    dht_client = get_dht_client()
-    return dht_client.set(data_key, data_value)
+
+    endpoints = DHT_ENDPOINTS[:]
+    results = [None] * len(endpoints)
+
+    def putter(i):
+        try:
+            results[i] = dht_endpoint_put(endpoints[i], data_key, data_value)
+        except Exception, e:
+            traceback.print_exc()
+            results[i] = None
+
+    threads = [threading.Thread(target=putter, args=(i,)) for i in xrange(0, len(endpoints))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    deadline = time.time() + DHT_TIMEOUT
+    for t in threads:
+        t.join(max(0, deadline - time.time()))
+
+    for rc in results:
+        if rc:
+            return rc
+
+    return False
 
 
 # ---------------------------------------------------------
@@ -142,6 +285,41 @@ def storage_init(conf):
     Return True on success
     Return False on error
     """
+    global DHT_ENDPOINTS, DHT_TIMEOUT, DHT_POOL_SIZE
+
+    config_path = conf.get('path', None)
+    if config_path is not None and os.path.exists(config_path):
+
+        parser = SafeConfigParser()
+
+        try:
+            parser.read(config_path)
+        except Exception, e:
+            traceback.print_exc()
+            return False
+
+        if parser.has_section('dht'):
+
+            if parser.has_option('dht', 'servers'):
+                endpoints = []
+                try:
+                    for hostport in parser.get('dht', 'servers').split(","):
+                        host, port = hostport.strip().rsplit(":", 1)
+                        endpoints.append((host, int(port)))
+
+                    assert len(endpoints) > 0
+                except Exception, e:
+                    print >> sys.stderr, "Config file '%s': invalid 'servers' in section 'dht' (expected host:port,host:port,...)" % config_path
+                    return False
+
+                DHT_ENDPOINTS = endpoints
+
+            if parser.has_option('dht', 'timeout'):
+                DHT_TIMEOUT = float(parser.get('dht', 'timeout'))
+
+            if parser.has_option('dht', 'pool_size'):
+                DHT_POOL_SIZE = max(0, int(parser.get('dht', 'pool_size')))
+
     return dht_init()
 
 
@@ -180,7 +358,9 @@ def get_mutable_handler(data_id, **kw):
     Return the data if found.
     Return None if not.
     """
-    return dht_get_key(dht_data_hash(data_id))
+    # mutable data can't be checked against its key; the caller verifies its signature.
+    # the first non-empty reply wins (see DHT_ENDPOINTS).
+    return dht_get_key(dht_data_hash(data_id), validate=False)
 
 
 def put_immutable_handler(key, data, txid, **kw):
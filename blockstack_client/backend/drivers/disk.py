@@ -28,6 +28,11 @@ import os
 import sys 
 import traceback
 import logging
+import hashlib
+import tempfile
+import threading
+import time
+from ConfigParser import SafeConfigParser
 from common import get_logger, DEBUG
 
 log = get_logger("blockstack-storage-driver-disk")
@@ -40,8 +45,345 @@ else:
 IMMUTABLE_STORAGE_ROOT = DISK_ROOT + "/immutable"
 MUTABLE_STORAGE_ROOT = DISK_ROOT + "/mutable"
 
+# Objects are stored in two levels of subdirectories named after
+# the hash of their names (e.g. immutable/ab/cd/<key>), so no one
+# directory gets too big.  Objects written by older versions of this
+# driver sit directly in the storage roots; they are still readable,
+# and can be moved into place with `disk.py migrate`.
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+# how to make writes durable (from the [disk] section):
+# * "none": atomic rename, but leave flushing to the OS
+# * "always": fsync each object and its directory before returning
+# * "group": sync concurrent writes together, in a background thread.
+#   A batch is started as soon as a write is waiting; with a nonzero
+#   FSYNC_GROUP_INTERVAL, it waits that many seconds for more writes to join.
+FSYNC_MODE = "none"
+FSYNC_GROUP_INTERVAL = 0.0
+GROUP_COMMITTER = None
+
+TEMPFILE_PREFIX = ".tmp-"
+
 log.setLevel( logging.DEBUG if DEBUG else logging.INFO )
 
+
+class GroupCommitter( threading.Thread ):
+   """
+   Background thread that makes batches of writes durable at once.
+   Writers hand it a written-but-not-synced temporary file and its final path,
+   and block until it has been synced and renamed into place.
+
+   Where syncfs(2) is available, a batch costs two syncfs calls per filesystem
+   (one to flush the temporary files' data before they are renamed, one to
+   flush the renames), however many files are in it.  Otherwise, each file is
+   fsync'ed on its own, and each directory once per batch.
+
+   Writes that arrive while a batch is being synced make up the next batch.
+   """
+
+   def __init__(self, interval):
+      super( GroupCommitter, self ).__init__()
+      self.daemon = True
+      self.interval = interval
+      self.lock = threading.Lock()
+      self.cond = threading.Condition( self.lock )
+      self.pending = []
+      self.results = {}
+      self.syncfs = get_syncfs()
+
+   def commit( self, tmppath, path ):
+      """
+      Make tmppath durable and rename it to path.
+      Return True on success
+      Return False on error
+      """
+      with self.lock:
+         self.pending.append( (tmppath, path) )
+         self.cond.notify_all()
+         while not self.results.has_key( tmppath ):
+            self.cond.wait()
+
+         return self.results.pop( tmppath )
+
+   def sync_batch( self, batch ):
+      """
+      Sync and rename a batch of files with syncfs(2).
+      Return {tmppath: True/False}
+      """
+      results = {}
+      dirs = {}   # device: directory
+      for (tmppath, path) in batch:
+         d = os.path.dirname(path)
+         try:
+            dirs[ os.stat(d).st_dev ] = d
+         except Exception, e:
+            log.exception(e)
+
+      if not all( syncfs_dir( self.syncfs, d ) for d in dirs.values() ):
+         return dict( [(tmppath, False) for (tmppath, path) in batch] )
+
+      for (tmppath, path) in batch:
+         try:
+            os.rename( tmppath, path )
+            results[tmppath] = True
+         except Exception, e:
+            log.exception(e)
+            results[tmppath] = False
+
+      if not all( syncfs_dir( self.syncfs, d ) for d in dirs.values() ):
+         return dict( [(tmppath, False) for (tmppath, path) in batch] )
+
+      return results
+
+   def fsync_batch( self, batch ):
+      """
+      Sync and rename a batch of files, one fsync at a time.
+      Return {tmppath: True/False}
+      """
+      results = {}
+      dirs = set()
+      for (tmppath, path) in batch:
+         try:
+            fd = os.open( tmppath, os.O_RDONLY )
+            try:
+               os.fsync( fd )
+            finally:
+               os.close( fd )
+
+            os.rename( tmppath, path )
+            dirs.add( os.path.dirname(path) )
+            results[tmppath] = True
+
+         except Exception, e:
+            log.exception(e)
+            results[tmppath] = False
+
+      for d in dirs:
+         fsync_dir( d )
+
+      return results
+
+   def run(self):
+      while True:
+         with self.lock:
+            while len(self.pending) == 0:
+               self.cond.wait()
+
+         if self.interval > 0:
+            # let other writers join this batch
+            time.sleep( self.interval )
+
+         with self.lock:
+            batch = self.pending
+            self.pending = []
+
+         if self.syncfs is not None:
+            results = self.sync_batch( batch )
+         else:
+            results = self.fsync_batch( batch )
+
+         with self.lock:
+            self.results.update( results )
+            self.cond.notify_all()
+
+
+def get_syncfs():
+   """
+   Get libc's syncfs(2), if this platform has it.
+   Return the function on success
+   Return None if not
+   """
+   try:
+      import ctypes
+      import ctypes.util
+
+      libc = ctypes.CDLL( ctypes.util.find_library("c"), use_errno=True )
+      return libc.syncfs
+   except Exception, e:
+      if DEBUG:
+         log.debug("No syncfs(2); falling back to fsync(2)")
+
+      return None
+
+
+def syncfs_dir( syncfs, dirpath ):
+   """
+   Flush the whole filesystem that holds a directory.
+   Return True on success
+   Return False on error
+   """
+   try:
+      fd = os.open( dirpath, os.O_RDONLY )
+      try:
+         if syncfs( fd ) != 0:
+            log.error("syncfs(%s) failed" % dirpath)
+            return False
+
+      finally:
+         os.close( fd )
+
+      return True
+
+   except Exception, e:
+      log.exception(e)
+      return False
+
+
+def fsync_dir( dirpath ):
+   """
+   fsync a directory, so renames into it are durable.
+   """
+   try:
+      fd = os.open( dirpath, os.O_RDONLY )
+      try:
+         os.fsync( fd )
+      finally:
+         os.close( fd )
+
+   except Exception, e:
+      if DEBUG:
+         log.exception(e)
+
+
+def get_shard_path( root, name ):
+   """
+   Get the path to an object in the sharded layout.
+   """
+   h = hashlib.sha256( name ).hexdigest()
+   shards = [h[i*SHARD_WIDTH:(i+1)*SHARD_WIDTH] for i in xrange(0, SHARD_DEPTH)]
+   return os.path.join( root, *(shards + [name]) )
+
+
+def get_object_path( root, name ):
+   """
+   Find an object on disk: in the sharded layout, or failing that,
+   in the flat layout used by older versions of this driver.
+   Return the path if it exists
+   Return None if not
+   """
+   path = get_shard_path( root, name )
+   if os.path.exists( path ):
+      return path
+
+   path = os.path.join( root, name )
+   if os.path.isfile( path ):
+      return path
+
+   if DEBUG:
+      log.debug("No such file or directory: '%s'" % get_shard_path( root, name ))
+
+   return None
+
+
+def write_object( root, name, data ):
+   """
+   Atomically store an object to its sharded path:
+   write it to a temporary file in the same directory, and rename it into place.
+   Return True on success
+   Return False on error
+   """
+
+   global FSYNC_MODE, GROUP_COMMITTER
+
+   path = get_shard_path( root, name )
+   pathdir = os.path.dirname(path)
+
+   if not os.path.exists(pathdir):
+       try:
+           os.makedirs(pathdir, 0700)
+       except Exception, e:
+           if not os.path.isdir(pathdir):
+               if DEBUG:
+                   log.exception(e)
+               return False
+
+   tmppath = None
+   try:
+      fd, tmppath = tempfile.mkstemp( prefix=TEMPFILE_PREFIX, dir=pathdir )
+      with os.fdopen( fd, "w" ) as f:
+         f.write( data )
+         f.flush()
+         if FSYNC_MODE == "always":
+            os.fsync( f.fileno() )
+
+      if FSYNC_MODE == "group" and GROUP_COMMITTER is not None:
+         rc = GROUP_COMMITTER.commit( tmppath, path )
+         if not rc:
+            raise Exception("Failed to commit '%s'" % path)
+
+      else:
+         os.rename( tmppath, path )
+         if FSYNC_MODE == "always":
+            fsync_dir( pathdir )
+
+      # superseded
+      legacy_path = os.path.join( root, name )
+      if os.path.isfile( legacy_path ):
+         os.unlink( legacy_path )
+
+      if DEBUG:
+         log.debug("Stored to '%s'" % path)
+
+   except Exception, e:
+      if DEBUG:
+         log.exception(e)
+
+      if tmppath is not None and os.path.exists(tmppath):
+         try:
+            os.unlink( tmppath )
+         except:
+            pass
+
+      return False
+
+   return True
+
+
+def delete_object( root, name ):
+   """
+   Remove an object from both the sharded and the flat layouts.
+   """
+   for path in [get_shard_path( root, name ), os.path.join( root, name )]:
+      try:
+         os.unlink( path )
+      except Exception, e:
+         pass
+
+
+def migrate_flat_layout( root ):
+   """
+   Move objects stored directly in @root (i.e. by an older version
+   of this driver) into the sharded layout.  Safe to interrupt and re-run.
+   Return the number of objects moved
+   """
+   count = 0
+   for name in os.listdir( root ):
+      path = os.path.join( root, name )
+      if not os.path.isfile( path ):
+         continue
+
+      if name.startswith( TEMPFILE_PREFIX ):
+         # torn write from an older crash
+         continue
+
+      new_path = get_shard_path( root, name )
+      new_dir = os.path.dirname( new_path )
+      if not os.path.exists( new_dir ):
+         os.makedirs( new_dir, 0700 )
+
+      if os.path.exists( new_path ):
+         # already written in the new layout, which is newer
+         os.unlink( path )
+      else:
+         os.rename( path, new_path )
+
+      count += 1
+
+   fsync_dir( root )
+   return count
+
+
 def storage_init(conf):
    """
    Local disk implementation of the storage_init API call.
@@ -49,8 +391,30 @@ def storage_init(conf):
    Return True on success
    Return False on error 
    """
-   global DISK_ROOT, MUTABLE_STORAGE_ROOT, IMMUTABLE_STORAGE_ROOT
+   global DISK_ROOT, MUTABLE_STORAGE_ROOT, IMMUTABLE_STORAGE_ROOT, FSYNC_MODE, FSYNC_GROUP_INTERVAL, GROUP_COMMITTER
    
+   config_path = conf.get('path', None)
+   if config_path is not None and os.path.exists( config_path ):
+
+      parser = SafeConfigParser()
+
+      try:
+         parser.read(config_path)
+      except Exception, e:
+         log.exception(e)
+         return False
+
+      if parser.has_section('disk'):
+
+         if parser.has_option('disk', 'fsync'):
+            FSYNC_MODE = parser.get('disk', 'fsync')
+            if FSYNC_MODE not in ["none", "always", "group"]:
+               log.error("Config file '%s': section 'disk' has invalid 'fsync' (expected none, always, or group)" % config_path)
+               return False
+
+         if parser.has_option('disk', 'fsync_group_interval'):
+            FSYNC_GROUP_INTERVAL = float(parser.get('disk', 'fsync_group_interval'))
+
    if not os.path.isdir( DISK_ROOT ):
       os.makedirs( DISK_ROOT )
    
@@ -59,6 +423,10 @@ def storage_init(conf):
     
    if not os.path.isdir( IMMUTABLE_STORAGE_ROOT ):
       os.makedirs( IMMUTABLE_STORAGE_ROOT )
+
+   if FSYNC_MODE == "group" and GROUP_COMMITTER is None:
+      GROUP_COMMITTER = GroupCommitter( FSYNC_GROUP_INTERVAL )
+      GROUP_COMMITTER.start()
    
    return True 
 
@@ -97,12 +465,8 @@ def get_immutable_handler( key, **kw ):
    global IMMUTABLE_STORAGE_ROOT
    
    data = None 
-   path = os.path.join( IMMUTABLE_STORAGE_ROOT, key )
-
-   if not os.path.exists(path):
-       if DEBUG:
-           log.debug("No such file or directory: '%s'" % path)
-       
+   path = get_object_path( IMMUTABLE_STORAGE_ROOT, key )
+   if path is None:
        return None
    
    try:
@@ -117,6 +481,29 @@ def get_immutable_handler( key, **kw ):
       return None
 
 
+def get_immutable_stream_handler( key, **kw ):
+   """
+   Local disk implementation of the (optional) get_immutable_stream_handler API call.
+   Given the hash of the data, return a file-like object
+   from which the data can be read.
+   Return None if not found.
+   """
+
+   global IMMUTABLE_STORAGE_ROOT
+
+   path = get_object_path( IMMUTABLE_STORAGE_ROOT, key )
+   if path is None:
+       return None
+
+   try:
+      return open( path, "rb" )
+
+   except Exception, e:
+      if DEBUG:
+         traceback.print_exc()
+      return None
+
+
 def get_mutable_handler( url, **kw ):
    """
    Local disk implementation of the get_mutable_handler API call.
@@ -125,14 +512,22 @@ def get_mutable_handler( url, **kw ):
    Return None if not.
    """
    
+   global MUTABLE_STORAGE_ROOT
+
    if not url.startswith( "file://" ):
       # invalid
       return None 
    
    # get path from URL 
    path = url[ len("file://"): ]
-   
-   if not os.path.exists(path):
+
+   # URLs name the object's flat path; find where it really is
+   if os.path.dirname(path) == MUTABLE_STORAGE_ROOT:
+       path = get_object_path( MUTABLE_STORAGE_ROOT, os.path.basename(path) )
+       if path is None:
+           return None
+
+   elif not os.path.exists(path):
        if DEBUG:
            log.debug("No such file or directory: '%s'" % path)
 
@@ -159,32 +554,9 @@ def put_immutable_handler( key, data, txid, **kw ):
    Return True on success; False on failure.
    """
    
-   global IMMUTABLE_STORAGE_ROOT, DEBUG
-   
-   path = os.path.join( IMMUTABLE_STORAGE_ROOT, key )
-   pathdir = os.path.dirname(path)
-
-   if not os.path.exists(pathdir):
-       try:
-           os.makedirs(path_dir, 0700)
-       except Exception, e:
-           if DEBUG:
-               log.exception(e)
-           return False
-   
-   try:
-      with open( path, "w") as f:
-         f.write( data )
-         f.flush()
-
-      if DEBUG:
-         log.debug("Stored to '%s'" % path)
-   except Exception, e:
-      if DEBUG:
-         traceback.print_exc()
-      return False 
+   global IMMUTABLE_STORAGE_ROOT
    
-   return True 
+   return write_object( IMMUTABLE_STORAGE_ROOT, key, data )
 
 
 def put_mutable_handler( data_id, data_bin, **kw ):
@@ -193,35 +565,11 @@ def put_mutable_handler( data_id, data_bin, **kw ):
    Return True on success; False on failure.
    """
    
-   global MUTABLE_STORAGE_ROOT, DEBUG
+   global MUTABLE_STORAGE_ROOT
    
    # replace all /'s with \x2f's
    data_id_noslash = data_id.replace( "/", r"\x2f" )
-   path = os.path.join( MUTABLE_STORAGE_ROOT, data_id_noslash )
-   pathdir = os.path.dirname(path)
-
-   if not os.path.exists(pathdir):
-       try:
-           os.makedirs(path_dir, 0700)
-       except Exception, e:
-           if DEBUG:
-               log.exception(e)
-           return False
-
-   try:
-      with open( path, "w" ) as f:
-         f.write( data_bin )
-         f.flush()
-
-      if DEBUG:
-         log.debug("Stored to '%s'" % path)
-
-   except Exception, e:
-       if DEBUG:
-           log.exception(e)
-       return False
-   
-   return True 
+   return write_object( MUTABLE_STORAGE_ROOT, data_id_noslash, data_bin )
 
 
 def delete_immutable_handler( key, txid, sig_key_txid, **kw ):
@@ -234,13 +582,7 @@ def delete_immutable_handler( key, txid, sig_key_txid, **kw ):
    
    global IMMUTABLE_STORAGE_ROOT
    
-   path = os.path.join( IMMUTABLE_STORAGE_ROOT, key )
-   
-   try:
-      os.unlink( path )
-   except Exception, e:
-      pass
-   
+   delete_object( IMMUTABLE_STORAGE_ROOT, key )
    return True 
 
 
@@ -255,13 +597,7 @@ def delete_mutable_handler( data_id, signature, **kw ):
    global MUTABLE_STORAGE_ROOT
    
    data_id_noslash = data_id.replace( "/", r"\x2f" )
-   path = os.path.join( MUTABLE_STORAGE_ROOT, data_id_noslash )
-   
-   try:
-      os.unlink( path )
-   except Exception, e:
-      pass 
-   
+   delete_object( MUTABLE_STORAGE_ROOT, data_id_noslash )
    return True
    
    
@@ -277,6 +613,20 @@ if __name__ == "__main__":
    current_dir =  os.path.abspath(os.path.join( os.path.dirname(__file__), "..") )
    sys.path.insert(0, current_dir)
    
+   if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+      # convert a flat DISK_ROOT to the sharded layout, in place
+      if len(sys.argv) > 2:
+         DISK_ROOT = sys.argv[2]
+         IMMUTABLE_STORAGE_ROOT = DISK_ROOT + "/immutable"
+         MUTABLE_STORAGE_ROOT = DISK_ROOT + "/mutable"
+
+      for root in [IMMUTABLE_STORAGE_ROOT, MUTABLE_STORAGE_ROOT]:
+         if os.path.isdir( root ):
+            count = migrate_flat_layout( root )
+            print "Migrated %s object(s) in %s" % (count, root)
+
+      sys.exit(0)
+
    from storage import serialize_mutable_data, parse_mutable_data
    from user import make_mutable_data_info
 
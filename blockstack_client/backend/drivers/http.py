@@ -23,12 +23,517 @@
 
 import os
 import sys
+import re
+import json
+import hashlib
+import tempfile
+import threading
+import time
+from cStringIO import StringIO
 import requests
+from requests.adapters import HTTPAdapter
+from ConfigParser import SafeConfigParser
 from common import get_logger
 
 log = get_logger("blockstack-storage-drivers-http")
 
+HTTP_TIMEOUT = 30
+
+# keep-alive connection pool, shared by all threads
+HTTP_POOL_SIZE = 10
+HTTP_SESSION = None
+HTTP_SESSION_LOCK = threading.Lock()
+
+# conditional-GET cache: responses with an ETag or Last-Modified header
+# are kept here, and revalidated instead of re-downloaded.
+if os.environ.get("BLOCKSTACK_TEST", None) is not None:
+    HTTP_CACHE_DIR = "/tmp/blockstack-http-cache"
+else:
+    HTTP_CACHE_DIR = os.path.expanduser("~/.blockstack/http-cache")
+
+HTTP_CACHE = True
+
+# cached responses not used (or revalidated) in HTTP_CACHE_MAX_AGE seconds are dropped, and
+# once the cached bodies exceed HTTP_CACHE_MAX_SIZE bytes, the least-recently
+# used ones are evicted until the cache is back under HTTP_CACHE_LOW_WATER of it.
+HTTP_CACHE_MAX_AGE = 7 * 24 * 3600
+HTTP_CACHE_MAX_SIZE = 256 * 1024 * 1024
+HTTP_CACHE_LOW_WATER = 0.9
+HTTP_CACHE_USAGE = None     # bytes of cached bodies; None until first counted
+HTTP_CACHE_LOCK = threading.Lock()
+
+# objects bigger than one range (in bytes) are fetched with
+# up to HTTP_RANGE_PARALLELISM concurrent range requests.
+# set HTTP_RANGE_SIZE to 0 to disable.
+HTTP_RANGE_SIZE = 1024 * 1024
+HTTP_RANGE_PARALLELISM = 4
+
+
+def get_session():
+    """
+    Get the shared HTTP session
+    """
+    global HTTP_SESSION, HTTP_SESSION_LOCK, HTTP_POOL_SIZE
+
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION is None:
+            ses = requests.Session()
+            adapter = HTTPAdapter( pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE )
+            ses.mount( "http://", adapter )
+            ses.mount( "https://", adapter )
+            HTTP_SESSION = ses
+
+        return HTTP_SESSION
+
+
+def get_cache_paths( url ):
+    """
+    Get the paths to the cached response metadata and body for a URL
+    """
+    h = hashlib.sha256( url ).hexdigest()
+    return (os.path.join( HTTP_CACHE_DIR, h + ".json" ), os.path.join( HTTP_CACHE_DIR, h + ".data" ))
+
+
+def cache_remove( meta_path, data_path ):
+    """
+    Remove a cached response
+    """
+    global HTTP_CACHE_USAGE, HTTP_CACHE_LOCK
+
+    for path in [meta_path, data_path]:
+        try:
+            size = os.stat( path ).st_size
+            os.unlink( path )
+        except OSError:
+            continue
+
+        if path == data_path:
+            with HTTP_CACHE_LOCK:
+                if HTTP_CACHE_USAGE is not None:
+                    HTTP_CACHE_USAGE -= size
+
+
+def cache_evict():
+    """
+    Bring the cache back under its size limit by removing
+    the least-recently used responses, and drop expired ones.
+    Return the number of responses removed
+    """
+    global HTTP_CACHE_USAGE, HTTP_CACHE_LOCK
+
+    entries = []
+    now = time.time()
+    try:
+        names = os.listdir( HTTP_CACHE_DIR )
+    except OSError:
+        return 0
+
+    for name in names:
+        if not name.endswith(".data"):
+            continue
+
+        data_path = os.path.join( HTTP_CACHE_DIR, name )
+        meta_path = data_path[:-len(".data")] + ".json"
+        try:
+            st = os.stat( data_path )
+        except OSError:
+            continue
+
+        entries.append( (st.st_mtime, st.st_size, meta_path, data_path) )
+
+    total = sum( size for (mtime, size, meta_path, data_path) in entries )
+    limit = HTTP_CACHE_MAX_SIZE * HTTP_CACHE_LOW_WATER
+    removed = 0
+
+    # oldest (least-recently used) first
+    entries.sort()
+    for (mtime, size, meta_path, data_path) in entries:
+        if total <= limit and now - mtime <= HTTP_CACHE_MAX_AGE:
+            continue
+
+        cache_remove( meta_path, data_path )
+        total -= size
+        removed += 1
+
+    with HTTP_CACHE_LOCK:
+        HTTP_CACHE_USAGE = total
+
+    if removed > 0:
+        log.debug("Evicted %s cached responses" % removed)
+
+    return removed
+
+
+def cache_load( url ):
+    """
+    Load a cached response.
+    Return {'etag': ..., 'last_modified': ..., 'data': ...} on success
+    Return None if not cached
+    """
+    if not HTTP_CACHE:
+        return None
+
+    meta_path, data_path = get_cache_paths( url )
+    if not os.path.exists( meta_path ) or not os.path.exists( data_path ):
+        return None
+
+    try:
+        if time.time() - os.stat( data_path ).st_mtime > HTTP_CACHE_MAX_AGE:
+            cache_remove( meta_path, data_path )
+            return None
+
+        with open( meta_path, "r" ) as f:
+            meta = json.loads( f.read() )
+
+        if meta.get('url', None) != url:
+            return None
+
+        with open( data_path, "rb" ) as f:
+            meta['data'] = f.read()
+
+        return meta
+
+    except Exception, e:
+        log.exception(e)
+        return None
+
+
+def cache_touch( url ):
+    """
+    Mark a cached response as used (and fresh), after revalidating it
+    """
+    meta_path, data_path = get_cache_paths( url )
+    try:
+        os.utime( data_path, None )
+    except OSError:
+        pass
+
+
+def cache_store( url, headers, data ):
+    """
+    Cache a response, if it can be revalidated later.
+    Evict old responses if the cache is full.
+    Return True if cached
+    Return False if not
+    """
+    global HTTP_CACHE_USAGE, HTTP_CACHE_LOCK
+
+    if not HTTP_CACHE:
+        return False
+
+    if len(data) > HTTP_CACHE_MAX_SIZE * HTTP_CACHE_LOW_WATER:
+        return False
+
+    etag = headers.get('ETag', None)
+    last_modified = headers.get('Last-Modified', None)
+    if etag is None and last_modified is None:
+        return False
+
+    if 'no-store' in headers.get('Cache-Control', ''):
+        return False
+
+    meta_path, data_path = get_cache_paths( url )
+    meta = {
+        'url': url,
+        'etag': etag,
+        'last_modified': last_modified,
+    }
+
+    try:
+        if not os.path.isdir( HTTP_CACHE_DIR ):
+            os.makedirs( HTTP_CACHE_DIR, 0700 )
+
+        # write body first, and swap each file in atomically
+        for path, buf in [(data_path, data), (meta_path, json.dumps(meta))]:
+            fd, tmppath = tempfile.mkstemp( dir=HTTP_CACHE_DIR )
+            with os.fdopen( fd, "wb" ) as f:
+                f.write( buf )
+
+            os.rename( tmppath, path )
+
+    except Exception, e:
+        log.exception(e)
+        return False
+
+    with HTTP_CACHE_LOCK:
+        if HTTP_CACHE_USAGE is not None:
+            # may overcount a replaced response until the next eviction pass
+            HTTP_CACHE_USAGE += len(data)
+
+        evict = (HTTP_CACHE_USAGE is None or HTTP_CACHE_USAGE > HTTP_CACHE_MAX_SIZE)
+
+    if evict:
+        try:
+            cache_evict()
+        except Exception, e:
+            log.exception(e)
+
+    return True
+
+
+def is_encoded( req ):
+    """
+    Did the server send the body with a content-coding (i.e. gzip)?
+    Byte ranges of an encoded body are not byte ranges of the object.
+    """
+    return req.headers.get('Content-Encoding', 'identity').strip().lower() not in ['identity', '']
+
+
+def get_range( url, start, end, etag ):
+    """
+    Fetch bytes [start, end] of a URL, making sure it's still the same object.
+    Return the data on success
+    Return None on error
+    """
+    headers = {'Range': 'bytes=%s-%s' % (start, end), 'Accept-Encoding': 'identity'}
+    if etag is not None:
+        headers['If-Match'] = etag
+
+    try:
+        req = get_session().get( url, headers=headers, timeout=HTTP_TIMEOUT )
+        if req.status_code != 206:
+            log.debug("GET %s (range %s-%s) status code %s" % (url, start, end, req.status_code))
+            return None
+
+        if is_encoded( req ):
+            log.debug("GET %s (range %s-%s): encoded as '%s'" % (url, start, end, req.headers['Content-Encoding']))
+            return None
+
+        data = req.content
+        if len(data) != end - start + 1:
+            log.debug("GET %s (range %s-%s): short read" % (url, start, end))
+            return None
+
+        return data
+
+    except Exception, e:
+        log.exception(e)
+        return None
+
+
+def get_ranges( url, first_range, total_size, etag ):
+    """
+    Fetch the rest of an object in parallel, given its first range.
+    Return the whole object on success
+    Return None on error
+    """
+    ranges = []
+    for start in xrange( len(first_range), total_size, HTTP_RANGE_SIZE ):
+        ranges.append( (start, min(start + HTTP_RANGE_SIZE, total_size) - 1) )
+
+    parts = [None] * len(ranges)
+    next_range = [0]
+    lock = threading.Lock()
+
+    def fetcher():
+        while True:
+            with lock:
+                i = next_range[0]
+                next_range[0] += 1
+
+            if i >= len(ranges):
+                return
+
+            parts[i] = get_range( url, ranges[i][0], ranges[i][1], etag )
+            if parts[i] is None:
+                return
+
+    threads = [threading.Thread( target=fetcher ) for i in xrange(0, min(HTTP_RANGE_PARALLELISM, len(ranges)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    if None in parts:
+        return None
+
+    return first_range + "".join(parts)
+
+
+def get_url( url ):
+    """
+    GET a URL over the shared session.
+    * revalidate cached copies with If-None-Match/If-Modified-Since.
+    * fetch large objects with parallel range requests.
+    Return the data on success
+    Return None if the server says there's nothing there (or the fetch failed part-way)
+    Raise if the server can't be reached or answers with an error
+    """
+
+    headers = {}
+    cached = cache_load( url )
+    if cached is not None:
+        if cached.get('etag', None) is not None:
+            headers['If-None-Match'] = cached['etag']
+
+        if cached.get('last_modified', None) is not None:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    if HTTP_RANGE_SIZE > 0:
+        # ranges must be of the object itself, not of a compressed encoding of it
+        headers['Range'] = 'bytes=0-%s' % (HTTP_RANGE_SIZE - 1)
+        headers['Accept-Encoding'] = 'identity'
+
+    req = get_session().get( url, headers=headers, timeout=HTTP_TIMEOUT )
+    if req.status_code == 304 and cached is not None:
+        log.debug("GET %s: not modified" % url)
+        cache_touch( url )
+        return cached['data']
+
+    if req.status_code == 200:
+        # whole object (no range support, or not needed)
+        data = req.content
+        cache_store( url, req.headers, data )
+        return data
+
+    if req.status_code == 206 and is_encoded( req ):
+        # server ignored our Accept-Encoding; don't trust its offsets
+        log.debug("GET %s: ranged response encoded as '%s'; retrying whole object" % (url, req.headers['Content-Encoding']))
+        req = get_session().get( url, timeout=HTTP_TIMEOUT )
+        if req.status_code != 200:
+            log.debug("GET %s status code %s" % (url, req.status_code))
+            return None
+
+        data = req.content
+        cache_store( url, req.headers, data )
+        return data
+
+    if req.status_code == 206:
+        data = req.content
+        content_range = req.headers.get('Content-Range', '')
+        m = re.match( r"^bytes 0-([0-9]+)/([0-9]+)$", content_range.strip() )
+        if m is None:
+            log.debug("GET %s: unusable Content-Range '%s'" % (url, content_range))
+            return None
+
+        total_size = int(m.groups()[1])
+        if total_size > len(data):
+            data = get_ranges( url, data, total_size, req.headers.get('ETag', None) )
+            if data is None:
+                # object changed under us, or ranges failed.  get it all at once.
+                log.debug("GET %s: ranged fetch failed; retrying whole object" % url)
+                req = get_session().get( url, timeout=HTTP_TIMEOUT )
+                if req.status_code != 200:
+                    log.debug("GET %s status code %s" % (url, req.status_code))
+                    return None
+
+                data = req.content
+
+        cache_store( url, req.headers, data )
+        return data
+
+    if req.status_code in [404, 410]:
+        log.debug("GET %s status code %s" % (url, req.status_code))
+        return None
+
+    raise Exception("GET %s status code %s" % (url, req.status_code))
+
+
+class ResponseReader( object ):
+    """
+    File-like wrapper around a streamed response body
+    """
+
+    def __init__(self, req):
+        self.req = req
+
+    def read(self, numbytes=-1):
+        if numbytes is None or numbytes < 0:
+            numbytes = None
+
+        return self.req.raw.read( numbytes, decode_content=True )
+
+    def close(self):
+        self.req.close()
+
+
+def get_url_stream( url ):
+    """
+    GET a URL over the shared session, and stream the body
+    instead of loading it into RAM.  A cached copy is still
+    revalidated and used if it's current, but the streamed body
+    is not itself cached.
+    Return a file-like object on success
+    Return None if the server says there's nothing there
+    Raise if the server can't be reached or answers with an error
+    """
+
+    headers = {}
+    cached = cache_load( url )
+    if cached is not None:
+        if cached.get('etag', None) is not None:
+            headers['If-None-Match'] = cached['etag']
+
+        if cached.get('last_modified', None) is not None:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    req = get_session().get( url, headers=headers, timeout=HTTP_TIMEOUT, stream=True )
+    if req.status_code == 304 and cached is not None:
+        log.debug("GET %s: not modified" % url)
+        req.close()
+        cache_touch( url )
+        return StringIO( cached['data'] )
+
+    if req.status_code == 200:
+        return ResponseReader( req )
+
+    req.close()
+    if req.status_code in [404, 410]:
+        log.debug("GET %s status code %s" % (url, req.status_code))
+        return None
+
+    raise Exception("GET %s status code %s" % (url, req.status_code))
+
+
 def storage_init(conf):
+    """
+    HTTP implementation of the storage_init API call.
+    Read our settings, if given.
+    Return True on success
+    Return False on error
+    """
+    global HTTP_TIMEOUT, HTTP_POOL_SIZE, HTTP_CACHE_DIR, HTTP_CACHE, HTTP_CACHE_MAX_AGE, HTTP_CACHE_MAX_SIZE, \
+            HTTP_RANGE_SIZE, HTTP_RANGE_PARALLELISM
+
+    config_path = conf.get('path', None)
+    if config_path is not None and os.path.exists( config_path ):
+
+        parser = SafeConfigParser()
+
+        try:
+            parser.read(config_path)
+        except Exception, e:
+            log.exception(e)
+            return False
+
+        if parser.has_section('http'):
+
+            if parser.has_option('http', 'timeout'):
+                HTTP_TIMEOUT = float(parser.get('http', 'timeout'))
+
+            if parser.has_option('http', 'pool_size'):
+                HTTP_POOL_SIZE = max(1, int(parser.get('http', 'pool_size')))
+
+            if parser.has_option('http', 'cache'):
+                HTTP_CACHE = parser.get('http', 'cache').lower() in ['1', 'true', 'yes', 'on']
+
+            if parser.has_option('http', 'cache_dir'):
+                HTTP_CACHE_DIR = os.path.expanduser( parser.get('http', 'cache_dir') )
+
+            if parser.has_option('http', 'cache_max_age'):
+                HTTP_CACHE_MAX_AGE = max(0, int(parser.get('http', 'cache_max_age')))
+
+            if parser.has_option('http', 'cache_max_size'):
+                HTTP_CACHE_MAX_SIZE = max(0, int(parser.get('http', 'cache_max_size')))
+
+            if parser.has_option('http', 'range_size'):
+                HTTP_RANGE_SIZE = max(0, int(parser.get('http', 'range_size')))
+
+            if parser.has_option('http', 'range_parallelism'):
+                HTTP_RANGE_PARALLELISM = max(1, int(parser.get('http', 'range_parallelism')))
+
     return True
 
 def handles_url( url ):
@@ -42,16 +547,13 @@ def get_immutable_handler( key, **kw ):
 
 
 def get_mutable_handler( url, **kw ):
-    try:
-        req = requests.get(url)
-        if req.status_code != 200:
-            log.debug("GET %s status code %s" % (url, req.status_code))
-            return None
+    # errors propagate, so the caller can tell "not found" from "unreachable"
+    return get_url( url )
 
-        return req.content 
-    except Exception, e:
-        log.exception(e)
-        return None
+
+def get_url_stream_handler( url, **kw ):
+    # errors propagate, as with get_mutable_handler
+    return get_url_stream( url )
 
 
 def put_immutable_handler( key, data, txid, **kw ):
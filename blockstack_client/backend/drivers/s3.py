@@ -27,10 +27,15 @@ import os
 import boto
 import errno
 import zlib
+import bz2
 import time
+import threading
+import Queue
+from cStringIO import StringIO
 from ConfigParser import SafeConfigParser
 
 from boto.s3.key import Key
+from boto.s3.connection import OrdinaryCallingFormat
 
 import logging
 logging.getLogger('boto').setLevel(logging.CRITICAL)
@@ -45,51 +50,441 @@ AWS_BUCKET = None
 AWS_ACCESS_KEY_ID = None 
 AWS_SECRET_ACCESS_KEY = None
 
+# optional S3-compatible endpoint (e.g. a local stand-in for testing)
+S3_HOST = None
+S3_PORT = None
+S3_IS_SECURE = True
+
+# chunks at least this big (in bytes) are uploaded in parallel parts,
+# S3_MULTIPART_PART_SIZE bytes each (S3 requires at least 5MB), with at most
+# S3_MULTIPART_PARALLELISM parts in flight, each tried up to S3_MULTIPART_PART_RETRIES times.
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+S3_MULTIPART_PARALLELISM = 4
+S3_MULTIPART_PART_RETRIES = 3
+
+# process-wide connection and bucket cache.
+# the bucket is only re-fetched (and re-created) after a request fails.
+S3_CACHE_CONNECTIONS = True
+S3_CONNECTION = None
+S3_BUCKETS = {}
+S3_CACHE_LOCK = threading.Lock()
+
+# compression settings (from the [s3] section).
+# chunks smaller than S3_COMPRESSION_MIN_SIZE bytes, or that compression
+# would shrink by less than S3_COMPRESSION_MIN_SAVINGS (a fraction),
+# are stored uncompressed.
+S3_COMPRESSION = "zlib"
+S3_COMPRESSION_LEVEL = 6
+S3_COMPRESSION_MIN_SIZE = 256
+S3_COMPRESSION_MIN_SAVINGS = 0.05
+
+# chunks are prefixed with CHUNK_HEADER_MAGIC and a codec byte.
+# the magic byte's low nibble is not 8, so it can never begin a zlib
+# stream; chunks without it were written by older versions of this driver,
+# which always used zlib.
+CHUNK_HEADER_MAGIC = "\xb5"
+CHUNK_CODECS = {
+    "none": "n",
+    "zlib": "z",
+    "bz2": "b",
+}
+
+# valid compression levels for each codec
+CHUNK_CODEC_LEVELS = {
+    "zlib": (0, 9),
+    "bz2": (1, 9),
+}
+
 #-------------------------
 def compress_chunk( chunk_buf ):
     """
-    compress a chunk of data
+    compress a chunk of data, and prefix it with a header
+    that identifies the codec used.
     """
-    data = zlib.compress(chunk_buf, 9)
-    return data
+    global S3_COMPRESSION, S3_COMPRESSION_LEVEL, S3_COMPRESSION_MIN_SIZE, S3_COMPRESSION_MIN_SAVINGS
+
+    codec = S3_COMPRESSION
+    data = chunk_buf
+
+    if codec != "none" and len(chunk_buf) >= S3_COMPRESSION_MIN_SIZE:
+        if codec == "zlib":
+            data = zlib.compress(chunk_buf, S3_COMPRESSION_LEVEL)
+        elif codec == "bz2":
+            data = bz2.compress(chunk_buf, S3_COMPRESSION_LEVEL)
+
+        if len(data) > len(chunk_buf) * (1.0 - S3_COMPRESSION_MIN_SAVINGS):
+            # not worth it
+            codec = "none"
+            data = chunk_buf
+
+    else:
+        codec = "none"
+
+    return CHUNK_HEADER_MAGIC + CHUNK_CODECS[codec] + data
+
+#-------------------------
+def compress_chunk_stream( chunk_reader, part_size ):
+    """
+    compress a chunk of data incrementally as it is read from
+    @chunk_reader, with the same header and codec as compress_chunk().
+    Since the compressed size isn't known in advance, the chunk is
+    always compressed.
+
+    Yield the compressed data in pieces of @part_size bytes
+    (except for the last piece, which is never empty).
+    """
+    global S3_COMPRESSION, S3_COMPRESSION_LEVEL
+
+    codec = S3_COMPRESSION
+    compressor = None
+    if codec == "zlib":
+        compressor = zlib.compressobj(S3_COMPRESSION_LEVEL)
+    elif codec == "bz2":
+        compressor = bz2.BZ2Compressor(S3_COMPRESSION_LEVEL)
+
+    outbuf = [CHUNK_HEADER_MAGIC + CHUNK_CODECS[codec]]
+    outlen = len(outbuf[0])
+
+    while True:
+        inbuf = chunk_reader.read(part_size)
+        if len(inbuf) == 0:
+            break
+
+        if compressor is not None:
+            inbuf = compressor.compress(inbuf)
+
+        outbuf.append(inbuf)
+        outlen += len(inbuf)
+
+        while outlen >= part_size:
+            data = "".join(outbuf)
+            outbuf = [data[part_size:]]
+            outlen = len(outbuf[0])
+            yield data[:part_size]
+
+    if compressor is not None:
+        outbuf.append(compressor.flush())
+
+    data = "".join(outbuf)
+    while len(data) > part_size:
+        yield data[:part_size]
+        data = data[part_size:]
+
+    if len(data) > 0:
+        yield data
 
 #-------------------------
 def decompress_chunk( chunk_buf ):
     """
     decompress a chunk of data
     """
-    data = zlib.decompress(chunk_buf)
-    return data
+    if not chunk_buf.startswith(CHUNK_HEADER_MAGIC):
+        # legacy chunk
+        return zlib.decompress(chunk_buf)
+
+    codec_id = chunk_buf[len(CHUNK_HEADER_MAGIC):len(CHUNK_HEADER_MAGIC)+1]
+    data = chunk_buf[len(CHUNK_HEADER_MAGIC)+1:]
+
+    if codec_id == CHUNK_CODECS["none"]:
+        return data
+    elif codec_id == CHUNK_CODECS["zlib"]:
+        return zlib.decompress(data)
+    elif codec_id == CHUNK_CODECS["bz2"]:
+        return bz2.decompress(data)
+    else:
+        raise ValueError("Unknown chunk codec '%s'" % codec_id)
 
 #-------------------------
-def get_bucket( bucket_name ):
+class ChunkReader( object ):
     """
-    Get or create a reference to the given bucket.
-    
-    Return the bucket on success
-    Return None on error, and log an exception 
+    File-like object that decompresses a chunk as it is read
+    from an underlying stream (i.e. an open S3 key), so the
+    whole chunk never has to be held in RAM.
     """
-    
-    global AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
-    
+
+    READ_SIZE = 65536
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decompressor = None
+        self.header_read = False
+        self.buf = ""
+        self.eof = False
+
+    def read_header(self):
+        """
+        Read the chunk header and set up the decompressor
+        """
+        header = self.stream.read(len(CHUNK_HEADER_MAGIC) + 1)
+        self.header_read = True
+
+        if not header.startswith(CHUNK_HEADER_MAGIC):
+            # legacy chunk
+            self.decompressor = zlib.decompressobj()
+            self.buf = self.decompressor.decompress(header)
+            return
+
+        codec_id = header[len(CHUNK_HEADER_MAGIC):]
+        if codec_id == CHUNK_CODECS["none"]:
+            self.decompressor = None
+        elif codec_id == CHUNK_CODECS["zlib"]:
+            self.decompressor = zlib.decompressobj()
+        elif codec_id == CHUNK_CODECS["bz2"]:
+            self.decompressor = bz2.BZ2Decompressor()
+        else:
+            raise ValueError("Unknown chunk codec '%s'" % codec_id)
+
+    def fill(self):
+        """
+        Read and decompress the next piece of the stream.
+        Return "" at EOF
+        """
+        data = self.stream.read(self.READ_SIZE)
+        if len(data) == 0:
+            self.eof = True
+            if hasattr(self.decompressor, "flush"):
+                return self.decompressor.flush()
+
+            return ""
+
+        if self.decompressor is not None:
+            return self.decompressor.decompress(data)
+
+        return data
+
+    def read(self, numbytes=-1):
+        if not self.header_read:
+            self.read_header()
+
+        parts = [self.buf]
+        buflen = len(self.buf)
+        while not self.eof and (numbytes is None or numbytes < 0 or buflen < numbytes):
+            data = self.fill()
+            parts.append(data)
+            buflen += len(data)
+
+        data = "".join(parts)
+        if numbytes is None or numbytes < 0:
+            self.buf = ""
+            return data
+
+        self.buf = data[numbytes:]
+        return data[:numbytes]
+
+    def close(self):
+        if hasattr(self.stream, "close"):
+            self.stream.close()
+
+#-------------------------
+def connect_s3():
+    """
+    Open a new connection to S3 (or the configured S3-compatible endpoint).
+
+    Return the connection on success
+    Return None on error, and log an exception
+    """
+
+    global AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_HOST, S3_PORT, S3_IS_SECURE
+
     aws_id = AWS_ACCESS_KEY_ID
     aws_key = AWS_SECRET_ACCESS_KEY
-    
+
+    kw = {}
+    if S3_HOST is not None:
+        kw['host'] = S3_HOST
+        kw['is_secure'] = S3_IS_SECURE
+        kw['calling_format'] = OrdinaryCallingFormat()
+
+        if S3_PORT is not None:
+            kw['port'] = S3_PORT
+
     try:
-        conn = boto.connect_s3(aws_id, aws_key)
+        conn = boto.connect_s3(aws_id, aws_key, **kw)
     except Exception, e:
         log.error("Connection to S3 failed")
         log.exception(e)
         return None
-        
-    bucket = None
+
+    return conn
+
+#-------------------------
+def get_bucket( bucket_name, refresh=False ):
+    """
+    Get or create a reference to the given bucket.
+    The connection and bucket are cached, and shared by all threads.
+    If @refresh is True, then reconnect and re-fetch the bucket
+    (i.e. because a request with the cached one failed).
+    
+    Return the bucket on success
+    Return None on error, and log an exception 
+    """
+
+    global S3_CACHE_CONNECTIONS, S3_CONNECTION, S3_BUCKETS, S3_CACHE_LOCK
+
+    if not S3_CACHE_CONNECTIONS:
+        conn = connect_s3()
+        if conn is None:
+            return None
+
+        bucket = None
+        try:
+            bucket = conn.create_bucket(bucket_name)
+        except Exception, e:
+            log.error("Could not create/fetch bucket " + bucket_name)
+            log.exception(e)
+
+        return bucket
+
+    with S3_CACHE_LOCK:
+        if not refresh and S3_BUCKETS.has_key(bucket_name):
+            return S3_BUCKETS[bucket_name]
+
+        if refresh or S3_CONNECTION is None:
+            S3_BUCKETS = {}
+            S3_CONNECTION = connect_s3()
+            if S3_CONNECTION is None:
+                return None
+
+        bucket = None
+        try:
+            bucket = S3_CONNECTION.create_bucket(bucket_name)
+        except Exception, e:
+            log.error("Could not create/fetch bucket " + bucket_name)
+            log.exception(e)
+            return None
+
+        S3_BUCKETS[bucket_name] = bucket
+        return bucket
+
+#-------------------------
+def is_missing_key( e ):
+    """
+    Did an S3 request fail only because the key does not exist?
+    (i.e. the connection and bucket are fine)
+    """
+    return getattr(e, 'status', None) == 404 and getattr(e, 'error_code', None) == 'NoSuchKey'
+
+#-------------------------
+def upload_part( mp, part_num, part_buf ):
+    """
+    Upload one part of a multipart upload, retrying on failure.
+
+    Return True on success
+    Return False if all attempts failed
+    """
+
+    global S3_MULTIPART_PART_RETRIES
+
+    for i in xrange(0, S3_MULTIPART_PART_RETRIES):
+        try:
+            mp.upload_part_from_file( StringIO(part_buf), part_num )
+            return True
+
+        except Exception, e:
+            log.error("Failed to upload part %s of '%s' (attempt %s of %s)" % (part_num, mp.key_name, i+1, S3_MULTIPART_PART_RETRIES))
+            log.exception(e)
+            time.sleep( 0.5 * 2**i )
+
+    return False
+
+#-------------------------
+def write_chunk_multipart( chunk_path, chunk_reader ):
+    """
+    Write a large chunk of data to S3 as a multipart upload.
+    The chunk is read from @chunk_reader and compressed as it
+    is uploaded, and parts are sent in parallel; at most
+    S3_MULTIPART_PARALLELISM compressed parts are held in RAM at once.
+
+    Return True on success
+    Return False on error, and log an exception
+    """
+
+    global AWS_BUCKET, S3_MULTIPART_PART_SIZE, S3_MULTIPART_PARALLELISM
+
+    mp = None
+    for refresh in [False, True]:
+
+        bucket = get_bucket( AWS_BUCKET, refresh=refresh )
+        if bucket == None:
+            log.error("Failed to get bucket '%s'" % AWS_BUCKET )
+            continue
+
+        try:
+            mp = bucket.initiate_multipart_upload( chunk_path )
+            break
+        except Exception, e:
+            log.error("Failed to start multipart upload of '%s'" % chunk_path)
+            log.exception(e)
+
+    if mp is None:
+        return False
+
+    parts = Queue.Queue( S3_MULTIPART_PARALLELISM )
+    failed = threading.Event()
+
+    def part_uploader():
+        while True:
+            part = parts.get()
+            if part is None:
+                return
+
+            if failed.is_set():
+                # drain
+                continue
+
+            part_num, part_buf = part
+            if not upload_part( mp, part_num, part_buf ):
+                failed.set()
+
+    threads = [threading.Thread(target=part_uploader) for i in xrange(0, S3_MULTIPART_PARALLELISM)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    begin = time.time()
+    size = 0
+    part_num = 1
     try:
-        bucket = conn.create_bucket(bucket_name)
+        for part_buf in compress_chunk_stream( chunk_reader, S3_MULTIPART_PART_SIZE ):
+            if failed.is_set():
+                break
+
+            size += len(part_buf)
+            parts.put( (part_num, part_buf) )
+            part_num += 1
+
     except Exception, e:
-        log.error("Could not create/fetch bucket " + bucket_name)
+        log.error("Failed to compress '%s'" % chunk_path)
         log.exception(e)
-        
-    return bucket
+        failed.set()
+
+    for t in threads:
+        parts.put(None)
+
+    for t in threads:
+        t.join()
+
+    rc = False
+    if not failed.is_set():
+        try:
+            mp.complete_upload()
+            rc = True
+        except Exception, e:
+            log.error("Failed to complete multipart upload of '%s'" % chunk_path)
+            log.exception(e)
+
+    if not rc:
+        try:
+            mp.cancel_upload()
+        except Exception, e:
+            log.error("Failed to cancel multipart upload of '%s'" % chunk_path)
+            log.exception(e)
+
+    if os.environ.get("BLOCKSTACK_TEST") == "1" and rc:
+        log.debug("[BENCHMARK] s3.write_chunk_multipart %s (%s parts): %s" % (size, part_num - 1, time.time() - begin))
+
+    return rc
 
 #-------------------------
 def write_chunk( chunk_path, chunk_buf ):
@@ -101,34 +496,41 @@ def write_chunk( chunk_path, chunk_buf ):
     """
 
     global AWS_BUCKET
-    
-    bucket = get_bucket( AWS_BUCKET )
-    if bucket == None:
-        log.error("Failed to get bucket '%s'" % AWS_BUCKET )
-        return False
 
     # replace / with \x2f 
     chunk_path = chunk_path.replace( "/", r"\x2f" )
-    
-    k = Key(bucket)
-    k.key = chunk_path
 
-    rc = True
+    if len(chunk_buf) >= S3_MULTIPART_THRESHOLD:
+        return write_chunk_multipart( chunk_path, StringIO(chunk_buf) )
+
+    compressed_data = compress_chunk( chunk_buf )
+    size = len(compressed_data)
+
+    rc = False
     begin = None
     end = None
-    size = None
-    try:
-        compressed_data = compress_chunk( chunk_buf )
-        size = len(compressed_data)
 
-        begin = time.time()
-        k.set_contents_from_string( compressed_data )
-        end = time.time()
-        
-    except Exception, e:
-        log.error("Failed to write '%s'" % chunk_path)
-        log.exception(e)
-        rc = False
+    # try the cached bucket first, and reconnect if it fails
+    for refresh in [False, True]:
+
+        bucket = get_bucket( AWS_BUCKET, refresh=refresh )
+        if bucket == None:
+            log.error("Failed to get bucket '%s'" % AWS_BUCKET )
+            continue
+
+        k = Key(bucket)
+        k.key = chunk_path
+
+        try:
+            begin = time.time()
+            k.set_contents_from_string( compressed_data )
+            end = time.time()
+            rc = True
+            break
+            
+        except Exception, e:
+            log.error("Failed to write '%s'" % chunk_path)
+            log.exception(e)
     
     if os.environ.get("BLOCKSTACK_TEST") == "1" and rc:
         log.debug("[BENCHMARK] s3.write_chunk %s: %s" % (size, end - begin))
@@ -145,40 +547,96 @@ def read_chunk( chunk_path ):
     """
 
     global AWS_BUCKET
-    
-    bucket = get_bucket( AWS_BUCKET )
-    if bucket == None:
-        log.error("Failed to get bucket '%s'" % AWS_BUCKET)
-        return None
 
     # replace / with \x2f 
     chunk_path = chunk_path.replace( "/", r"\x2f" )
-    
-    k = Key(bucket)
-    k.key = chunk_path
 
     data = None
     begin = None
     end = None
     size = None
-    try:
-        begin = time.time()
-        compressed_data = k.get_contents_as_string()
-        end = time.time()
-        size = len(compressed_data)
 
-        data = decompress_chunk( compressed_data )
-        
-    except Exception, e:
-        log.error("Failed to read '%s'" % chunk_path)
-        log.exception(e)
+    # try the cached bucket first, and reconnect if it fails
+    for refresh in [False, True]:
+
+        bucket = get_bucket( AWS_BUCKET, refresh=refresh )
+        if bucket == None:
+            log.error("Failed to get bucket '%s'" % AWS_BUCKET)
+            continue
+
+        k = Key(bucket)
+        k.key = chunk_path
+
+        try:
+            begin = time.time()
+            compressed_data = k.get_contents_as_string()
+            end = time.time()
+            size = len(compressed_data)
+
+        except Exception, e:
+            log.error("Failed to read '%s'" % chunk_path)
+            if is_missing_key(e):
+                # nothing wrong with the bucket
+                break
+
+            log.exception(e)
+            continue
+
+        try:
+            data = decompress_chunk( compressed_data )
+        except Exception, e:
+            log.error("Failed to decompress '%s'" % chunk_path)
+            log.exception(e)
+
+        break
         
-    if os.environ.get("BLOCKSTACK_TEST") == "1":
+    if os.environ.get("BLOCKSTACK_TEST") == "1" and end is not None:
         log.debug("[BENCHMARK] s3.read_chunk %s: %s" % (size, end - begin))
 
     return data
     
     
+#-------------------------
+def open_chunk( chunk_path ):
+    """
+    Open a chunk of data in S3 for streaming.
+
+    Return a ChunkReader on success
+    Return None if it doesn't exist, or on error
+    """
+
+    global AWS_BUCKET
+
+    # replace / with \x2f 
+    chunk_path = chunk_path.replace( "/", r"\x2f" )
+
+    # try the cached bucket first, and reconnect if it fails
+    for refresh in [False, True]:
+
+        bucket = get_bucket( AWS_BUCKET, refresh=refresh )
+        if bucket == None:
+            log.error("Failed to get bucket '%s'" % AWS_BUCKET)
+            continue
+
+        k = Key(bucket)
+        k.key = chunk_path
+
+        try:
+            k.open_read()
+        except Exception, e:
+            log.error("Failed to open '%s'" % chunk_path)
+            if is_missing_key(e):
+                # nothing wrong with the bucket
+                break
+
+            log.exception(e)
+            continue
+
+        return ChunkReader( k )
+
+    return None
+
+
 #-------------------------
 def delete_chunk( chunk_path ):
     """
@@ -189,25 +647,31 @@ def delete_chunk( chunk_path ):
     """
     
     global AWS_BUCKET
-    
-    bucket = get_bucket( AWS_BUCKET )
-    if bucket == None:
-        log.error("Failed to get bucket '%s'" % AWS_BUCKET)
-        return False
 
     # replace / with \x2f 
     chunk_path = chunk_path.replace( "/", r"\x2f" )
-    
-    k = Key(bucket)
-    k.key = chunk_path
 
-    rc = True
-    try:
-        k.delete()
-    except Exception, e:
-        log.error("Failed to delete '%s'" % chunk_path)
-        log.exception(e)
-        rc = False
+    rc = False
+
+    # try the cached bucket first, and reconnect if it fails
+    for refresh in [False, True]:
+
+        bucket = get_bucket( AWS_BUCKET, refresh=refresh )
+        if bucket == None:
+            log.error("Failed to get bucket '%s'" % AWS_BUCKET)
+            continue
+
+        k = Key(bucket)
+        k.key = chunk_path
+
+        try:
+            k.delete()
+            rc = True
+            break
+
+        except Exception, e:
+            log.error("Failed to delete '%s'" % chunk_path)
+            log.exception(e)
 
     return rc
 
@@ -224,7 +688,9 @@ def storage_init(conf):
     Return True on success
     Return False on error 
     """
-    global AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET
+    global AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET, S3_HOST, S3_PORT, S3_IS_SECURE
+    global S3_COMPRESSION, S3_COMPRESSION_LEVEL, S3_COMPRESSION_MIN_SIZE, S3_COMPRESSION_MIN_SAVINGS
+    global S3_MULTIPART_THRESHOLD, S3_MULTIPART_PART_SIZE, S3_MULTIPART_PARALLELISM, S3_MULTIPART_PART_RETRIES
 
     config_path = conf['path']
     if os.path.exists( config_path ):
@@ -247,6 +713,48 @@ def storage_init(conf):
             
             if parser.has_option('s3', 'api_key_secret'):
                 AWS_SECRET_ACCESS_KEY = parser.get('s3', 'api_key_secret')
+
+            if parser.has_option('s3', 'host'):
+                S3_HOST = parser.get('s3', 'host')
+
+            if parser.has_option('s3', 'port'):
+                S3_PORT = int(parser.get('s3', 'port'))
+
+            if parser.has_option('s3', 'is_secure'):
+                S3_IS_SECURE = parser.get('s3', 'is_secure').lower() in ['1', 'true', 'yes', 'on']
+
+            if parser.has_option('s3', 'compression'):
+                S3_COMPRESSION = parser.get('s3', 'compression')
+                if S3_COMPRESSION not in CHUNK_CODECS.keys():
+                    log.error("Config file '%s': unsupported 's3' compression '%s' (expected one of %s)" % (config_path, S3_COMPRESSION, ",".join(CHUNK_CODECS.keys())))
+                    return False
+
+            if parser.has_option('s3', 'compression_level'):
+                S3_COMPRESSION_LEVEL = int(parser.get('s3', 'compression_level'))
+
+            if CHUNK_CODEC_LEVELS.has_key(S3_COMPRESSION):
+                min_level, max_level = CHUNK_CODEC_LEVELS[S3_COMPRESSION]
+                if S3_COMPRESSION_LEVEL < min_level or S3_COMPRESSION_LEVEL > max_level:
+                    log.error("Config file '%s': 's3' compression_level for %s must be between %s and %s" % (config_path, S3_COMPRESSION, min_level, max_level))
+                    return False
+
+            if parser.has_option('s3', 'compression_min_size'):
+                S3_COMPRESSION_MIN_SIZE = int(parser.get('s3', 'compression_min_size'))
+
+            if parser.has_option('s3', 'compression_min_savings'):
+                S3_COMPRESSION_MIN_SAVINGS = float(parser.get('s3', 'compression_min_savings'))
+
+            if parser.has_option('s3', 'multipart_threshold'):
+                S3_MULTIPART_THRESHOLD = int(parser.get('s3', 'multipart_threshold'))
+
+            if parser.has_option('s3', 'multipart_part_size'):
+                S3_MULTIPART_PART_SIZE = max(5 * 1024 * 1024, int(parser.get('s3', 'multipart_part_size')))
+
+            if parser.has_option('s3', 'multipart_parallelism'):
+                S3_MULTIPART_PARALLELISM = max(1, int(parser.get('s3', 'multipart_parallelism')))
+
+            if parser.has_option('s3', 'multipart_part_retries'):
+                S3_MULTIPART_PART_RETRIES = max(1, int(parser.get('s3', 'multipart_part_retries')))
             
             
     # we can't proceed unless we have all three.
@@ -292,6 +800,18 @@ def get_immutable_handler( key, **kw ):
     return read_chunk( immutable_data_id )
 
 
+def get_immutable_stream_handler( key, **kw ):
+    """
+    S3 implementation of the (optional) get_immutable_stream_handler API call.
+    Given the hash of the data, return a file-like object
+    from which the data can be read (and decompressed) incrementally.
+    Return None if not found.
+    """
+
+    immutable_data_id = "immutable-%s" % key 
+    return open_chunk( immutable_data_id )
+
+
 def get_mutable_handler( url, **kw ):
     """
     S3 implementation of the get_mutable_handler API call.
@@ -403,6 +923,49 @@ if __name__ == "__main__":
    if not rc:
       raise Exception("Failed to initialize")
   
+   if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+       # per-operation latency, with and without the connection/bucket cache.
+       # point the [s3] section at a local S3-compatible stand-in to run this offline, e.g.
+       #   $ moto_server s3 -p 5000
+       #   [s3]
+       #   host = localhost
+       #   port = 5000
+       #   is_secure = False
+       num_ops = 100
+       if len(sys.argv) > 2:
+           num_ops = int(sys.argv[2])
+
+       def benchmark( cached ):
+           global S3_CACHE_CONNECTIONS, S3_CONNECTION, S3_BUCKETS
+
+           S3_CACHE_CONNECTIONS = cached
+           S3_CONNECTION = None
+           S3_BUCKETS = {}
+
+           timings = {}
+           for op_name, op in [("write_chunk", lambda i: write_chunk( "benchmark-%s" % i, "hello world %s" % i )),
+                               ("read_chunk", lambda i: read_chunk( "benchmark-%s" % i )),
+                               ("delete_chunk", lambda i: delete_chunk( "benchmark-%s" % i ))]:
+
+               begin = time.time()
+               for i in xrange(0, num_ops):
+                   res = op(i)
+                   if not res:
+                       raise Exception("%s(%s) failed" % (op_name, i))
+
+               timings[op_name] = (time.time() - begin) / num_ops
+
+           return timings
+
+       before = benchmark( False )
+       after = benchmark( True )
+
+       print "%-14s %12s %12s" % ("operation", "uncached", "cached")
+       for op_name in ["write_chunk", "read_chunk", "delete_chunk"]:
+           print "%-14s %10.2fms %10.2fms" % (op_name, before[op_name] * 1000, after[op_name] * 1000)
+
+       sys.exit(0)
+
    if len(sys.argv) > 1:
        # try to get these profiles 
        for name in sys.argv[1:]:
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# This module lets the blockstack client use a single SQLite database
+# (in WAL mode) as a storage provider.  This is useful for hosting
+# large local mirrors of zonefiles and profiles, which are slow to
+# list, back up, and fsync as one file per object.
+
+import os
+import sys
+import traceback
+import logging
+import threading
+import urllib
+import sqlite3
+from ConfigParser import SafeConfigParser
+from common import get_logger, DEBUG
+
+log = get_logger("blockstack-storage-driver-sqlite")
+
+if os.environ.get("BLOCKSTACK_TEST", None) is not None:
+    SQLITE_PATH = "/tmp/blockstack-sqlite/storage.db"
+else:
+    SQLITE_PATH = os.path.expanduser("~/.blockstack/storage-sqlite/storage.db")
+
+# writes are committed in batches: a background thread commits all
+# writes that arrive within SQLITE_BATCH_INTERVAL seconds of each
+# other (up to SQLITE_BATCH_SIZE at a time) in one transaction.
+# writers block until their batch is committed.
+SQLITE_BATCH_SIZE = 1000
+SQLITE_BATCH_INTERVAL = 0.01
+
+# if nonzero, read connections memory-map up to this many bytes of the database
+SQLITE_MMAP_SIZE = 0
+
+SQLITE_WRITER = None
+SQLITE_READERS = threading.local()
+
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS immutable( key TEXT PRIMARY KEY NOT NULL, data BLOB NOT NULL );",
+    "CREATE TABLE IF NOT EXISTS mutable( data_id TEXT PRIMARY KEY NOT NULL, data BLOB NOT NULL );",
+]
+
+log.setLevel( logging.DEBUG if DEBUG else logging.INFO )
+
+
+def db_connect( path, mmap_size=0 ):
+    """
+    Open a connection to the database, in WAL mode.
+    Return the connection
+    """
+    con = sqlite3.connect( path, timeout=60, check_same_thread=False, isolation_level=None )
+    con.text_factory = str
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    if mmap_size > 0:
+        con.execute("PRAGMA mmap_size=%d;" % int(mmap_size))
+
+    return con
+
+
+def db_read( sql, args ):
+    """
+    Run a query on this thread's read connection.
+    Return the first column of the first row, or None if there is no such row
+    """
+    global SQLITE_PATH, SQLITE_MMAP_SIZE, SQLITE_READERS
+
+    con = getattr( SQLITE_READERS, "con", None )
+    if con is None:
+        con = db_connect( SQLITE_PATH, mmap_size=SQLITE_MMAP_SIZE )
+        SQLITE_READERS.con = con
+
+    row = con.execute( sql, args ).fetchone()
+    if row is None:
+        return None
+
+    return str(row[0])
+
+
+class SQLiteBatchWriter( threading.Thread ):
+    """
+    Background thread that owns the write connection, and commits
+    concurrent writes together in as few transactions as possible.
+    """
+
+    def __init__(self, path, batch_size, batch_interval):
+        super( SQLiteBatchWriter, self ).__init__()
+        self.daemon = True
+        self.con = db_connect( path )
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.lock = threading.Lock()
+        self.cond = threading.Condition( self.lock )
+        self.pending = []
+        self.results = {}
+        self.next_id = 0
+
+    def write( self, sql, args ):
+        """
+        Queue a write, and wait for it to be committed.
+        Return True on success
+        Return False on error
+        """
+        with self.lock:
+            write_id = self.next_id
+            self.next_id += 1
+
+            self.pending.append( (write_id, sql, args) )
+            self.cond.notify_all()
+
+            while not self.results.has_key( write_id ):
+                self.cond.wait()
+
+            return self.results.pop( write_id )
+
+    def commit_batch( self, batch ):
+        """
+        Commit a batch of writes in one transaction.
+        If the transaction fails, then fall back to committing them one at a time,
+        so one bad write does not fail the others.
+        Return {write_id: True/False}
+        """
+        results = {}
+        try:
+            self.con.execute("BEGIN;")
+            for (write_id, sql, args) in batch:
+                self.con.execute( sql, args )
+
+            self.con.execute("COMMIT;")
+            for (write_id, sql, args) in batch:
+                results[write_id] = True
+
+            return results
+
+        except Exception, e:
+            log.exception(e)
+            try:
+                self.con.execute("ROLLBACK;")
+            except:
+                pass
+
+        for (write_id, sql, args) in batch:
+            try:
+                self.con.execute( sql, args )
+                results[write_id] = True
+            except Exception, e:
+                log.exception(e)
+                results[write_id] = False
+
+        return results
+
+    def run(self):
+        while True:
+            with self.lock:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+
+                # let concurrent writers join the batch
+                if len(self.pending) < self.batch_size:
+                    self.cond.wait( self.batch_interval )
+
+                batch = self.pending[:self.batch_size]
+                self.pending = self.pending[self.batch_size:]
+
+            results = self.commit_batch( batch )
+
+            with self.lock:
+                self.results.update( results )
+                self.cond.notify_all()
+
+
+def db_write( sql, args ):
+    """
+    Run a write through the batch writer.
+    Return True on success
+    Return False on error
+    """
+    global SQLITE_WRITER
+    if SQLITE_WRITER is None:
+        log.error("SQLite storage is not initialized")
+        return False
+
+    return SQLITE_WRITER.write( sql, args )
+
+
+def storage_init(conf):
+    """
+    SQLite implementation of the storage_init API call.
+    Do one-time global setup: read our settings, create the database,
+    and start the batch writer.
+    Return True on success
+    Return False on error
+    """
+    global SQLITE_PATH, SQLITE_BATCH_SIZE, SQLITE_BATCH_INTERVAL, SQLITE_MMAP_SIZE, SQLITE_WRITER
+
+    config_path = conf.get('path', None)
+    if config_path is not None and os.path.exists( config_path ):
+
+        parser = SafeConfigParser()
+
+        try:
+            parser.read(config_path)
+        except Exception, e:
+            log.exception(e)
+            return False
+
+        if parser.has_section('sqlite'):
+
+            if parser.has_option('sqlite', 'path'):
+                SQLITE_PATH = os.path.expanduser( parser.get('sqlite', 'path') )
+
+            if parser.has_option('sqlite', 'batch_size'):
+                SQLITE_BATCH_SIZE = max(1, int(parser.get('sqlite', 'batch_size')))
+
+            if parser.has_option('sqlite', 'batch_interval'):
+                SQLITE_BATCH_INTERVAL = float(parser.get('sqlite', 'batch_interval'))
+
+            if parser.has_option('sqlite', 'mmap_size'):
+                SQLITE_MMAP_SIZE = int(parser.get('sqlite', 'mmap_size'))
+
+    if SQLITE_WRITER is not None:
+        return True
+
+    dirpath = os.path.dirname( SQLITE_PATH )
+    if not os.path.isdir( dirpath ):
+        os.makedirs( dirpath )
+
+    try:
+        con = db_connect( SQLITE_PATH )
+        for stmt in SQLITE_SCHEMA:
+            con.execute( stmt )
+
+        con.close()
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to set up SQLite storage at '%s'" % SQLITE_PATH)
+        return False
+
+    SQLITE_WRITER = SQLiteBatchWriter( SQLITE_PATH, SQLITE_BATCH_SIZE, SQLITE_BATCH_INTERVAL )
+    SQLITE_WRITER.start()
+    return True
+
+
+def handles_url( url ):
+    """
+    Does this storage driver handle this kind of URL?
+    """
+    return url.startswith("sqlite://")
+
+
+def make_mutable_url( data_id ):
+    """
+    SQLite implementation of the make_mutable_url API call.
+    Given the ID of the data, generate a URL that
+    can be used to route reads and writes to the data.
+
+    Return a string.
+    """
+    return "sqlite://%s" % urllib.quote( data_id, safe="" )
+
+
+def get_immutable_handler( key, **kw ):
+    """
+    SQLite implementation of the get_immutable_handler API call.
+    Given the hash of the data, return the data.
+    Return None if not found.
+    """
+    try:
+        return db_read( "SELECT data FROM immutable WHERE key = ?;", (key,) )
+    except Exception, e:
+        if DEBUG:
+            traceback.print_exc()
+        return None
+
+
+def get_mutable_handler( url, **kw ):
+    """
+    SQLite implementation of the get_mutable_handler API call.
+    Given a route URL to data, return the data itself.
+    Return the data if found.
+    Return None if not.
+    """
+    if not handles_url( url ):
+        return None
+
+    data_id = urllib.unquote( url[len("sqlite://"):] )
+    try:
+        return db_read( "SELECT data FROM mutable WHERE data_id = ?;", (data_id,) )
+    except Exception, e:
+        if DEBUG:
+            traceback.print_exc()
+        return None
+
+
+def put_immutable_handler( key, data, txid, **kw ):
+    """
+    SQLite implementation of the put_immutable_handler API call.
+    Given the hash of the data (key), the serialized data itself,
+    and the transaction ID in the blockchain that contains the data's hash,
+    put the data into the storage system.
+    Return True on success; False on failure.
+    """
+    return db_write( "INSERT OR REPLACE INTO immutable (key, data) VALUES (?, ?);", (key, sqlite3.Binary(data)) )
+
+
+def put_mutable_handler( data_id, data_bin, **kw ):
+    """
+    SQLite implementation of the put_mutable_handler API call.
+    Return True on success; False on failure.
+    """
+    return db_write( "INSERT OR REPLACE INTO mutable (data_id, data) VALUES (?, ?);", (data_id, sqlite3.Binary(data_bin)) )
+
+
+def delete_immutable_handler( key, txid, sig_key_txid, **kw ):
+    """
+    SQLite implementation of the delete_immutable_handler API call.
+    Given the hash of the data and transaction ID of the update
+    that deleted the data, remove data from storage.
+    Return True on success; False if not.
+    """
+    return db_write( "DELETE FROM immutable WHERE key = ?;", (key,) )
+
+
+def delete_mutable_handler( data_id, signature, **kw ):
+    """
+    SQLite implementation of the delete_mutable_handler API call.
+    Given the unchanging data ID for the data and the writer's
+    signature over the hash of the data_id, remove data from storage.
+    Return True on success; False if not.
+    """
+    return db_write( "DELETE FROM mutable WHERE data_id = ?;", (data_id,) )
+
+
+if __name__ == "__main__":
+    """
+    Unit tests.
+    """
+
+    test_data = [
+        ["my_first_datum",        "hello world"],
+        ["/my/second/datum",      "hello world 2"],
+        ["foo.id:user_profile",   '{"name":{"formatted":"judecn"},"v":"2"}'],
+        ["empty_string",          ""],
+    ]
+
+    rc = storage_init({})
+    if not rc:
+        raise Exception("Failed to initialize")
+
+    print "put_immutable_handler"
+    for d_id, d in test_data:
+        rc = put_immutable_handler( "immutable-%s" % d_id, d, "unused" )
+        if not rc:
+            raise Exception("put_immutable_handler('%s') failed" % d)
+
+    print "put_mutable_handler"
+    for d_id, d in test_data:
+        rc = put_mutable_handler( d_id, d )
+        if not rc:
+            raise Exception("put_mutable_handler('%s', '%s') failed" % (d_id, d))
+
+    print "get_immutable_handler"
+    for d_id, d in test_data:
+        rd = get_immutable_handler( "immutable-%s" % d_id )
+        if rd != d:
+            raise Exception("get_immutable_handler('%s'): '%s' != '%s'" % (d_id, d, rd))
+
+    print "get_mutable_handler"
+    for d_id, d in test_data:
+        url = make_mutable_url( d_id )
+        if not handles_url( url ):
+            raise Exception("Does not handle '%s'" % url)
+
+        rd = get_mutable_handler( url )
+        if rd != d:
+            raise Exception("get_mutable_handler('%s'): '%s' != '%s'" % (url, d, rd))
+
+    print "concurrent put_mutable_handler"
+    results = []
+    def put_many( i ):
+        for j in xrange(0, 100):
+            results.append( put_mutable_handler( "concurrent-%s-%s" % (i, j), "%s" % j ) )
+
+    threads = [threading.Thread( target=put_many, args=(i,) ) for i in xrange(0, 10)]
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    if len(results) != 1000 or not all(results):
+        raise Exception("Concurrent puts failed")
+
+    print "delete_immutable_handler"
+    for d_id, d in test_data:
+        rc = delete_immutable_handler( "immutable-%s" % d_id, "unused", "unused" )
+        if not rc or get_immutable_handler( "immutable-%s" % d_id ) is not None:
+            raise Exception("delete_immutable_handler('%s') failed" % d_id)
+
+    print "delete_mutable_handler"
+    for d_id, d in test_data:
+        rc = delete_mutable_handler( d_id, "unused" )
+        if not rc or get_mutable_handler( make_mutable_url( d_id ) ) is not None:
+            raise Exception("delete_mutable_handler('%s') failed" % d_id)
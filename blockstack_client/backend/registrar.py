@@ -49,13 +49,15 @@ from .queue import queue_cleanall, queue_find_accepted
 
 from .nameops import async_preorder, async_register, async_update, async_transfer, async_renew, async_revoke
 from .blockchain import get_block_height
+from .repair import RepairWorker
 
 from ..keys import get_data_privkey_info, is_singlesig, is_multisig, get_privkey_info_address, get_privkey_info_params, encrypt_private_key_info, decrypt_private_key_info
 from ..proxy import is_name_registered, is_zonefile_hash_current, is_name_owner, get_default_proxy, get_name_blockchain_record, get_name_cost, get_atlas_peers
-from ..profile import get_and_migrate_profile, zonefile_data_replicate
+from ..profile import get_and_migrate_profile, zonefile_data_replicate, atlas_peer_rank, atlas_peer_is_unreliable, negative_cache_forget
 from ..user import make_empty_user_zonefile, is_user_zonefile 
-from ..storage import put_mutable_data, put_immutable_data, hash_zonefile, get_zonefile_data_hash
+from ..storage import put_mutable_data, put_immutable_data, hash_zonefile, get_zonefile_data_hash, parse_zonefile
 from ..data import get_profile_timestamp, set_profile_timestamp
+from ..atlas import atlas_get_ranked_peers, atlas_crawl_if_stale
 
 from .crypto.utils import aes_decrypt, aes_encrypt
 
@@ -406,7 +408,7 @@ class RegistrarWorker(threading.Thread):
             # the zonefile to find the appropriate data private key.
             zonefile = None
             try:
-                zonefile = blockstack_zones.parse_zone_file( zonefile_data )
+                zonefile = parse_zonefile( zonefile_data )
                 assert is_user_zonefile( zonefile )
             except Exception, e:
                 if os.environ.get("BLOCKSTACK_TEST", None) == 1:
@@ -423,12 +425,14 @@ class RegistrarWorker(threading.Thread):
             profile_payload = copy.deepcopy(name_data['profile'])
             profile_payload = set_profile_timestamp(profile_payload)
 
-            rc = put_mutable_data( name_data['fqu'], profile_payload, data_privkey, required=storage_drivers )
+            # skip drivers that already have this profile (the timestamp doesn't count)
+            rc = put_mutable_data( name_data['fqu'], profile_payload, data_privkey, required=storage_drivers, fingerprint_data=name_data['profile'], config_path=config_path )
             if not rc:
                 log.info("Failed to replicate profile for %s" % (name_data['fqu']))
                 return {'error': 'Failed to store profile'}
             else:
                 log.info("Replicated profile for %s" % (name_data['fqu']))
+                negative_cache_forget( 'profile', name_data['fqu'] )
                 return {'status': True}
 
         else:
@@ -462,34 +466,45 @@ class RegistrarWorker(threading.Thread):
     @classmethod 
     def get_atlas_server_list( cls, config_path ):
         """
-        Get the list of atlas servers to which to replicate zonefiles
+        Get the list of atlas servers to which to replicate zonefiles,
+        best-performing first.  Use the crawled peer table if we have one
+        (see atlas_crawl()); otherwise, ask our atlas node for its peers
+        and rank them by how they've done so far (see atlas_peer_rank())
         Returns [(host, port)] on success
         Returns {'error': ...} on error
         """
         conf = get_config(config_path)
-        servers = ['{}:{}'.format(conf['server'], conf['port'])]
         server_hostport = '{}:{}'.format(conf['server'], conf['port'])
 
-        atlas_peers_res = {}
-        try:
-            atlas_peers_res = get_atlas_peers( server_hostport )
-            assert 'error' not in atlas_peers_res
-           
-            servers += atlas_peers_res['peers']
-
-        except AssertionError as ae:
-            log.exception(ae)
-            log.error('Error response from {}: {}'.format(server_hostport, atlas_peers_res['error']))
-            return {'error': 'Failed to get valid response'}
-        except socket.error, se:
-            log.exception(se)
-            log.warning('Failed to find Atlas peers of {}'.format(server_hostport))
-            return {'error': 'Failed to get atlas peers due to socket error'}
-        except Exception as e:
-            log.exception(e)
-            return {'error': 'Failed to contact atlas peer'}
-            
-        servers = list(set([str(hp) for hp in servers]))
+        ranked_peers = atlas_get_ranked_peers( config_path )
+        if len(ranked_peers) > 0:
+            servers = [server_hostport] + [hp for hp in ranked_peers if hp != server_hostport]
+
+        else:
+            servers = [server_hostport]
+            atlas_peers_res = {}
+            try:
+                atlas_peers_res = get_atlas_peers( server_hostport )
+                assert 'error' not in atlas_peers_res
+               
+                servers += atlas_peers_res['peers']
+
+            except AssertionError as ae:
+                log.exception(ae)
+                log.error('Error response from {}: {}'.format(server_hostport, atlas_peers_res['error']))
+                return {'error': 'Failed to get valid response'}
+            except socket.error, se:
+                log.exception(se)
+                log.warning('Failed to find Atlas peers of {}'.format(server_hostport))
+                return {'error': 'Failed to get atlas peers due to socket error'}
+            except Exception as e:
+                log.exception(e)
+                return {'error': 'Failed to contact atlas peer'}
+                
+            servers = atlas_peer_rank( list(set([str(hp) for hp in servers])) )
+
+        # skip peers that keep failing, but give them an occasional chance to recover
+        servers = [hp for hp in servers if hp == server_hostport or not atlas_peer_is_unreliable(hp) or random.random() < 0.1]
         log.debug("Servers: {}".format(servers))
 
         return [url_to_host_port(hp) for hp in servers]
@@ -691,6 +706,13 @@ class RegistrarWorker(threading.Thread):
                 # see if we can replicate any zonefiles and profiles
                 # clear out any confirmed updates
                 log.debug("replicate all pending zonefiles and profiles in %s" % (self.queue_path))
+                try:
+                    # keep the Atlas peer table fresh
+                    atlas_crawl_if_stale( self.config_path )
+                except Exception, e:
+                    log.exception(e)
+                    log.warning("Failed to crawl Atlas peers")
+
                 servers = RegistrarWorker.get_atlas_server_list( self.config_path )
                 res = RegistrarWorker.replicate_profiles( self.queue_path, servers, wallet_data, self.required_storage_drivers, config_path=self.config_path, proxy=proxy )
                 if 'error' in res:
@@ -764,6 +786,7 @@ class RegistrarState(object):
 
     server_started_at = None
     registrar_worker = None
+    repair_worker = None
     queue_path = None
 
     def __init__(self, config_path):
@@ -774,18 +797,22 @@ class RegistrarState(object):
         log.info("Registrar initialized (config: %s, queues: %s)" % (config_path, self.queue_path))
         self.server_started_at = get_block_height( config_path=config_path )
         self.registrar_worker = RegistrarWorker( config_path )
+        self.repair_worker = RepairWorker( config_path )
 
 
     def start(self):
         self.registrar_worker.start()
+        self.repair_worker.start()
 
     def request_stop(self):
         log.debug("Registrar worker request stop")
         self.registrar_worker.request_stop()
+        self.repair_worker.request_stop()
 
     def join(self):
         log.debug("Registrar worker join")
         self.registrar_worker.join()
+        self.repair_worker.join()
 
 
 def ping():
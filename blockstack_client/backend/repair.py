@@ -0,0 +1,804 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Replica repair.
+#
+# Every object we write gets a small row in a local database (its key, type,
+# and the replica drivers that should have it), so it can be audited later.
+# When a put fails on some of the replica drivers, the object's data is
+# remembered too, along with the drivers that failed to store it.
+# The RepairWorker re-pushes the missing replicas with exponential backoff, and
+# drops the data once every replica is in place.  It also periodically audits
+# the least recently audited objects, to find replicas that have gone missing
+# since they were written; those are re-pushed from a replica that still has them.
+#
+# Nothing is recorded if repair is disabled (replica_repair = False).
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import threading
+import traceback
+
+from ..storage import get_storage_handlers, get_data_hash, get_zonefile_data_hash, run_parallel, get_metadata_dir
+from ..storage import load_mutable_data_fingerprints, store_mutable_data_fingerprints
+
+from ..config import get_config, get_logger, CONFIG_PATH, DEFAULT_STORAGE_WORKERS
+from ..config import DEFAULT_REPAIR_ENABLED, DEFAULT_REPAIR_INTERVAL, DEFAULT_REPAIR_AUDIT_INTERVAL, DEFAULT_REPAIR_AUDIT_SAMPLE_SIZE
+
+log = get_logger("blockstack-client-repair")
+
+REPAIR_SQL = """
+CREATE TABLE objects( object_type STRING NOT NULL,
+                      object_key STRING NOT NULL,
+                      data TEXT NOT NULL,
+                      txid TEXT,
+                      fqu TEXT,
+                      fingerprint TEXT,
+                      written_at INTEGER NOT NULL,
+                      audited_at INTEGER NOT NULL,
+                      PRIMARY KEY(object_type,object_key) );
+CREATE TABLE replicas( object_type STRING NOT NULL,
+                       object_key STRING NOT NULL,
+                       driver STRING NOT NULL,
+                       attempts INTEGER NOT NULL,
+                       next_attempt INTEGER NOT NULL,
+                       last_error TEXT,
+                       PRIMARY KEY(object_type,object_key,driver) );
+CREATE INDEX replicas_next_attempt ON replicas(next_attempt);
+"""
+
+# every object we wrote, for auditing.
+# added after the tables above, so it is created in older databases on open.
+REPAIR_WRITTEN_SQL = """
+CREATE TABLE IF NOT EXISTS written( object_type STRING NOT NULL,
+                                    object_key STRING NOT NULL,
+                                    drivers TEXT NOT NULL,
+                                    fqu TEXT,
+                                    txid TEXT,
+                                    zonefile INTEGER NOT NULL,
+                                    written_at INTEGER NOT NULL,
+                                    audited_at INTEGER NOT NULL,
+                                    PRIMARY KEY(object_type,object_key) );
+CREATE INDEX IF NOT EXISTS written_audited_at ON written(audited_at);
+"""
+
+# re-push backoff: REPAIR_BACKOFF_BASE * 2**attempts seconds, up to REPAIR_BACKOFF_MAX
+REPAIR_BACKOFF_BASE = 30
+REPAIR_BACKOFF_MAX = 24 * 60 * 60
+
+# most replicas to re-push per pass
+REPAIR_BATCH_SIZE = 100
+
+# seconds to wait on a locked database (the CLI and the RPC daemon share it)
+REPAIR_DB_TIMEOUT = 30
+
+# config for each config file, as read by get_repair_conf()
+repair_confs = {}
+
+# databases whose 'written' table we've made sure exists
+repairdb_upgraded = set()
+
+
+def get_repair_conf( config_path=CONFIG_PATH ):
+    """
+    Get the config for the write path (note_put() and forget()
+    run on every put and delete), reading the config file only once.
+    Return None on error
+    """
+    global repair_confs
+
+    conf = repair_confs.get( config_path, None )
+    if conf is None:
+        conf = get_config( config_path )
+        if conf is not None:
+            repair_confs[config_path] = conf
+
+    return conf
+
+
+def get_repair_db_path( config_path=CONFIG_PATH, conf=None ):
+    """
+    Get the path to the replica repair database
+    """
+    if conf is None:
+        conf = get_config( config_path )
+
+    if conf is not None and conf.has_key('repair_path'):
+        return conf['repair_path']
+
+    return os.path.join( os.path.dirname(config_path), "repair.db" )
+
+
+def is_repair_enabled( config_path=CONFIG_PATH, conf=None ):
+    """
+    Is replica repair turned on?
+    """
+    if conf is None:
+        conf = get_config( config_path )
+
+    if conf is None:
+        return False
+
+    return conf.get('replica_repair', DEFAULT_REPAIR_ENABLED) in [True, 'True', 'true', '1']
+
+
+def get_replica_drivers( config_path=CONFIG_PATH, conf=None ):
+    """
+    Get the names of the storage drivers that should have
+    a replica of everything we write.
+    Return None on error
+    """
+    if conf is None:
+        conf = get_config( config_path )
+
+    if conf is None:
+        return None
+
+    drivers = conf.get('storage_drivers_required_write', None)
+    if drivers is None:
+        drivers = conf.get('storage_drivers', "")
+
+    return [d.strip() for d in drivers.split(",") if len(d.strip()) > 0]
+
+
+def repairdb_create( path ):
+    """
+    Create a sqlite3 db at the given path.
+    Create all the tables and indexes we need.
+    """
+
+    global REPAIR_SQL
+
+    if os.path.exists( path ):
+        raise Exception("Database '%s' already exists" % path)
+
+    lines = [l + ";" for l in (REPAIR_SQL + REPAIR_WRITTEN_SQL).split(";")]
+    con = sqlite3.connect( path, isolation_level=None, timeout=REPAIR_DB_TIMEOUT )
+
+    for line in lines:
+        con.execute(line)
+
+    repairdb_upgraded.add( path )
+
+    con.row_factory = repairdb_row_factory
+    con.text_factory = str
+    return con
+
+
+def repairdb_open( path ):
+    """
+    Open a connection to our database
+    """
+    if not os.path.exists( path ):
+        con = repairdb_create( path )
+    else:
+        con = sqlite3.connect( path, isolation_level=None, timeout=REPAIR_DB_TIMEOUT )
+        con.row_factory = repairdb_row_factory
+        con.text_factory = str
+
+        if path not in repairdb_upgraded:
+            # created by an older version
+            for line in [l + ";" for l in REPAIR_WRITTEN_SQL.split(";")]:
+                con.execute(line)
+
+            repairdb_upgraded.add( path )
+
+    return con
+
+
+def repairdb_row_factory( cursor, row ):
+    """
+    Row factory: make rows into dicts
+    """
+    d = {}
+    for idx, col in enumerate( cursor.description ):
+        d[col[0]] = row[idx]
+
+    return d
+
+
+def repairdb_query_execute( cur, query, values ):
+    """
+    Execute a query.  Raise on error.
+
+    DO NOT CALL THIS DIRECTLY.
+    """
+
+    try:
+        ret = cur.execute( query, values )
+        return ret
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to execute query (%s, %s)" % (query, values))
+        raise
+
+
+def repairdb_note_put( object_type, object_key, data, succeeded, failed, txid=None, fqu=None, fingerprint=None, path=None ):
+    """
+    Remember an object we just wrote, that some replica drivers failed to store:
+    * store its data, so we can re-push it later
+    * mark it as missing from each driver in @failed
+    * mark it as present in each driver in @succeeded
+
+    A mutable object's data is replaced by the latest write.
+    Return True on success
+    Raise on error
+    """
+    now = int(time.time())
+
+    db = repairdb_open(path)
+    cur = db.cursor()
+
+    try:
+        repairdb_query_execute( cur, "BEGIN;", () )
+
+        repairdb_query_execute( cur, "INSERT OR REPLACE INTO objects VALUES (?,?,?,?,?,?,?,?);", \
+                                (object_type, object_key, data, txid, fqu, fingerprint, now, now) )
+
+        for driver in succeeded:
+            repairdb_query_execute( cur, "DELETE FROM replicas WHERE object_type = ? AND object_key = ? AND driver = ?;", \
+                                    (object_type, object_key, driver) )
+
+        for driver in failed:
+            repairdb_query_execute( cur, "INSERT OR REPLACE INTO replicas VALUES (?,?,?,?,?,?);", \
+                                    (object_type, object_key, driver, 0, now, None) )
+
+        repairdb_query_execute( cur, "COMMIT;", () )
+
+    except:
+        db.rollback()
+        db.close()
+        raise
+
+    db.close()
+    return True
+
+
+def repairdb_note_written( object_type, object_key, drivers, succeeded, fqu=None, txid=None, zonefile=False, path=None ):
+    """
+    Remember that we wrote an object, and which replica drivers should have it,
+    so it can be audited later.  Since it was just written, it is not due for
+    an audit until the objects written before it have been audited.
+
+    Re-pushes still pending to the drivers in @succeeded are dropped, and
+    so is the object's data once no re-pushes remain.
+    Return True on success
+    Raise on error
+    """
+    now = int(time.time())
+
+    db = repairdb_open(path)
+    cur = db.cursor()
+
+    try:
+        repairdb_query_execute( cur, "BEGIN;", () )
+        repairdb_query_execute( cur, "INSERT OR REPLACE INTO written VALUES (?,?,?,?,?,?,?,?);",                                 (object_type, object_key, ",".join(drivers), fqu, txid, int(zonefile), now, now) )
+
+        for driver in succeeded:
+            repairdb_query_execute( cur, "DELETE FROM replicas WHERE object_type = ? AND object_key = ? AND driver = ?;", \
+                                    (object_type, object_key, driver) )
+
+        repairdb_query_execute( cur, "DELETE FROM objects WHERE object_type = ? AND object_key = ? AND NOT EXISTS " + \
+                                     "(SELECT 1 FROM replicas WHERE replicas.object_type = objects.object_type AND replicas.object_key = objects.object_key);", \
+                                (object_type, object_key) )
+        repairdb_query_execute( cur, "COMMIT;", () )
+
+    except:
+        db.rollback()
+        db.close()
+        raise
+
+    db.close()
+    return True
+
+
+def repairdb_forget( object_type, object_key, path=None ):
+    """
+    Forget an object (e.g. because it was deleted), so it will not be re-pushed or audited.
+    Return True on success
+    Raise on error
+    """
+    if not os.path.exists( path ):
+        return True
+
+    db = repairdb_open(path)
+    cur = db.cursor()
+
+    repairdb_query_execute( cur, "DELETE FROM replicas WHERE object_type = ? AND object_key = ?;", (object_type, object_key) )
+    repairdb_query_execute( cur, "DELETE FROM objects WHERE object_type = ? AND object_key = ?;", (object_type, object_key) )
+    repairdb_query_execute( cur, "DELETE FROM written WHERE object_type = ? AND object_key = ?;", (object_type, object_key) )
+
+    db.close()
+    return True
+
+
+def repairdb_find_due( now, limit=None, path=None ):
+    """
+    Find the missing replicas that are due to be re-pushed, along with their objects' data.
+    Return the rows on success (empty list if none)
+    Raise on error
+    """
+    sql = "SELECT replicas.*,objects.data,objects.txid,objects.fqu,objects.fingerprint FROM replicas JOIN objects " + \
+          "ON replicas.object_type = objects.object_type AND replicas.object_key = objects.object_key " + \
+          "WHERE replicas.next_attempt <= ? ORDER BY replicas.next_attempt"
+    args = (now,)
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        args += (limit,)
+
+    db = repairdb_open(path)
+    cur = db.cursor()
+    rows = repairdb_query_execute( cur, sql + ";", args )
+
+    ret = []
+    for row in rows:
+        ret.append(row)
+
+    db.close()
+    return ret
+
+
+def repairdb_sample( count, path=None ):
+    """
+    Select the @count written objects that were audited least recently.
+    Return the rows on success (empty list if none)
+    Raise on error
+    """
+    db = repairdb_open(path)
+    cur = db.cursor()
+    rows = repairdb_query_execute( cur, "SELECT * FROM written ORDER BY audited_at LIMIT ?;", (count,) )
+
+    ret = []
+    for row in rows:
+        ret.append(row)
+
+    db.close()
+    return ret
+
+
+def repairdb_mark_repaired( object_type, object_key, driver, path=None ):
+    """
+    Mark a replica as present.
+    Forget the object once all of its replicas are present.
+    Return True on success
+    Raise on error
+    """
+    db = repairdb_open(path)
+    cur = db.cursor()
+
+    try:
+        repairdb_query_execute( cur, "BEGIN;", () )
+        repairdb_query_execute( cur, "DELETE FROM replicas WHERE object_type = ? AND object_key = ? AND driver = ?;", (object_type, object_key, driver) )
+        repairdb_query_execute( cur, "DELETE FROM objects WHERE object_type = ? AND object_key = ? AND NOT EXISTS " + \
+                                     "(SELECT 1 FROM replicas WHERE replicas.object_type = objects.object_type AND replicas.object_key = objects.object_key);", \
+                                (object_type, object_key) )
+        repairdb_query_execute( cur, "COMMIT;", () )
+
+    except:
+        db.rollback()
+        db.close()
+        raise
+
+    db.close()
+    return True
+
+
+def repairdb_mark_failed( object_type, object_key, driver, attempts, error, path=None ):
+    """
+    Record a failed re-push, and schedule the next one with exponential backoff.
+    Return True on success
+    Raise on error
+    """
+    backoff = min( REPAIR_BACKOFF_MAX, REPAIR_BACKOFF_BASE * (2 ** min(attempts, 32)) )
+    next_attempt = int(time.time() + backoff + random.random() * REPAIR_BACKOFF_BASE)
+
+    db = repairdb_open(path)
+    cur = db.cursor()
+    repairdb_query_execute( cur, "UPDATE replicas SET attempts = ?, next_attempt = ?, last_error = ? WHERE object_type = ? AND object_key = ? AND driver = ?;", \
+                            (attempts, next_attempt, error, object_type, object_key, driver) )
+    db.close()
+    return True
+
+
+def repairdb_note_audit( obj, missing, data, path=None ):
+    """
+    Record an audit of a written object (a row from repairdb_sample()).
+    If it is missing from any of the drivers in @missing, remember @data
+    (a good copy from another replica) so the RepairWorker can re-push it.
+    Replicas already waiting on a re-push keep their backoff (and their data).
+    Return True on success
+    Raise on error
+    """
+    now = int(time.time())
+
+    db = repairdb_open(path)
+    cur = db.cursor()
+
+    try:
+        repairdb_query_execute( cur, "BEGIN;", () )
+        repairdb_query_execute( cur, "UPDATE written SET audited_at = ? WHERE object_type = ? AND object_key = ?;", (now, obj['object_type'], obj['object_key']) )
+
+        if len(missing) > 0 and data is not None:
+            repairdb_query_execute( cur, "INSERT OR IGNORE INTO objects VALUES (?,?,?,?,?,?,?,?);", \
+                                    (obj['object_type'], obj['object_key'], data, obj['txid'], obj['fqu'], None, obj['written_at'], now) )
+
+            for driver in missing:
+                repairdb_query_execute( cur, "INSERT OR IGNORE INTO replicas VALUES (?,?,?,?,?,?);", \
+                                        (obj['object_type'], obj['object_key'], driver, 0, now, "missing on audit") )
+
+        repairdb_query_execute( cur, "COMMIT;", () )
+
+    except:
+        db.rollback()
+        db.close()
+        raise
+
+    db.close()
+    return True
+
+
+def note_put( object_type, object_key, data, succeeded, failed, txid=None, fqu=None, fingerprint=None, config_path=CONFIG_PATH ):
+    """
+    Remember that we wrote an object, so it can be audited, and which replica
+    drivers failed to store it, so the RepairWorker can fill in the missing
+    replicas.  Drivers that are not supposed to hold replicas (e.g. read-only
+    ones) are ignored.
+
+    The object's data is only kept if some replica driver failed to store it.
+    Does nothing if repair is disabled.
+
+    Return True on success
+    Return False on error
+    """
+    conf = get_repair_conf( config_path )
+    if not is_repair_enabled( config_path, conf=conf ):
+        return True
+
+    replica_drivers = get_replica_drivers( config_path, conf=conf )
+    if replica_drivers is None:
+        return False
+
+    succeeded = [d for d in succeeded if d in replica_drivers]
+    failed = [d for d in failed if d in replica_drivers]
+    path = get_repair_db_path(config_path, conf=conf)
+
+    zonefile = (object_type == 'immutable' and get_zonefile_data_hash( data ) == object_key)
+
+    try:
+        if len(failed) > 0:
+            repairdb_note_put( object_type, object_key, data, succeeded, failed, txid=txid, fqu=fqu, fingerprint=fingerprint, path=path )
+
+        return repairdb_note_written( object_type, object_key, succeeded + failed, succeeded, fqu=fqu, txid=txid, zonefile=zonefile, path=path )
+    except Exception, e:
+        log.exception(e)
+        return False
+
+
+def forget( object_type, object_key, config_path=CONFIG_PATH ):
+    """
+    Stop tracking the replicas of an object.
+    Return True on success
+    Return False on error
+    """
+    try:
+        return repairdb_forget( object_type, object_key, path=get_repair_db_path(config_path, conf=get_repair_conf(config_path)) )
+    except Exception, e:
+        log.exception(e)
+        return False
+
+
+def replica_push( handler, obj ):
+    """
+    Push an object to a storage driver.
+    Return True on success
+    Return False on error
+    """
+    if obj['object_type'] == 'immutable':
+        if not hasattr(handler, "put_immutable_handler"):
+            return False
+
+        return handler.put_immutable_handler( obj['object_key'], obj['data'], obj['txid'] )
+
+    elif obj['object_type'] == 'mutable':
+        if not hasattr(handler, "put_mutable_handler"):
+            return False
+
+        return handler.put_mutable_handler( obj['object_key'], obj['data'], fqu=obj['fqu'] )
+
+    else:
+        raise ValueError("Unknown object type '%s'" % obj['object_type'])
+
+
+def replica_fetch( handler, obj ):
+    """
+    Get a storage driver's replica of a written object (a row from repairdb_sample()).
+    Immutable replicas must match the object's hash.  Mutable replicas only
+    need to exist, since another client may have written a newer version.
+
+    Return (True, data) if the driver has a good replica
+    Return (False, None) if not
+    Return (None, None) if we can't tell
+    """
+    if obj['object_type'] == 'immutable':
+        if not hasattr(handler, "get_immutable_handler"):
+            return (None, None)
+
+        data = handler.get_immutable_handler( obj['object_key'], zonefile=bool(obj['zonefile']), fqu=obj['fqu'] )
+        if data is None:
+            return (False, None)
+
+        if obj['zonefile']:
+            data_hash = get_zonefile_data_hash( data )
+        else:
+            data_hash = get_data_hash( data )
+
+        if data_hash != obj['object_key']:
+            log.debug("Audit: bad '%s' replica of %s on '%s'" % (obj['object_type'], obj['object_key'], handler.__name__))
+            return (False, None)
+
+        return (True, data)
+
+    elif obj['object_type'] == 'mutable':
+        if not hasattr(handler, "get_mutable_handler") or not hasattr(handler, "make_mutable_url"):
+            return (None, None)
+
+        url = handler.make_mutable_url( obj['object_key'] )
+        if url is None:
+            return (None, None)
+
+        data = handler.get_mutable_handler( url, fqu=obj['fqu'] )
+        if data is None:
+            return (False, None)
+
+        return (True, data)
+
+    else:
+        raise ValueError("Unknown object type '%s'" % obj['object_type'])
+
+
+class RepairWorker(threading.Thread):
+    """
+    Worker thread for filling in missing replicas.
+    * re-push each missing replica, backing off exponentially on failure
+    * every so often, check the least recently audited objects we wrote for missing replicas
+    """
+    def __init__(self, config_path):
+        super(RepairWorker, self).__init__()
+
+        self.config_path = config_path
+        config = get_config(config_path)
+        self.repair_path = get_repair_db_path( config_path, conf=config )
+        self.repair_interval = int(config.get('repair_interval', DEFAULT_REPAIR_INTERVAL))
+        self.audit_interval = int(config.get('repair_audit_interval', DEFAULT_REPAIR_AUDIT_INTERVAL))
+        self.audit_sample_size = int(config.get('repair_audit_sample_size', DEFAULT_REPAIR_AUDIT_SAMPLE_SIZE))
+        self.replica_drivers = get_replica_drivers( config_path, conf=config )
+        self.enabled = is_repair_enabled( config_path, conf=config )
+        self.running = True
+
+        log.debug("Repair DB:       %s" % self.repair_path)
+        log.debug("Repair interval: %s" % self.repair_interval)
+        log.debug("Audit interval:  %s" % self.audit_interval)
+        log.debug("Audit sample:    %s" % self.audit_sample_size)
+
+
+    @classmethod
+    def repair_due( cls, repair_path, config_path=CONFIG_PATH, max_workers=DEFAULT_STORAGE_WORKERS ):
+        """
+        Re-push every missing replica that is due.
+        Return {'status': True, 'repaired': ..., 'failed': ...} on success
+        Return {'error': ...} on error
+        """
+        try:
+            due = repairdb_find_due( int(time.time()), limit=REPAIR_BATCH_SIZE, path=repair_path )
+        except Exception, e:
+            log.exception(e)
+            return {'error': 'Failed to query repair database'}
+
+        if len(due) == 0:
+            return {'status': True, 'repaired': 0, 'failed': 0}
+
+        handlers = dict( [(h.__name__, h) for h in get_storage_handlers( list(set([r['driver'] for r in due])) )] )
+
+        def push( row ):
+            handler = handlers.get( row['driver'], None )
+            if handler is None:
+                return (False, "driver not loaded")
+
+            try:
+                rc = replica_push( handler, row )
+            except Exception, e:
+                log.exception(e)
+                return (False, str(e))
+
+            if not rc:
+                return (False, "put failed")
+
+            return (True, None)
+
+        results = run_parallel( push, [(row,) for row in due], max_workers=max_workers )
+
+        repaired = 0
+        failed = 0
+        metadata_dir = None
+
+        for row, res in zip(due, results):
+            if res is None:
+                res = (False, "put failed")
+
+            rc, error = res
+            try:
+                if rc:
+                    log.debug("Repaired '%s' replica of %s on '%s'" % (row['object_type'], row['object_key'], row['driver']))
+                    repairdb_mark_repaired( row['object_type'], row['object_key'], row['driver'], path=repair_path )
+                    repaired += 1
+
+                    if row['object_type'] == 'mutable' and row['fingerprint'] is not None:
+                        # the driver now has what we last wrote
+                        if metadata_dir is None:
+                            metadata_dir = get_metadata_dir( config_path )
+
+                        fingerprints = load_mutable_data_fingerprints( row['object_key'], metadata_dir )
+                        fingerprints[row['driver']] = row['fingerprint']
+                        store_mutable_data_fingerprints( row['object_key'], fingerprints, metadata_dir )
+
+                else:
+                    log.debug("Failed to repair '%s' replica of %s on '%s' (attempt %s): %s" % (row['object_type'], row['object_key'], row['driver'], row['attempts'] + 1, error))
+                    repairdb_mark_failed( row['object_type'], row['object_key'], row['driver'], row['attempts'] + 1, error, path=repair_path )
+                    failed += 1
+
+            except Exception, e:
+                log.exception(e)
+                return {'error': 'Failed to update repair database'}
+
+        return {'status': True, 'repaired': repaired, 'failed': failed}
+
+
+    @classmethod
+    def audit_sample( cls, repair_path, replica_drivers, sample_size, max_workers=DEFAULT_STORAGE_WORKERS ):
+        """
+        Check the least recently audited objects we wrote for missing replicas,
+        and queue any that are missing for repair, using a good copy from
+        another replica.
+        Return {'status': True, 'audited': ..., 'missing': ..., 'lost': ...} on success,
+        where 'lost' counts objects that no replica had a good copy of
+        Return {'error': ...} on error
+        """
+        try:
+            sample = repairdb_sample( sample_size, path=repair_path )
+        except Exception, e:
+            log.exception(e)
+            return {'error': 'Failed to query repair database'}
+
+        handlers = get_storage_handlers( replica_drivers )
+        checks = []
+        for obj in sample:
+            for handler in handlers:
+                if handler.__name__ in obj['drivers'].split(","):
+                    checks.append( (handler, obj) )
+
+        results = run_parallel( replica_fetch, checks, max_workers=max_workers )
+
+        missing = dict( [((obj['object_type'], obj['object_key']), []) for obj in sample] )
+        copies = {}
+        for (handler, obj), res in zip(checks, results):
+            if res is None:
+                # failed; can't tell
+                continue
+
+            present, data = res
+            if present == False:
+                log.debug("Audit: '%s' replica of %s is missing on '%s'" % (obj['object_type'], obj['object_key'], handler.__name__))
+                missing[(obj['object_type'], obj['object_key'])].append( handler.__name__ )
+
+            elif present:
+                copies[(obj['object_type'], obj['object_key'])] = data
+
+        num_missing = 0
+        num_lost = 0
+        try:
+            for obj in sample:
+                key = (obj['object_type'], obj['object_key'])
+                data = copies.get( key, None )
+                if len(missing[key]) > 0 and data is None:
+                    log.warn("Audit: no replica of '%s' %s is left to repair from" % (obj['object_type'], obj['object_key']))
+                    num_lost += 1
+
+                repairdb_note_audit( obj, missing[key], data, path=repair_path )
+                num_missing += len(missing[key])
+
+        except Exception, e:
+            log.exception(e)
+            return {'error': 'Failed to update repair database'}
+
+        return {'status': True, 'audited': len(sample), 'missing': num_missing, 'lost': num_lost}
+
+
+    def request_stop(self):
+        """
+        Stop this thread
+        """
+        self.running = False
+
+
+    def run(self):
+        """
+        Re-push missing replicas every repair interval,
+        and audit a sample of objects every audit interval.
+        """
+        log.info("Repair worker entered")
+
+        if not self.enabled:
+            log.info("Replica repair is disabled; repair worker exiting")
+            return
+
+        if self.replica_drivers is None or len(self.replica_drivers) == 0:
+            log.warn("No replica storage drivers configured; repair worker exiting")
+            return
+
+        last_audit = time.time()
+
+        while self.running:
+
+            try:
+                res = RepairWorker.repair_due( self.repair_path, config_path=self.config_path )
+                if 'error' in res:
+                    log.warn("Replica repair failed: %s" % res['error'])
+
+                elif res['repaired'] > 0 or res['failed'] > 0:
+                    log.info("Repaired %s replica(s), %s failed" % (res['repaired'], res['failed']))
+
+            except Exception, e:
+                log.exception(e)
+
+            if time.time() >= last_audit + self.audit_interval:
+                try:
+                    res = RepairWorker.audit_sample( self.repair_path, self.replica_drivers, self.audit_sample_size )
+                    if 'error' in res:
+                        log.warn("Replica audit failed: %s" % res['error'])
+
+                    else:
+                        log.info("Audited %s object(s); %s replica(s) missing, %s object(s) lost" % (res['audited'], res['missing'], res['lost']))
+
+                except Exception, e:
+                    log.exception(e)
+
+                last_audit = time.time()
+
+            try:
+                for i in xrange(0, self.repair_interval):
+                    time.sleep(1)
+
+                    # preemption point
+                    if not self.running:
+                        break
+
+            except:
+                # interrupted
+                log.debug("Sleep interrupted")
+                break
+
+        log.info("Repair worker exited")
@@ -112,6 +112,9 @@ def session(conf=None, config_path=CONFIG_PATH, server_host=None, server_port=No
             log.error("Failed to initialize storage driver '%s' (%s)" % (storage_driver, rc))
             sys.exit(1)
 
+    if metadata_dir is not None and config_path is not None:
+        storage.set_metadata_dir( metadata_dir, config_path=config_path )
+
     # initialize SPV
     SPVClient.init(spv_headers_path)
     proxy.spv_headers_path = spv_headers_path
@@ -82,6 +82,8 @@ BLOCKSTACK_REQUIRED_STORAGE_DRIVERS_WRITE = "disk,blockstack_server,dht"
 
 DEFAULT_TIMEOUT = 30  # in secs
 
+DEFAULT_STORAGE_WORKERS = 8     # max concurrent storage driver requests in bulk operations
+
 """ transaction fee configs
 """
 
@@ -323,6 +325,21 @@ QUEUE_LENGTH_TO_MONITOR = 50
 MINIMUM_BALANCE = 0.002
 DEFAULT_POLL_INTERVAL = 300
 
+# zonefile publishing: number of Atlas peers that must store a new zonefile
+# before we consider it published (the rest are retried in the background)
+DEFAULT_ZONEFILE_PUBLISH_QUORUM = 1
+
+# replica repair (see backend/repair.py)
+DEFAULT_REPAIR_ENABLED = True               # track and re-push replicas that failed to store
+DEFAULT_REPAIR_INTERVAL = 60                # re-push due replicas every so many seconds
+DEFAULT_REPAIR_AUDIT_INTERVAL = 3600        # audit a sample of stored objects every so many seconds
+DEFAULT_REPAIR_AUDIT_SAMPLE_SIZE = 16       # number of objects to audit each time
+
+# Atlas peer crawling (see atlas.py)
+DEFAULT_ATLAS_CRAWL_INTERVAL = 3600         # re-crawl the Atlas peer graph every so many seconds
+DEFAULT_ATLAS_CRAWL_MAX_PEERS = 64          # most peers to probe in one crawl
+DEFAULT_ATLAS_CRAWL_FANOUT = 8              # most new neighbors to follow from each peer
+
 # approximate transaction sizes, for when the user has no balance.
 # over-estimations, to avoid stalled registrations.
 APPROX_PREORDER_TX_LEN = 620
@@ -980,7 +997,8 @@ def read_config_file(path=CONFIG_PATH):
         'blockstack-client': [
             'advanced_mode',
             'rpc_detach',
-            'anonymous_statistics'
+            'anonymous_statistics',
+            'replica_repair'
         ]
     }
 
@@ -195,7 +195,7 @@ def delete_mutable_data_version(conf, data_id):
         return False
 
 
-def get_immutable(name, data_hash, data_id=None, proxy=None):
+def get_immutable(name, data_hash, data_id=None, proxy=None, stream=False):
     """
     get_immutable
 
@@ -203,7 +203,12 @@ def get_immutable(name, data_hash, data_id=None, proxy=None):
     in the user's zonefile, and then fetch and verify the data itself
     from the configured storage providers.
 
+    If @stream is True, then don't load the data into RAM.  Instead,
+    return a file-like object that verifies the data hash as it is read
+    (and raises IOError at EOF if it doesn't match).
+
     Return {'data': the data, 'hash': hash} on success
+    Return {'stream': file-like object, 'hash': hash} on success, if @stream is True
     Return {'error': ...} on failure
     """
 
@@ -248,6 +253,13 @@ def get_immutable(name, data_hash, data_id=None, proxy=None):
         return {'error': 'No such immutable datum'}
 
     data_url_hint = user_db.get_immutable_data_url( user_zonefile, data_hash )
+    if stream:
+        data_stream = storage.get_immutable_data_stream( data_hash, data_url=data_url_hint, fqu=name, data_id=data_id )
+        if data_stream is None:
+            return {'error': 'No immutable data returned'}
+
+        return {'stream': data_stream, 'hash': data_hash}
+
     data = storage.get_immutable_data( data_hash, fqu=name, data_id=data_id, data_url=data_url_hint )
     if data is None:
         return {'error': 'No immutable data returned'}
@@ -322,12 +334,18 @@ def list_zonefile_history( name, current_block=None, proxy=None ):
     Return the list of zonefiles.  Each zonefile will be a dict with either the zonefile data,
     or a dict with only the key 'error' defined.  This method can successfully return
     some but not all zonefiles.
+
+    All of the zonefiles are fetched at once with load_name_zonefiles(), so
+    only the ones that no Atlas peer has will be fetched from the storage drivers.
     """
     zonefile_hashes = list_update_history( name, current_block=current_block, proxy=proxy )
+    loaded_zonefiles = load_name_zonefiles( zonefile_hashes, proxy=proxy )
+
     zonefiles = []
     for zh in zonefile_hashes:
-        zonefile = load_name_zonefile( name, zh, raw_zonefile=True )
+        zonefile = loaded_zonefiles.get( str(zh), None )
         if zonefile is None:
+            log.error("Failed to load user zonefile '%s'" % zh)
             zonefile = {'error': 'Failed to load zonefile %s' % zh}
 
         else:
@@ -367,13 +385,7 @@ def list_immutable_data_history( name, data_id, current_block=None, proxy=None )
 
         # try to parse 
         try:
-            zf = blockstack_zones.parse_zone_file( zf )
-
-            # force dict
-            tmp = {}
-            tmp.update(zf)
-            zf = tmp
-
+            zf = storage.parse_zonefile( zf )
         except Exception, e:
             if os.environ.get("BLOCKSTACK_TEST", None) == "1":
                 log.exception(e)
@@ -647,8 +659,9 @@ def put_immutable(name, data_id, data_json, data_url=None, txid=None, proxy=None
     user_zonefile = user_zonefile['zonefile']
     user_profile = user_profile['profile']
 
-    data_text = storage.serialize_immutable_data( data_json )
-    data_hash = storage.get_data_hash( data_text )
+    serialized_data = storage.serialize_immutable_data_hashed( data_json )
+    data_text = serialized_data['data_text']
+    data_hash = serialized_data['data_hash']
 
     # insert into user zonefile, overwriting if need be
     if user_db.has_immutable_data_id( user_zonefile, data_id ):
@@ -669,14 +682,15 @@ def put_immutable(name, data_id, data_json, data_url=None, txid=None, proxy=None
     if not rc:
         return {'error': 'Failed to insert immutable data into user zonefile'}
 
-    zonefile_hash = hash_zonefile( user_zonefile )
+    serialized_zonefile = storage.serialize_zonefile( user_zonefile )
+    user_zonefile_txt = serialized_zonefile['zonefile_text']
+    zonefile_hash = serialized_zonefile['zonefile_hash']
 
     # update zonefile, if we haven't already
     if txid is None:
         payment_privkey_info = get_payment_privkey_info(wallet_keys=wallet_keys, config_path=proxy.conf['path'])
         owner_privkey_info = get_owner_privkey_info(wallet_keys=wallet_keys, config_path=proxy.conf['path'])
 
-        user_zonefile_txt = blockstack_zones.make_zone_file( user_zonefile )
         update_result = async_update( name, user_zonefile_txt, None, owner_privkey_info, payment_privkey_info, config_path=proxy.conf['path'], proxy=proxy, queue_path=proxy.conf['queue_path'] )
         if 'error' in update_result:
             # failed to replicate user zonefile hash 
@@ -692,12 +706,12 @@ def put_immutable(name, data_id, data_json, data_url=None, txid=None, proxy=None
     }
 
     # replicate immutable data 
-    rc = storage.put_immutable_data( data_json, txid )
+    rc = storage.put_immutable_data( None, txid, data_hash=data_hash, data_text=data_text, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = 'Failed to store immutable data'
         return result
 
-    rc = store_name_zonefile( name, user_zonefile, txid )
+    rc, _ = store_name_zonefile_data( name, user_zonefile_txt, txid, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = 'Failed to store zonefile'
         return result
@@ -809,13 +823,13 @@ def put_mutable(name, data_id, data_json, proxy=None, create_only=False, update_
  
     # update the profile with the new zonefile
     user_profile = set_profile_timestamp( user_profile )
-    rc = storage.put_mutable_data( name, user_profile, data_privkey )
+    rc = storage.put_mutable_data( name, user_profile, data_privkey, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = 'Failed to store mutable data zonefile to profile'
         return result
 
     # put the mutable data record itself
-    rc = storage.put_mutable_data( fq_data_id, data_json, data_privkey )
+    rc = storage.put_mutable_data( fq_data_id, data_json, data_privkey, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = "Failed to store mutable data"
         return result
@@ -892,7 +906,7 @@ def put_app_data( name, service_id, account_id, data_id, data_bin, data_privkey,
         'version': version
     }
 
-    rc = storage.put_mutable_data( fq_data_id, app_data, data_privkey, use_only=storage_drivers )
+    rc = storage.put_mutable_data( fq_data_id, app_data, data_privkey, use_only=storage_drivers, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = "Failed to store mutable data"
         return result
@@ -960,14 +974,15 @@ def delete_immutable(name, data_key, data_id=None, proxy=None, txid=None, wallet
     # remove 
     user_db.remove_immutable_data_zonefile( user_zonefile, data_key )
 
-    zonefile_hash = hash_zonefile( user_zonefile )
+    serialized_zonefile = storage.serialize_zonefile( user_zonefile )
+    user_zonefile_txt = serialized_zonefile['zonefile_text']
+    zonefile_hash = serialized_zonefile['zonefile_hash']
     
     if txid is None:
         # actually send the transaction
         payment_privkey_info = get_payment_privkey_info(wallet_keys=wallet_keys, config_path=proxy.conf['path'])
         owner_privkey_info = get_owner_privkey_info(wallet_keys=wallet_keys, config_path=proxy.conf['path'])
 
-        user_zonefile_txt = blockstack_zones.make_zone_file( user_zonefile )
         update_result = async_update( name, user_zonefile_txt, None, owner_privkey_info, payment_privkey_info, config_path=proxy.conf['path'], proxy=proxy, queue_path=proxy.conf['queue_path'] )
         if 'error' in update_result:
             # failed to remove from zonefile 
@@ -982,7 +997,7 @@ def delete_immutable(name, data_key, data_id=None, proxy=None, txid=None, wallet
     }
     
     # put new zonefile 
-    rc = store_name_zonefile( name, user_zonefile, txid )
+    rc, _ = store_name_zonefile_data( name, user_zonefile_txt, txid, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = 'Failed to put new zonefile'
         return result
@@ -995,7 +1010,7 @@ def delete_immutable(name, data_key, data_id=None, proxy=None, txid=None, wallet
         data_privkey = data_privkey['privatekey']
         assert data_privkey is not None
 
-    rc = storage.delete_immutable_data( data_key, txid, data_privkey )
+    rc = storage.delete_immutable_data( data_key, txid, data_privkey, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = 'Failed to delete immutable data'
         return result
@@ -1050,12 +1065,12 @@ def delete_mutable(name, data_id, proxy=None, wallet_keys=None):
 
     # advance timestamp
     user_profile = set_profile_timestamp( user_profile )
-    rc = storage.put_mutable_data( name, user_profile, data_privkey )
+    rc = storage.put_mutable_data( name, user_profile, data_privkey, config_path=proxy.conf['path'] )
     if not rc:
         return {'error': 'Failed to unlink mutable data from profile'}
 
     # remove the data itself 
-    rc = storage.delete_mutable_data( fq_data_id, data_privkey )
+    rc = storage.delete_mutable_data( fq_data_id, data_privkey, config_path=proxy.conf['path'] )
     if not rc:
         return {'error': 'Failed to delete mutable data from storage providers'}
 
@@ -1092,7 +1107,7 @@ def delete_app_data(name, service_id, account_id, data_id, data_privkey, proxy=N
     fq_data_id = storage.make_fq_data_id( name, account_data_id )
     
     # remove the data itself 
-    rc = storage.delete_mutable_data( fq_data_id, data_privkey )
+    rc = storage.delete_mutable_data( fq_data_id, data_privkey, config_path=proxy.conf['path'] )
     if not rc:
         return {'error': 'Failed to delete mutable data from storage providers'}
 
@@ -1337,14 +1352,15 @@ def set_data_pubkey( name, data_pubkey, proxy=None, wallet_keys=None, txid=None
     user_profile = user_profile['profile']
 
     user_db.user_zonefile_set_data_pubkey( user_zonefile, data_pubkey )
-    zonefile_hash = hash_zonefile( user_zonefile )
+    serialized_zonefile = storage.serialize_zonefile( user_zonefile )
+    user_zonefile_txt = serialized_zonefile['zonefile_text']
+    zonefile_hash = serialized_zonefile['zonefile_hash']
 
     # update zonefile, if we haven't already
     if txid is None:
         payment_privkey_info = get_payment_privkey_info(wallet_keys=wallet_keys, config_path=proxy.conf['path'])
         owner_privkey_info = get_owner_privkey_info(wallet_keys=wallet_keys, config_path=proxy.conf['path'])
 
-        user_zonefile_txt = blockstack_zones.make_zone_file( user_zonefile )
         update_result = async_update( name, user_zonefile_txt, None, owner_privkey_info, payment_privkey_info, config_path=proxy.conf['path'], proxy=proxy, queue_path=proxy.conf['queue_path'] )
         if 'error' in update_result:
             # failed to replicate user zonefile hash 
@@ -1360,7 +1376,7 @@ def set_data_pubkey( name, data_pubkey, proxy=None, wallet_keys=None, txid=None
     }
 
     # replicate zonefile
-    rc = store_name_zonefile( name, user_zonefile, txid )
+    rc, _ = store_name_zonefile_data( name, user_zonefile_txt, txid, config_path=proxy.conf['path'] )
     if not rc:
         result['error'] = 'Failed to store zonefile'
         return result
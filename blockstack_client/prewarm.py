@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Namespace pre-warming: fetch the name record, zonefile and profile of every
+# name in a namespace, so later lookups are served from local caches.
+# Zonefiles go to the local Atlas mirror (see atlas.py); profiles are fetched
+# through the storage drivers, which fills their on-disk caches (e.g. the
+# HTTP driver's conditional-GET cache).
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import Queue
+
+from .proxy import get_default_proxy, get_num_names_in_namespace, get_names_in_namespace_page, get_name_blockchain_record, \
+        json_is_error, make_thread_proxy_factory
+from .profile import load_name_zonefiles, get_name_profiles
+from .atlas import atlas_mirror_get_zonefiles, atlas_mirror_put_zonefiles
+from .storage import run_parallel
+from .config import get_logger, CONFIG_PATH, DEFAULT_STORAGE_WORKERS
+
+log = get_logger("blockstack-client-prewarm")
+
+# names per batch (the most the server will give us in one page)
+PREWARM_BATCH_SIZE = 100
+
+# batches being worked on at once
+PREWARM_BATCHES_IN_FLIGHT = 2
+
+# log throughput every so many seconds
+PREWARM_REPORT_INTERVAL = 10
+
+
+def get_prewarm_checkpoint_path( namespace_id, config_path=CONFIG_PATH ):
+    """
+    Get the path to a namespace's pre-warm checkpoint
+    """
+    return os.path.join( os.path.dirname(config_path), "prewarm-{}.json".format(namespace_id) )
+
+
+def prewarm_checkpoint_load( path ):
+    """
+    Load a pre-warm checkpoint.
+    Return the checkpoint dict on success
+    Return None if there is none, or it is unreadable
+    """
+    if not os.path.exists( path ):
+        return None
+
+    try:
+        with open( path, "r" ) as f:
+            return json.loads( f.read() )
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Unreadable checkpoint {}".format(path))
+        return None
+
+
+def prewarm_checkpoint_store( path, checkpoint ):
+    """
+    Atomically store a pre-warm checkpoint.
+    Return True on success
+    Return False on error
+    """
+    try:
+        fd, tmppath = tempfile.mkstemp( dir=os.path.dirname(path) )
+        with os.fdopen( fd, "w" ) as f:
+            f.write( json.dumps(checkpoint) )
+
+        os.rename( tmppath, path )
+        return True
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to store checkpoint {}".format(path))
+        return False
+
+
+def prewarm_batch( names, proxy, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Warm the caches for one batch of names:
+    * look up their name records, with up to @max_workers concurrent lookups
+    * fetch the zonefiles that aren't in the local Atlas mirror yet, and store them there
+    * load (and verify) their profiles, with get_name_profiles()
+
+    Names that have no zonefile, or whose profile is known not to exist, are counted
+    as 'missing'; names whose lookups failed are counted as 'errors'.
+
+    Return {'names': ..., 'zonefiles_cached': ..., 'zonefiles_fetched': ..., 'profiles': ..., 'missing': ..., 'errors': ...}
+    """
+    config_path = proxy.conf['path']
+    get_worker_proxy = make_thread_proxy_factory( proxy )
+
+    def lookup_name_record( name ):
+        return get_name_blockchain_record( name, proxy=get_worker_proxy() )
+
+    name_records = dict( zip(names, run_parallel( lookup_name_record, [(name,) for name in names], max_workers=max_workers )) )
+
+    zonefile_hashes = {}
+    num_missing = 0
+    for name, name_record in name_records.items():
+        if name_record is None or json_is_error(name_record):
+            continue
+
+        if name_record.get('value_hash', None) in [None, "null", ""]:
+            # nothing to warm
+            num_missing += 1
+            continue
+
+        zonefile_hashes[name] = str(name_record['value_hash'])
+
+    cached = atlas_mirror_get_zonefiles( zonefile_hashes.values(), config_path=config_path )
+    fetched = load_name_zonefiles( [zfh for zfh in zonefile_hashes.values() if zfh not in cached], proxy=proxy, max_workers=max_workers )
+    if len(fetched) > 0:
+        atlas_mirror_put_zonefiles( fetched, config_path=config_path )
+
+    res = get_name_profiles( zonefile_hashes.keys(), proxy=proxy, max_workers=max_workers, name_records=name_records )
+    num_profiles = len([r for r in res['profiles'].values() if 'error' not in r])
+    num_missing += len([r for r in res['profiles'].values() if 'error' in r and r.get('missing', False)])
+
+    return {
+        'names': len(names),
+        'zonefiles_cached': len(cached),
+        'zonefiles_fetched': len(fetched),
+        'profiles': num_profiles,
+        'missing': num_missing,
+        'errors': len(names) - num_profiles - num_missing,
+    }
+
+
+def prewarm_namespace( namespace_id, config_path=CONFIG_PATH, proxy=None, max_workers=DEFAULT_STORAGE_WORKERS,
+                       batches_in_flight=PREWARM_BATCHES_IN_FLIGHT, restart=False ):
+    """
+    Warm the local caches with the zonefile and profile of every name in a namespace.
+
+    This runs as a bounded pipeline: one thread pages through the namespace's names,
+    and hands batches of PREWARM_BATCH_SIZE names over a queue to @batches_in_flight
+    worker threads, which warm them with prewarm_batch().  The queue holds at most
+    @batches_in_flight batches, so enumeration never runs far ahead of the workers.
+
+    Progress is checkpointed after each batch, up to the first batch that
+    hasn't finished; a later call resumes from there unless @restart is True.
+    The checkpoint is removed once the whole namespace has been warmed.
+
+    Return {'status': True, 'names': ..., 'zonefiles_cached': ..., 'zonefiles_fetched': ..., 'profiles': ...,
+            'missing': ..., 'errors': ..., 'elapsed': ..., 'names_per_second': ..., 'offset': ..., 'total': ...} on success
+    Return {'error': ...} on error
+    """
+    if proxy is None:
+        proxy = get_default_proxy( config_path=config_path )
+
+    checkpoint_path = get_prewarm_checkpoint_path( namespace_id, config_path=config_path )
+    start_offset = 0
+    if not restart:
+        checkpoint = prewarm_checkpoint_load( checkpoint_path )
+        if checkpoint is not None and checkpoint.get('namespace_id', None) == namespace_id:
+            start_offset = int(checkpoint['offset'])
+            log.info("Resuming pre-warm of {} at name {}".format(namespace_id, start_offset))
+
+    num_names = get_num_names_in_namespace( namespace_id, proxy=proxy )
+    if json_is_error(num_names):
+        return num_names
+
+    stats = {
+        'names': 0,
+        'zonefiles_cached': 0,
+        'zonefiles_fetched': 0,
+        'profiles': 0,
+        'missing': 0,
+        'errors': 0,
+    }
+
+    batch_queue = Queue.Queue( maxsize=batches_in_flight )
+    lock = threading.Lock()
+    completed = {}                      # batch offset: batch size
+    checkpoint_offset = [start_offset]  # all names before this have been warmed
+    failures = []
+    last_report = [time.time()]
+    begin = time.time()
+
+    def enumerate_names():
+        try:
+            for batch_offset in xrange(start_offset, num_names, PREWARM_BATCH_SIZE):
+                batch_size = min(PREWARM_BATCH_SIZE, num_names - batch_offset)
+                names = get_names_in_namespace_page( namespace_id, batch_offset, batch_size, proxy=proxy )
+                if json_is_error(names):
+                    with lock:
+                        failures.append( 'Failed to list names at {}: {}'.format(batch_offset, names['error']) )
+
+                    break
+
+                batch_queue.put( (batch_offset, batch_size, [str(name) for name in names]) )
+
+        finally:
+            for i in xrange(0, batches_in_flight):
+                batch_queue.put( None )
+
+    get_worker_proxy = make_thread_proxy_factory( proxy )
+
+    def warm_batches():
+        worker_proxy = get_worker_proxy()
+
+        while True:
+            item = batch_queue.get()
+            if item is None:
+                return
+
+            batch_offset, batch_size, names = item
+            try:
+                res = prewarm_batch( names, worker_proxy, max_workers=max_workers )
+            except Exception, e:
+                log.exception(e)
+                with lock:
+                    failures.append( 'Failed to warm names at {}'.format(batch_offset) )
+
+                continue
+
+            with lock:
+                for key in stats.keys():
+                    stats[key] += res[key]
+
+                completed[batch_offset] = batch_size
+                while checkpoint_offset[0] in completed:
+                    checkpoint_offset[0] += completed.pop( checkpoint_offset[0] )
+
+                prewarm_checkpoint_store( checkpoint_path, {'namespace_id': namespace_id, 'offset': checkpoint_offset[0], 'total': num_names} )
+
+                now = time.time()
+                if now - last_report[0] >= PREWARM_REPORT_INTERVAL:
+                    last_report[0] = now
+                    log.info("Pre-warmed {} of {} names in {} ({:.1f} names/s, {} zonefiles fetched, {} profiles)".format(
+                             checkpoint_offset[0], num_names, namespace_id, stats['names'] / (now - begin), stats['zonefiles_fetched'], stats['profiles']))
+
+    threads = [threading.Thread( target=enumerate_names )] + [threading.Thread( target=warm_batches ) for i in xrange(0, batches_in_flight)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    elapsed = time.time() - begin
+    if checkpoint_offset[0] >= num_names and os.path.exists( checkpoint_path ):
+        # all done; start over next time
+        os.unlink( checkpoint_path )
+
+    ret = {
+        'status': True,
+        'elapsed': elapsed,
+        'names_per_second': stats['names'] / elapsed if elapsed > 0 else 0.0,
+        'offset': checkpoint_offset[0],
+        'total': num_names,
+    }
+    ret.update( stats )
+
+    if len(failures) > 0:
+        ret = {'error': '; '.join(failures), 'partial': ret}
+
+    return ret
@@ -34,6 +34,9 @@ import pprint
 import random
 import time
 import copy
+import threading
+import sqlite3
+from collections import OrderedDict
 import blockstack_profiles
 import blockstack_zones 
 import urllib
@@ -47,6 +50,7 @@ from blockstack_client import storage
 from blockstack_client import user as user_db
 
 from storage import hash_zonefile
+from .atlas import atlas_get_ranked_peers, atlas_peer_note_failure, atlas_mirror_get_zonefile, atlas_mirror_get_zonefiles
 import pybitcoin
 import bitcoin
 import binascii
@@ -56,10 +60,58 @@ from config import get_logger, DEBUG, MAX_RPC_LEN, find_missing, BLOCKSTACKD_SER
     BLOCKSTACKD_PORT, BLOCKSTACK_METADATA_DIR, BLOCKSTACK_DEFAULT_STORAGE_DRIVERS, \
     FIRST_BLOCK_MAINNET, NAME_OPCODES, OPFIELDS, CONFIG_DIR, SPV_HEADERS_PATH, BLOCKCHAIN_ID_MAGIC, \
     NAME_PREORDER, NAME_REGISTRATION, NAME_UPDATE, NAME_TRANSFER, NAMESPACE_PREORDER, NAME_IMPORT, \
-    USER_ZONEFILE_TTL, CONFIG_PATH, get_config
+    USER_ZONEFILE_TTL, CONFIG_PATH, get_config, DEFAULT_STORAGE_WORKERS, DEFAULT_ZONEFILE_PUBLISH_QUORUM
 
 log = get_logger()
 
+# most zonefiles to ask an Atlas peer for in one request
+MAX_ZONEFILES_PER_REQUEST = 100
+
+# most Atlas peers to ask for a single zonefile before falling back to storage
+ATLAS_READ_MAX_PEERS = 3
+
+# how long to wait on an Atlas peer from the peer table (our own Atlas node gets the usual timeout)
+ATLAS_READ_PEER_TIMEOUT = 5
+
+# zonefile publishing: attempts per peer, and the backoff between them (doubled each time)
+ZONEFILE_PUBLISH_MAX_ATTEMPTS = 4
+ZONEFILE_PUBLISH_BACKOFF = 1.0
+
+# per-peer publishing statistics, keyed by "host:port"
+ATLAS_PEER_LATENCY_EWMA = 0.2
+atlas_peer_stats = {}
+atlas_peer_stats_lock = threading.Lock()
+
+# a peer is unreliable if it fails this often, over at least this many attempts
+ATLAS_PEER_MIN_SUCCESS_RATE = 0.25
+ATLAS_PEER_MIN_ATTEMPTS = 4
+
+# negative cache of lookups that found nothing, keyed by (entry type, key).
+# each entry type has its own TTL (in seconds), and all entries are dropped
+# once a new block is seen (checked at most every NEGATIVE_CACHE_BLOCK_CHECK_INTERVAL seconds).
+NEGATIVE_CACHE_TTL = {
+    'name': 600,        # name not registered, or revoked
+    'zonefile': 60,     # zonefile not found on any Atlas peer or storage driver
+    'profile': 30,      # profile not found at any of the zonefile's URLs
+}
+NEGATIVE_CACHE_SIZE = 10000
+NEGATIVE_CACHE_BLOCK_CHECK_INTERVAL = 30
+negative_cache = OrderedDict()
+negative_cache_lock = threading.Lock()
+negative_cache_block = {'height': None, 'checked': 0}
+negative_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+# converted legacy profiles, keyed by zonefile hash.  zonefiles are content-addressed,
+# so entries never go stale.  recently-used ones are kept in memory; up to
+# LEGACY_PROFILE_CACHE_DISK_SIZE of the most recently converted ones are kept
+# on disk (see get_legacy_profile_cache_path()), over one connection per config file.
+LEGACY_PROFILE_CACHE_SIZE = 1024
+LEGACY_PROFILE_CACHE_DISK_SIZE = 100000
+legacy_profile_cache = OrderedDict()
+legacy_profile_cache_lock = threading.Lock()
+legacy_profile_cache_dbs = {}
+legacy_profile_cache_db_lock = threading.Lock()
+
 
 def set_profile_timestamp( profile, now=None ):
     """
@@ -88,11 +140,8 @@ def decode_name_zonefile(zonefile_txt):
     user_zonefile = None
     try:
         # by default, it's a zonefile-formatted text file
-        user_zonefile_defaultdict = blockstack_zones.parse_zone_file( zonefile_txt )
-        assert user_db.is_user_zonefile( user_zonefile_defaultdict ), "Not a user zonefile"
-
-        # force dict
-        user_zonefile = dict(user_zonefile_defaultdict)
+        user_zonefile = storage.parse_zonefile( zonefile_txt )
+        assert user_db.is_user_zonefile( user_zonefile ), "Not a user zonefile"
 
     except (IndexError, ValueError, blockstack_zones.InvalidLineException):
         # might be legacy profile
@@ -118,6 +167,243 @@ def decode_name_zonefile(zonefile_txt):
     return user_zonefile
 
 
+def negative_cache_new_block( block_height ):
+    """
+    Tell the negative cache what the current block is.
+    If it's a new block, then drop every entry.
+    """
+    global negative_cache, negative_cache_lock, negative_cache_block, negative_cache_stats
+
+    with negative_cache_lock:
+        negative_cache_block['checked'] = time.time()
+        if negative_cache_block['height'] is not None and block_height != negative_cache_block['height']:
+            log.debug("New block {}; dropping {} negative cache entries".format(block_height, len(negative_cache)))
+            negative_cache.clear()
+            negative_cache_stats['invalidations'] += 1
+
+        negative_cache_block['height'] = block_height
+
+
+def negative_cache_check_block( proxy=None ):
+    """
+    Find out if there's a new block (at most every NEGATIVE_CACHE_BLOCK_CHECK_INTERVAL seconds),
+    and invalidate the negative cache if so.
+    """
+    with negative_cache_lock:
+        if negative_cache_block['checked'] + NEGATIVE_CACHE_BLOCK_CHECK_INTERVAL > time.time():
+            return
+
+        # don't let concurrent lookups all check at once
+        negative_cache_block['checked'] = time.time()
+
+    if proxy is None:
+        proxy = get_default_proxy()
+
+    try:
+        info = getinfo( proxy=proxy )
+        if 'error' in info:
+            log.debug("Failed to get the current block: {}".format(info['error']))
+            return
+
+        negative_cache_new_block( int(info['last_block_processed']) )
+
+    except Exception, e:
+        log.exception(e)
+        log.debug("Failed to get the current block")
+
+
+def negative_cache_put( entry_type, key, value=None ):
+    """
+    Remember that a lookup of type @entry_type ('name', 'zonefile' or 'profile')
+    found nothing for @key.  @value is what the lookup should return until
+    the entry expires.
+    """
+    global negative_cache, negative_cache_lock, negative_cache_stats
+
+    with negative_cache_lock:
+        negative_cache.pop( (entry_type, key), None )
+        negative_cache[(entry_type, key)] = (time.time() + NEGATIVE_CACHE_TTL[entry_type], copy.deepcopy(value))
+        while len(negative_cache) > NEGATIVE_CACHE_SIZE:
+            negative_cache.popitem( last=False )
+            negative_cache_stats['evictions'] += 1
+
+
+def negative_cache_get( entry_type, key, proxy=None ):
+    """
+    Did a lookup of type @entry_type recently find nothing for @key?
+    Return (True, value) if so, where value is what the lookup returned
+    Return (False, None) if not
+    """
+    global negative_cache, negative_cache_lock, negative_cache_stats
+
+    with negative_cache_lock:
+        empty = (len(negative_cache) == 0)
+
+    if not empty:
+        negative_cache_check_block( proxy=proxy )
+
+    with negative_cache_lock:
+        entry = negative_cache.get( (entry_type, key), None )
+        if entry is not None and entry[0] < time.time():
+            del negative_cache[(entry_type, key)]
+            entry = None
+
+        if entry is None:
+            negative_cache_stats['misses'] += 1
+            return (False, None)
+
+        negative_cache_stats['hits'] += 1
+        return (True, copy.deepcopy(entry[1]))
+
+
+def negative_cache_forget( entry_type, key ):
+    """
+    Drop a negative cache entry (e.g. because we just stored the data)
+    """
+    with negative_cache_lock:
+        negative_cache.pop( (entry_type, key), None )
+
+
+def get_negative_cache_stats():
+    """
+    Get the negative cache's counters.
+    Return {'hits': ..., 'misses': ..., 'evictions': ..., 'invalidations': ..., 'size': ...}
+    """
+    with negative_cache_lock:
+        stats = dict(negative_cache_stats)
+        stats['size'] = len(negative_cache)
+
+    return stats
+
+
+def get_legacy_profile_cache_path( config_path=CONFIG_PATH ):
+    """
+    Get the path to the on-disk legacy profile conversion cache
+    """
+    conf = get_config( config_path )
+    if conf is not None and conf.has_key('legacy_profile_cache_path'):
+        return conf['legacy_profile_cache_path']
+
+    return os.path.join( os.path.dirname(config_path), "legacy_profiles.db" )
+
+
+def legacy_profile_cache_open( config_path=CONFIG_PATH ):
+    """
+    Get the connection to the on-disk legacy profile conversion cache.
+    It is opened (and created, if need be) the first time, and shared after that;
+    hold legacy_profile_cache_db_lock while using it.
+    """
+    global legacy_profile_cache_dbs
+
+    con = legacy_profile_cache_dbs.get( config_path, None )
+    if con is not None:
+        return con
+
+    con = sqlite3.connect( get_legacy_profile_cache_path(config_path), isolation_level=None, timeout=30, check_same_thread=False )
+    con.text_factory = str
+    con.execute( "CREATE TABLE IF NOT EXISTS legacy_profiles( zonefile_hash STRING PRIMARY KEY NOT NULL, profile TEXT NOT NULL, stored_at INTEGER NOT NULL );" )
+    con.execute( "CREATE INDEX IF NOT EXISTS legacy_profiles_stored_at ON legacy_profiles(stored_at);" )
+
+    legacy_profile_cache_dbs[config_path] = con
+    return con
+
+
+def legacy_profile_cache_get( zonefile_hash, config_path=CONFIG_PATH ):
+    """
+    Get a converted legacy profile, from memory or from disk.
+    Return the profile on success
+    Return None if we haven't converted it
+    """
+    global legacy_profile_cache, legacy_profile_cache_lock
+
+    with legacy_profile_cache_lock:
+        profile = legacy_profile_cache.pop( zonefile_hash, None )
+        if profile is not None:
+            legacy_profile_cache[zonefile_hash] = profile
+            return copy.deepcopy(profile)
+
+    profile = None
+    try:
+        with legacy_profile_cache_db_lock:
+            con = legacy_profile_cache_open( config_path )
+            rows = con.execute( "SELECT profile FROM legacy_profiles WHERE zonefile_hash = ?;", (zonefile_hash,) ).fetchall()
+
+        if len(rows) > 0:
+            profile = json.loads( rows[0][0] )
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to read legacy profile cache")
+        return None
+
+    if profile is not None:
+        legacy_profile_cache_remember( zonefile_hash, profile )
+
+    return profile
+
+
+def legacy_profile_cache_remember( zonefile_hash, profile ):
+    """
+    Keep a converted legacy profile in memory
+    """
+    global legacy_profile_cache, legacy_profile_cache_lock
+
+    with legacy_profile_cache_lock:
+        legacy_profile_cache.pop( zonefile_hash, None )
+        legacy_profile_cache[zonefile_hash] = copy.deepcopy(profile)
+        while len(legacy_profile_cache) > LEGACY_PROFILE_CACHE_SIZE:
+            legacy_profile_cache.popitem( last=False )
+
+
+def legacy_profile_cache_put( zonefile_hash, profile, config_path=CONFIG_PATH ):
+    """
+    Store a converted legacy profile, in memory and on disk.
+    Drop the oldest ones on disk once there are more than LEGACY_PROFILE_CACHE_DISK_SIZE.
+    Return True on success
+    Return False if it could not be stored on disk
+    """
+    legacy_profile_cache_remember( zonefile_hash, profile )
+
+    try:
+        with legacy_profile_cache_db_lock:
+            con = legacy_profile_cache_open( config_path )
+            con.execute( "INSERT OR REPLACE INTO legacy_profiles VALUES (?,?,?);", (zonefile_hash, json.dumps(profile, sort_keys=True), int(time.time())) )
+            con.execute( "DELETE FROM legacy_profiles WHERE zonefile_hash IN " + \
+                         "(SELECT zonefile_hash FROM legacy_profiles ORDER BY stored_at DESC LIMIT -1 OFFSET ?);", (LEGACY_PROFILE_CACHE_DISK_SIZE,) )
+
+    except Exception, e:
+        log.exception(e)
+        log.error("Failed to write legacy profile cache")
+        return False
+
+    return True
+
+
+def convert_legacy_profile( user_zonefile, zonefile_hash=None, config_path=CONFIG_PATH ):
+    """
+    If a user zonefile is really a legacy profile, convert it to a modern profile.
+    Conversions are cached by @zonefile_hash, if given.
+
+    Return the converted profile if the zonefile is a legacy profile
+    Return None if not
+    """
+    if not blockstack_profiles.is_profile_in_legacy_format( user_zonefile ):
+        return None
+
+    if zonefile_hash is not None:
+        profile = legacy_profile_cache_get( str(zonefile_hash), config_path=config_path )
+        if profile is not None:
+            return profile
+
+    log.debug("Converting legacy profile to modern profile")
+    profile = blockstack_profiles.get_person_from_legacy_format( user_zonefile )
+
+    if zonefile_hash is not None:
+        legacy_profile_cache_put( str(zonefile_hash), profile, config_path=config_path )
+
+    return profile
+
+
 def load_name_zonefile(name, expected_zonefile_hash, storage_drivers=None, raw_zonefile=False, proxy=None ):
     """
     Fetch and load a user zonefile from the storage implementation with the given hex string hash,
@@ -138,22 +424,49 @@ def load_name_zonefile(name, expected_zonefile_hash, storage_drivers=None, raw_z
     atlas_port = conf['port']
     hostport = '{}:{}'.format( atlas_host, atlas_port )
 
-    zonefile_txt = None
     expected_zonefile_hash = str(expected_zonefile_hash)
 
-    # try atlas node first 
-    res = get_zonefiles( hostport, [expected_zonefile_hash], proxy=proxy )
-    if 'error' in res or expected_zonefile_hash not in res['zonefiles']:
-        # fall back to storage drivers if atlas node didn't have it
-        zonefile_txt = storage.get_immutable_data(expected_zonefile_hash, hash_func=storage.get_zonefile_data_hash, fqu=name, zonefile=True, deserialize=False, drivers=storage_drivers)
+    cached, _ = negative_cache_get( 'zonefile', expected_zonefile_hash, proxy=proxy )
+    if cached:
+        log.error("Failed to load user zonefile '%s' (cached)" % expected_zonefile_hash)
+        return None
+
+    # do we have it locally already?  (see atlas_sync() and prewarm_namespace())
+    zonefile_txt = atlas_mirror_get_zonefile( expected_zonefile_hash, config_path=conf['path'] )
+
+    # only remember that it's missing if everyone we asked said so
+    definitely_missing = True
+
+    if zonefile_txt is None:
+        # try our atlas node, then the fastest, most complete Atlas peers we know of (see atlas_crawl())
+        peers = [hostport] + [peer for peer in atlas_get_ranked_peers( config_path=conf['path'], count=ATLAS_READ_MAX_PEERS ) if peer != hostport]
+
+        for peer_hostport in peers:
+            if peer_hostport == hostport:
+                res = get_zonefiles( peer_hostport, [expected_zonefile_hash], proxy=proxy )
+            else:
+                res = get_zonefiles( peer_hostport, [expected_zonefile_hash], timeout=ATLAS_READ_PEER_TIMEOUT )
+                if 'error' in res:
+                    atlas_peer_note_failure( peer_hostport, config_path=conf['path'] )
+
+            if 'error' in res:
+                definitely_missing = False
+
+            if 'error' not in res and expected_zonefile_hash in res['zonefiles']:
+                # extract 
+                log.debug('Fetched {} from Atlas peer {}'.format(expected_zonefile_hash, peer_hostport))
+                zonefile_txt = res['zonefiles'][expected_zonefile_hash]
+                break
+
+    if zonefile_txt is None:
+        # fall back to storage drivers if no atlas node had it
+        zonefile_txt, error = storage.get_immutable_data_status(expected_zonefile_hash, hash_func=storage.get_zonefile_data_hash, fqu=name, zonefile=True, deserialize=False, drivers=storage_drivers)
         if zonefile_txt is None:
             log.error("Failed to load user zonefile '%s'" % expected_zonefile_hash)
-            return None
+            if definitely_missing and error == "not found":
+                negative_cache_put( 'zonefile', expected_zonefile_hash )
 
-    else:
-        # extract 
-        log.debug('Fetched {} from Atlas peer {}'.format(expected_zonefile_hash, hostport))
-        zonefile_txt = res['zonefiles'][expected_zonefile_hash]
+            return None
 
     if raw_zonefile:
         try:
@@ -170,6 +483,102 @@ def load_name_zonefile(name, expected_zonefile_hash, storage_drivers=None, raw_z
     return decode_name_zonefile( zonefile_txt )
 
 
+def load_name_zonefiles( zonefile_hashes, storage_drivers=None, proxy=None, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Fetch many raw zonefiles at once, given their authentic hashes.
+    Use the ones in the local Atlas mirror, and ask our Atlas node for the rest with one multi-hash get_zonefiles request
+    (per MAX_ZONEFILES_PER_REQUEST hashes), then ask each of its Atlas peers for
+    the ones it didn't have, and then fall back to the storage drivers.
+
+    Return {zonefile hash: raw zonefile} for each zonefile that was found.
+    """
+
+    if proxy is None:
+        proxy = get_default_proxy()
+
+    conf = proxy.conf
+    hostport = '{}:{}'.format( conf['server'], conf['port'] )
+
+    zonefiles = atlas_mirror_get_zonefiles( set([str(zfh) for zfh in zonefile_hashes]), config_path=conf['path'] )
+    missing = list(set([str(zfh) for zfh in zonefile_hashes if str(zfh) not in zonefiles]))
+
+    # skip the ones we just failed to find
+    missing = [zfh for zfh in missing if not negative_cache_get( 'zonefile', zfh, proxy=proxy )[0]]
+
+    # zonefiles that someone failed to look up (so they may not really be missing)
+    errored = set()
+
+    def fetch_from_peer( peer_hostport, zonefile_hashes ):
+        """
+        Get a batch of zonefiles from one peer
+        Return None on error
+        """
+        if peer_hostport == hostport:
+            res = get_zonefiles( peer_hostport, zonefile_hashes )
+        else:
+            res = get_zonefiles( peer_hostport, zonefile_hashes, timeout=ATLAS_READ_PEER_TIMEOUT )
+
+        if 'error' in res:
+            log.debug("Failed to get zonefiles from {}: {}".format(peer_hostport, res['error']))
+            if peer_hostport != hostport:
+                atlas_peer_note_failure( peer_hostport, config_path=conf['path'] )
+
+            return None
+
+        return res['zonefiles']
+
+    def fetch_missing( peer_hostport ):
+        """
+        Get all missing zonefiles from one peer
+        """
+        batches = [missing[i:i+MAX_ZONEFILES_PER_REQUEST] for i in xrange(0, len(missing), MAX_ZONEFILES_PER_REQUEST)]
+        for batch, res in zip(batches, storage.run_parallel( fetch_from_peer, [(peer_hostport, batch) for batch in batches], max_workers=max_workers )):
+            if res is None:
+                errored.update( batch )
+            else:
+                zonefiles.update( res )
+
+        log.debug('Fetched {} zonefiles from Atlas peer {}'.format(len(missing) - len([zfh for zfh in missing if zfh not in zonefiles]), peer_hostport))
+        return [zfh for zfh in missing if zfh not in zonefiles]
+
+    if len(missing) > 0:
+        missing = fetch_missing( hostport )
+
+    if len(missing) > 0:
+        # try the best Atlas peers we know of (see atlas_crawl()), or failing that, the Atlas node's peers
+        peers = [peer for peer in atlas_get_ranked_peers( config_path=conf['path'] ) if peer != hostport]
+        if len(peers) == 0:
+            try:
+                res = get_atlas_peers( hostport )
+                if 'error' in res:
+                    log.debug("Failed to get Atlas peers of {}: {}".format(hostport, res['error']))
+                else:
+                    peers = [str(peer) for peer in res['peers'] if str(peer) != hostport]
+
+            except Exception, e:
+                log.exception(e)
+                log.debug("Failed to get Atlas peers of {}".format(hostport))
+
+        for peer_hostport in peers:
+            if len(missing) == 0:
+                break
+
+            missing = fetch_missing( peer_hostport )
+
+    if len(missing) > 0:
+        # fall back to storage drivers
+        failed = []
+        res = storage.get_immutable_data_many( missing, hash_func=storage.get_zonefile_data_hash, zonefile=True, deserialize=False, drivers=storage_drivers, max_workers=max_workers, failed=failed )
+        zonefiles.update( res )
+        errored.update( failed )
+
+        for zfh in missing:
+            if zfh not in zonefiles and zfh not in errored:
+                negative_cache_put( 'zonefile', zfh )
+
+    return zonefiles
+
+
 def load_legacy_user_profile( name, expected_hash ):
     """
     Load a legacy user profile, and convert it into
@@ -235,12 +644,20 @@ def load_name_profile(name, user_zonefile, data_address, owner_address, use_zone
     if user_data_pubkey is None:
         log.warn("No data public key set; falling back to hash of data and/or owner public key for profile authentication")
 
+    cached, _ = negative_cache_get( 'profile', name )
+    if cached:
+        log.debug("No profile for %s (cached)" % name)
+        return None
+
     # get user's data public key from the zonefile
     urls = None
     if use_zonefile_urls:
         urls = user_db.user_zonefile_urls( user_zonefile )
 
-    user_profile = storage.get_mutable_data( name, user_data_pubkey, data_address=data_address, owner_address=owner_address, urls=urls, drivers=storage_drivers, decode=decode )
+    user_profile, error = storage.get_mutable_data_status( name, user_data_pubkey, data_address=data_address, owner_address=owner_address, urls=urls, drivers=storage_drivers, decode=decode )
+    if user_profile is None and error == "not found":
+        negative_cache_put( 'profile', name )
+
     return user_profile
 
 
@@ -294,7 +711,8 @@ def profile_update( name, user_zonefile, new_profile, owner_address, proxy=None,
     profile_payload = set_profile_timestamp( profile_payload )
 
     log.debug("Save updated profile for '%s' to %s at %s" % (name, ",".join(required_storage_drivers), get_profile_timestamp(profile_payload)))
-    rc = storage.put_mutable_data( name, profile_payload, data_privkey, required=required_storage_drivers )
+    rc = storage.put_mutable_data( name, profile_payload, data_privkey, required=required_storage_drivers, fingerprint_data=new_profile, config_path=proxy.conf['path'] )
+    negative_cache_forget( 'profile', name )
     if not rc:
         ret['error'] = 'Failed to update profile'
         return ret
@@ -328,8 +746,21 @@ def get_name_zonefile( name, storage_drivers=None, create_if_absent=False, proxy
         proxy = get_default_proxy()
 
     # find name record first
+    looked_up = False
     if name_record is None:
+        if not create_if_absent:
+            # did we just find out that there's no such name, or no zonefile?
+            cached, res = negative_cache_get( 'name', name, proxy=proxy )
+            if cached:
+                log.debug("No zonefile for %s (cached)" % name)
+                return res
+
         name_record = get_name_blockchain_record(name, proxy=proxy)
+        looked_up = True
+
+        if json_is_error(name_record) and 'not found' in str(name_record['error']).lower():
+            negative_cache_put( 'name', name, {'error': 'No such name'} )
+            return {'error': 'No such name'}
 
     if name_record is None:
         # failed to look up
@@ -349,6 +780,10 @@ def get_name_zonefile( name, storage_drivers=None, create_if_absent=False, proxy
 
         # no user data
         if not create_if_absent:
+            if looked_up:
+                # (e.g. revoked)
+                negative_cache_put( 'name', name, None )
+
             return None
 
         else:
@@ -426,6 +861,7 @@ def get_name_profile(name, zonefile_storage_drivers=None,
         proxy = get_default_proxy()
  
     raw_zonefile = None
+    zonefile_hash = None
 
     if user_zonefile is None:
         user_zonefile = get_name_zonefile( name, create_if_absent=create_if_absent, proxy=proxy, name_record=name_record, include_name_record=True, storage_drivers=zonefile_storage_drivers, include_raw_zonefile=include_raw_zonefile )
@@ -438,6 +874,9 @@ def get_name_profile(name, zonefile_storage_drivers=None,
         name_record = user_zonefile['name_record']
         del user_zonefile['name_record']
 
+        # the zonefile we just loaded is the one this hash refers to
+        zonefile_hash = name_record.get('value_hash', None)
+
         raw_zonefile = None
         if include_raw_zonefile:
             raw_zonefile = user_zonefile['raw_zonefile']
@@ -446,10 +885,10 @@ def get_name_profile(name, zonefile_storage_drivers=None,
         user_zonefile = user_zonefile['zonefile']
 
     # is this really a legacy profile?
-    if blockstack_profiles.is_profile_in_legacy_format( user_zonefile ):
-        # convert it
-        log.debug("Converting legacy profile to modern profile")
-        user_profile = blockstack_profiles.get_person_from_legacy_format( user_zonefile )
+    legacy_profile = convert_legacy_profile( user_zonefile, zonefile_hash=zonefile_hash, config_path=proxy.conf['path'] )
+    if legacy_profile is not None:
+        # converted
+        user_profile = legacy_profile
      
     elif not user_db.is_user_zonefile( user_zonefile ):
         # not a legacy profile, but a custom profile
@@ -517,7 +956,246 @@ def get_name_profile(name, zonefile_storage_drivers=None,
     return (user_profile, user_zonefile)
 
 
-def store_name_zonefile_data( name, user_zonefile_txt, txid, storage_drivers=None ):
+def get_name_profiles( names, zonefile_storage_drivers=None, profile_storage_drivers=None, proxy=None, include_name_record=False,
+                       use_zonefile_urls=True, decode_profile=True, max_workers=DEFAULT_STORAGE_WORKERS, name_records=None ):
+    """
+    Given a list of names, look up all of their profiles at once.
+    This is the bulk version of get_name_profile(), and runs as a pipeline of stages:
+    * look up all of the name records, with up to @max_workers concurrent lookups
+    * fetch all of the zonefiles with load_name_zonefiles()
+    * load all of the profiles from the storage drivers concurrently, and verify them
+      in a pool of @max_workers threads (with storage.get_mutable_data_many())
+
+    Legacy and custom zonefiles are handled the same way as in get_name_profile().
+    If the caller already has the name records, they can be passed as @name_records ({name: record}),
+    and the first stage is skipped for those names.
+
+    Return {'status': True, 'profiles': {name: result}, 'timings': {stage: seconds}} on success, where
+    each result is {'profile': ..., 'zonefile': ...} (and 'name_record', if @include_name_record is True),
+    or {'error': ...} if the name's profile could not be loaded.  The error also has 'missing': True
+    if the name has no zonefile, or its profile is known not to exist (as opposed to a failed fetch).
+    """
+
+    if proxy is None:
+        proxy = get_default_proxy()
+
+    names = list(set([str(name) for name in names]))
+    results = {}
+    timings = {}
+    begin = time.time()
+
+    # stage 1: name records.
+    # each worker thread gets its own connection
+    get_worker_proxy = make_thread_proxy_factory( proxy )
+
+    def lookup_name_record( name ):
+        return get_name_blockchain_record( name, proxy=get_worker_proxy() )
+
+    stage_begin = time.time()
+    known_name_records = name_records if name_records is not None else {}
+    lookup_names = []
+    for name in names:
+        if name in known_name_records:
+            continue
+
+        # did we just find out that there's no such name, or no zonefile?
+        cached, res = negative_cache_get( 'name', name, proxy=proxy )
+        if cached:
+            results[name] = res if res is not None else {'error': 'No user zonefile', 'missing': True}
+        else:
+            lookup_names.append( name )
+
+    name_records = dict( [(name, known_name_records[name]) for name in names if name in known_name_records] )
+    name_records.update( dict( zip(lookup_names, storage.run_parallel( lookup_name_record, [(name,) for name in lookup_names], max_workers=max_workers )) ) )
+    timings['name_records'] = time.time() - stage_begin
+
+    zonefile_hashes = {}
+    for name in name_records.keys():
+        name_record = name_records[name]
+        if name_record is None or 'error' in name_record or len(name_record) == 0:
+            results[name] = {'error': 'No such name'}
+            if name in lookup_names and json_is_error(name_record) and 'not found' in str(name_record['error']).lower():
+                negative_cache_put( 'name', name, {'error': 'No such name'} )
+
+        elif 'value_hash' not in name_record:
+            results[name] = {'error': 'Name has no user record hash defined'}
+
+        elif name_record['value_hash'] in [None, "null", ""]:
+            results[name] = {'error': 'No user zonefile', 'missing': True}
+            if name in lookup_names:
+                negative_cache_put( 'name', name, None )
+
+        else:
+            zonefile_hashes[name] = str(name_record['value_hash'])
+
+    # stage 2: zonefiles
+    stage_begin = time.time()
+    raw_zonefiles = load_name_zonefiles( zonefile_hashes.values(), storage_drivers=zonefile_storage_drivers, proxy=proxy, max_workers=max_workers )
+    timings['zonefiles'] = time.time() - stage_begin
+
+    user_zonefiles = {}
+    profile_requests = []
+    for name, zonefile_hash in zonefile_hashes.items():
+        if zonefile_hash not in raw_zonefiles:
+            log.error("Failed to load user zonefile '%s'" % zonefile_hash)
+            results[name] = {'error': 'Failed to load or decode user zonefile'}
+            continue
+
+        user_zonefile = decode_name_zonefile( raw_zonefiles[zonefile_hash] )
+        if user_zonefile is None:
+            results[name] = {'error': 'Failed to load or decode user zonefile'}
+            continue
+
+        user_zonefiles[name] = user_zonefile
+
+        # is this really a legacy profile?
+        legacy_profile = convert_legacy_profile( user_zonefile, zonefile_hash=zonefile_hash, config_path=proxy.conf['path'] )
+        if legacy_profile is not None:
+            # converted
+            results[name] = {'profile': legacy_profile}
+
+        elif not user_db.is_user_zonefile( user_zonefile ):
+            # not a legacy profile, but a custom profile
+            log.debug("Using custom legacy profile")
+            results[name] = {'profile': copy.deepcopy(user_zonefile)}
+
+        else:
+            # get user's data public key
+            user_data_pubkey = None
+            user_address = None
+            try:
+                user_data_pubkey = user_db.user_zonefile_data_pubkey( user_zonefile )
+                if user_data_pubkey is not None:
+                    user_data_pubkey = str(user_data_pubkey)
+                    user_address = virtualchain.BitcoinPublicKey(user_data_pubkey).address()
+
+            except ValueError:
+                # user decided to put multiple keys under the same name into the zonefile.
+                # so don't use them.
+                user_data_pubkey = None
+
+            old_address = name_records[name]['address']
+            if user_address is None:
+                # cut to the chase
+                user_address = old_address
+
+            req = {
+                'fq_data_id': name,
+                'data_pubkey': user_data_pubkey,
+                'data_address': user_address,
+                'owner_address': old_address,
+            }
+
+            if use_zonefile_urls:
+                req['urls'] = user_db.user_zonefile_urls( user_zonefile )
+
+            profile_requests.append( req )
+
+    # stage 3: profiles (skipping the ones we just failed to find)
+    stage_begin = time.time()
+    uncached_requests = []
+    for req in profile_requests:
+        if negative_cache_get( 'profile', req['fq_data_id'], proxy=proxy )[0]:
+            results[req['fq_data_id']] = {'error': 'Failed to load user profile', 'missing': True}
+        else:
+            uncached_requests.append( req )
+
+    profile_requests = uncached_requests
+    user_profiles = storage.get_mutable_data_many( profile_requests, drivers=profile_storage_drivers, decode=decode_profile, max_workers=max_workers )
+    timings['profiles'] = time.time() - stage_begin
+
+    for req in profile_requests:
+        name = req['fq_data_id']
+        user_profile = user_profiles.get( name, None )
+        if user_profile is None or (isinstance(user_profile, dict) and 'error' in user_profile and len(user_profile.keys()) == 1):
+            log.debug("WARN: no user profile for %s" % name)
+            results[name] = {'error': 'Failed to load user profile'}
+            if user_profile == {'error': 'No data found'}:
+                # every driver said so; not just a failed fetch
+                results[name]['missing'] = True
+                negative_cache_put( 'profile', name )
+        else:
+            results[name] = {'profile': user_profile}
+
+    for name in user_zonefiles.keys():
+        if 'error' not in results[name]:
+            results[name]['zonefile'] = user_zonefiles[name]
+            if include_name_record:
+                results[name]['name_record'] = name_records[name]
+
+    timings['total'] = time.time() - begin
+    log.debug("Resolved %s of %s profiles in %s seconds (%s)" % (len([r for r in results.values() if 'error' not in r]), len(names), timings['total'],
+              ", ".join(["%s: %.3f" % (stage, timings[stage]) for stage in ['name_records', 'zonefiles', 'profiles']])))
+
+    return {'status': True, 'profiles': results, 'timings': timings}
+
+
+def convert_legacy_profiles( names, proxy=None, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Convert the legacy profiles of a list of names ahead of time, and store the
+    conversions in the legacy profile cache (see convert_legacy_profile()).
+    Name records are looked up with up to @max_workers concurrent lookups,
+    and zonefiles are fetched in bulk with load_name_zonefiles().
+
+    Return {'status': True, 'converted': [names], 'cached': [names], 'not_legacy': [names], 'errors': {name: error}}
+    """
+
+    if proxy is None:
+        proxy = get_default_proxy()
+
+    config_path = proxy.conf['path']
+    names = list(set([str(name) for name in names]))
+    get_worker_proxy = make_thread_proxy_factory( proxy )
+
+    def lookup_name_record( name ):
+        return get_name_blockchain_record( name, proxy=get_worker_proxy() )
+
+    name_records = dict( zip(names, storage.run_parallel( lookup_name_record, [(name,) for name in names], max_workers=max_workers )) )
+
+    ret = {'status': True, 'converted': [], 'cached': [], 'not_legacy': [], 'errors': {}}
+    zonefile_hashes = {}
+
+    for name, name_record in name_records.items():
+        if name_record is None or json_is_error(name_record):
+            ret['errors'][name] = 'No such name'
+
+        elif name_record.get('value_hash', None) in [None, "null", ""]:
+            ret['errors'][name] = 'No user zonefile'
+
+        elif legacy_profile_cache_get( str(name_record['value_hash']), config_path=config_path ) is not None:
+            ret['cached'].append( name )
+
+        else:
+            zonefile_hashes[name] = str(name_record['value_hash'])
+
+    raw_zonefiles = load_name_zonefiles( zonefile_hashes.values(), proxy=proxy, max_workers=max_workers )
+
+    for name, zonefile_hash in zonefile_hashes.items():
+        if zonefile_hash not in raw_zonefiles:
+            ret['errors'][name] = 'Failed to load user zonefile'
+            continue
+
+        user_zonefile = decode_name_zonefile( raw_zonefiles[zonefile_hash] )
+        if user_zonefile is None:
+            ret['errors'][name] = 'Failed to decode user zonefile'
+            continue
+
+        try:
+            profile = convert_legacy_profile( user_zonefile, zonefile_hash=zonefile_hash, config_path=config_path )
+        except Exception, e:
+            log.exception(e)
+            ret['errors'][name] = 'Failed to convert legacy profile'
+            continue
+
+        if profile is None:
+            ret['not_legacy'].append( name )
+        else:
+            ret['converted'].append( name )
+
+    return ret
+
+
+def store_name_zonefile_data( name, user_zonefile_txt, txid, storage_drivers=None, config_path=CONFIG_PATH ):
     """
     Store a serialized zonefile to immutable storage providers, synchronously.
     This is only necessary if we've added/changed/removed immutable data.
@@ -529,7 +1207,7 @@ def store_name_zonefile_data( name, user_zonefile_txt, txid, storage_drivers=Non
     storage_drivers = [] if storage_drivers is None else storage_drivers
 
     data_hash = storage.get_zonefile_data_hash( user_zonefile_txt )
-    result = storage.put_immutable_data(None, txid, data_hash=data_hash, data_text=user_zonefile_txt, required=storage_drivers )
+    result = storage.put_immutable_data(None, txid, data_hash=data_hash, data_text=user_zonefile_txt, required=storage_drivers, config_path=config_path )
 
     rc = None
     if result is None:
@@ -540,7 +1218,7 @@ def store_name_zonefile_data( name, user_zonefile_txt, txid, storage_drivers=Non
     return (rc, data_hash)
 
 
-def store_name_zonefile( name, user_zonefile, txid, storage_drivers=None ):
+def store_name_zonefile( name, user_zonefile, txid, storage_drivers=None, config_path=CONFIG_PATH ):
     """
     Store JSON user zonefile data to the immutable storage providers, synchronously.
     This is only necessary if we've added/changed/removed immutable data.
@@ -556,10 +1234,10 @@ def store_name_zonefile( name, user_zonefile, txid, storage_drivers=None ):
 
     # serialize and send off
     user_zonefile_txt = blockstack_zones.make_zone_file( user_zonefile, origin=name, ttl=USER_ZONEFILE_TTL )
-    return store_name_zonefile_data( name, user_zonefile_txt, txid, storage_drivers=storage_drivers )
+    return store_name_zonefile_data( name, user_zonefile_txt, txid, storage_drivers=storage_drivers, config_path=config_path )
 
 
-def remove_name_zonefile(user, txid):
+def remove_name_zonefile(user, txid, privkey, config_path=CONFIG_PATH):
     """
     Delete JSON user zonefile data from immutable storage providers, synchronously.
 
@@ -570,7 +1248,7 @@ def remove_name_zonefile(user, txid):
     # serialize
     user_json = json.dumps(user, sort_keys=True)
     data_hash = storage.get_data_hash(user_json)
-    result = storage.delete_immutable_data(data_hash, txid)
+    result = storage.delete_immutable_data(data_hash, txid, privkey, config_path=config_path)
 
     rc = None
     if result is None:
@@ -645,7 +1323,7 @@ def get_and_migrate_profile( name, zonefile_storage_drivers=None, profile_storag
         user_profile = {}
         if blockstack_profiles.is_profile_in_legacy_format( user_zonefile ):
             # traditional profile
-            user_profile = blockstack_profiles.get_person_from_legacy_format( user_zonefile )
+            user_profile = convert_legacy_profile( user_zonefile, zonefile_hash=name_record.get('value_hash', None), config_path=proxy.conf['path'] )
         else:
             # custom profile 
             user_profile = copy.deepcopy( user_zonefile )
@@ -685,39 +1363,153 @@ def get_and_migrate_profile( name, zonefile_storage_drivers=None, profile_storag
     return (ret_user_profile, ret_user_zonefile, created_new_zonefile)
 
 
-def zonefile_data_publish(fqu, zonefile_txt, server_list, wallet_keys=None):
+def atlas_peer_record( hostport, success, latency ):
+    """
+    Record the outcome of a request to an Atlas peer.
+    """
+    global atlas_peer_stats, atlas_peer_stats_lock
+
+    with atlas_peer_stats_lock:
+        stats = atlas_peer_stats.get( hostport, None )
+        if stats is None:
+            stats = {'attempts': 0, 'successes': 0, 'latency': latency}
+            atlas_peer_stats[hostport] = stats
+
+        stats['attempts'] += 1
+        if success:
+            stats['successes'] += 1
+
+        stats['latency'] = ATLAS_PEER_LATENCY_EWMA * latency + (1.0 - ATLAS_PEER_LATENCY_EWMA) * stats['latency']
+
+
+def atlas_peer_get_stats( hostport=None ):
+    """
+    Get the recorded statistics for one Atlas peer, or all of them.
+    Each peer's statistics are {'attempts': ..., 'successes': ..., 'success_rate': ..., 'latency': ...},
+    where 'latency' is a moving average, in seconds.
+
+    Return the statistics for @hostport (None if we have none), or {hostport: statistics} if @hostport is None
+    """
+    with atlas_peer_stats_lock:
+        all_stats = dict( [(hp, dict(stats)) for (hp, stats) in atlas_peer_stats.items()] )
+
+    for stats in all_stats.values():
+        stats['success_rate'] = float(stats['successes']) / stats['attempts'] if stats['attempts'] > 0 else 0.0
+
+    if hostport is not None:
+        return all_stats.get( hostport, None )
+
+    return all_stats
+
+
+def atlas_peer_is_unreliable( hostport ):
+    """
+    Has an Atlas peer failed most of the requests we sent it?
+    """
+    stats = atlas_peer_get_stats( hostport )
+    if stats is None or stats['attempts'] < ATLAS_PEER_MIN_ATTEMPTS:
+        return False
+
+    return stats['success_rate'] < ATLAS_PEER_MIN_SUCCESS_RATE
+
+
+def atlas_peer_rank( hostports ):
+    """
+    Sort a list of "host:port" strings so the best Atlas peers come first:
+    highest success rate, then lowest latency.  Peers we know nothing
+    about go right after the ones that always succeeded.
+
+    Return the sorted list
+    """
+    all_stats = atlas_peer_get_stats()
+
+    def rank( hostport ):
+        stats = all_stats.get( hostport, None )
+        if stats is None:
+            # unknown; worth a try
+            return (-1.0, float('inf'))
+
+        return (-stats['success_rate'], stats['latency'])
+
+    return sorted( hostports, key=rank )
+
+
+def zonefile_data_publish(fqu, zonefile_txt, server_list, wallet_keys=None, quorum=DEFAULT_ZONEFILE_PUBLISH_QUORUM):
     """
     Replicate a zonefile to as many blockstack servers as possible.
     @server_list is a list of (host, port) tuple
-    Return {'status': True, 'servers': ...} on success, if we succeeded to replicate at least once.
+
+    The zonefile is sent to all servers concurrently, and each server is retried
+    with exponential backoff.  Once @quorum servers have stored it, we return;
+    the remaining servers keep being tried in the background.
+    Each attempt is recorded in the per-peer statistics (see atlas_peer_get_stats()).
+
+    Return {'status': True, 'servers': ...} on success, if we succeeded to replicate at least @quorum times.
         'servers' will be a list of (host, port) tuples
-    Return {'error': ...} if we failed on all accounts.
+    Return {'error': ...} if we failed to reach the quorum.
     """
+    if len(server_list) == 0:
+        return {'error': 'No servers given'}
+
+    quorum = max(1, min(quorum, len(server_list)))
+    zonefile_b64 = base64.b64encode(zonefile_txt)
+
     successful_servers = []
-    for server_host, server_port in server_list:
-        try:
+    num_finished = [0]
+    publish_cv = threading.Condition()
+
+    def publish( server_host, server_port ):
+        hostport = '{}:{}'.format(server_host, server_port)
+        saved = False
+
+        for attempt in xrange(0, ZONEFILE_PUBLISH_MAX_ATTEMPTS):
+            if attempt > 0:
+                time.sleep( ZONEFILE_PUBLISH_BACKOFF * (2 ** (attempt - 1)) )
+
+            begin = time.time()
+            try:
+                log.debug("Replicate zonefile to %s:%s" % (server_host, server_port))
+                res = put_zonefiles( hostport, [zonefile_b64] )
+                if 'error' in res or res['saved'][0] != 1:
+                    log.error("Failed to publish zonefile to %s:%s: %s" % (server_host, server_port, res.get('error', 'not saved')))
+                else:
+                    saved = True
+
+            except Exception, e:
+                log.exception(e)
+                log.error("Failed to publish zonefile to %s:%s" % (server_host, server_port))
 
-            log.debug("Replicate zonefile to %s:%s" % (server_host, server_port))
-            hostport = '{}:{}'.format(server_host, server_port)
+            atlas_peer_record( hostport, saved, time.time() - begin )
+            if saved:
+                log.debug("Replicated zonefile to %s:%s" % (server_host, server_port))
+                break
 
-            res = put_zonefiles( hostport, [base64.b64encode(zonefile_txt)] )
-            if 'error' in res or res['saved'][0] != 1:
-                log.error("Failed to publish zonefile to %s:%s: %s" % (server_host, server_port, res['error']))
-                continue
+        with publish_cv:
+            if saved:
+                successful_servers.append( (server_host, server_port) )
 
-            log.debug("Replicated zonefile to %s:%s" % (server_host, server_port))
-            successful_servers.append( (server_host, server_port) )
+            num_finished[0] += 1
+            publish_cv.notify_all()
 
-        except Exception, e:
-            log.exception(e)
-            log.error("Failed to publish zonefile to %s:%s" % (server_host, server_port))
-            continue
+    for server_host, server_port in server_list:
+        t = threading.Thread( target=publish, args=(server_host, server_port) )
+        t.daemon = True
+        t.start()
+
+    with publish_cv:
+        while len(successful_servers) < quorum and num_finished[0] < len(server_list):
+            publish_cv.wait( 1.0 )
+
+        servers = list(successful_servers)
+
+    if len(servers) >= quorum:
+        if len(servers) < len(server_list):
+            log.debug("Published zonefile for %s to %s of %s server(s); continuing in the background" % (fqu, len(servers), len(server_list)))
 
-    if len(successful_servers) > 0:
-        return {'status': True, 'servers': successful_servers}
+        return {'status': True, 'servers': servers}
 
     else:
-        return {'error': 'Failed to publish zonefile to all backend providers'}
+        return {'error': 'Failed to publish zonefile to a quorum of %s backend providers' % quorum}
 
 
 def zonefile_data_replicate( fqu, zonefile_data, tx_hash, server_list, config_path=CONFIG_PATH, storage_drivers=None ):
@@ -746,13 +1538,15 @@ def zonefile_data_replicate( fqu, zonefile_data, tx_hash, server_list, config_pa
     assert len(required_storage_drivers) > 0, "No zonefile storage drivers specified"
 
     # replicate to our own storage providers
-    rc = store_name_zonefile_data( fqu, zonefile_data, tx_hash, storage_drivers=required_storage_drivers )
+    rc = store_name_zonefile_data( fqu, zonefile_data, tx_hash, storage_drivers=required_storage_drivers, config_path=config_path )
+    negative_cache_forget( 'zonefile', storage.get_zonefile_data_hash(zonefile_data) )
     if not rc:
         log.info("Failed to replicate zonefile for %s to %s" % (fqu))
         return {'error': 'Failed to store user zonefile'}
 
     # replicate to blockstack servers
-    res = zonefile_data_publish( fqu, zonefile_data, server_list ) 
+    quorum = int(conf.get('zonefile_publish_quorum', DEFAULT_ZONEFILE_PUBLISH_QUORUM))
+    res = zonefile_data_publish( fqu, zonefile_data, server_list, quorum=quorum )
     if 'error' in res:
         return res
 
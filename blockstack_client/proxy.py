@@ -34,6 +34,7 @@ import pprint
 import random
 import time
 import copy
+import threading
 import blockstack_profiles
 import blockstack_zones
 import urllib
@@ -469,6 +470,26 @@ class BlockstackRPCClient(object):
             return inner
 
 
+def make_thread_proxy_factory( proxy ):
+    """
+    Make a function that gives each calling thread its own
+    connection to the same server as @proxy
+    """
+    thread_proxies = threading.local()
+
+    def get_thread_proxy():
+        if not isinstance(proxy, BlockstackRPCClient):
+            return proxy
+
+        if not hasattr(thread_proxies, 'proxy'):
+            thread_proxies.proxy = BlockstackRPCClient( proxy.server, proxy.port )
+            thread_proxies.proxy.conf = proxy.conf
+
+        return thread_proxies.proxy
+
+    return get_thread_proxy
+
+
 def get_default_proxy(config_path=CONFIG_PATH):
     """
     Get the default API proxy to blockstack.
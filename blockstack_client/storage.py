@@ -36,14 +36,20 @@ import re
 import base64
 import json
 import hashlib
+import hmac
+import copy
 import urllib
 import urllib2
+import threading
+import time
+import Queue
 import blockstack_zones
-from collections import defaultdict
+from cStringIO import StringIO
+from collections import defaultdict, OrderedDict
 
 import blockstack_profiles 
 
-from config import LENGTH_MAX_NAME, get_logger, CONFIG_PATH
+from config import LENGTH_MAX_NAME, get_logger, get_config, CONFIG_PATH, DEFAULT_STORAGE_WORKERS
 from scripts import is_name_valid
 import keys
 
@@ -60,6 +66,42 @@ URLENCODED_CLASS = '[a-zA-Z0-9\-_.~%]'
 # global list of registered data handlers
 storage_handlers = []
 
+# metadata directory for each config file (see get_metadata_dir())
+metadata_dirs = {}
+
+# methods every storage driver must implement
+STORAGE_DRIVER_METHODS = ["make_mutable_url", "get_immutable_handler", "get_mutable_handler", \
+                          "put_immutable_handler", "put_mutable_handler", \
+                          "delete_immutable_handler", "delete_mutable_handler" ]
+
+# optional libsecp256k1 bindings for fast signature verification.
+# set BLOCKSTACK_SECP256K1_BACKEND=python to force the pure-python ecdsa path.
+coincurve = None
+if os.environ.get("BLOCKSTACK_SECP256K1_BACKEND", None) != "python":
+    try:
+        import coincurve
+    except ImportError:
+        coincurve = None
+
+# LRU cache of verifying keys, keyed by hex public key
+VERIFIER_CACHE_SIZE = 4096
+verifier_cache = OrderedDict()
+verifier_cache_lock = threading.Lock()
+
+# LRU cache of parsed zonefiles, keyed by zonefile hash.
+# zonefiles are content-addressed, so entries never go stale.
+ZONEFILE_CACHE_SIZE = 1024
+zonefile_cache = OrderedDict()
+zonefile_cache_lock = threading.Lock()
+zonefile_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# negative cache of mutable data URLs that returned nothing,
+# keyed by (driver name, URL), with the time each entry expires.
+DEAD_URL_CACHE_TTL = 300
+DEAD_URL_CACHE_SIZE = 4096
+dead_url_cache = OrderedDict()
+dead_url_cache_lock = threading.Lock()
+
 
 def is_b40(s):
     return (isinstance(s, str) and (re.match(B40_REGEX, s) is not None))
@@ -116,16 +158,82 @@ def get_blockchain_compat_hash( data_txt ):
    return pybitcoin.hex_hash160( data_txt )
 
 
-def hash_zonefile( zonefile_json ):
+def serialize_zonefile( zonefile_json ):
     """
-    Given a JSON-ized zonefile, calculate its hash
+    Given a JSON-ized zonefile, serialize it and calculate its hash
+    in one pass, so callers that need both don't serialize it twice.
+    Return {'zonefile_text': serialized zonefile, 'zonefile_hash': hash}
     """
     assert "$origin" in zonefile_json.keys(), "Missing $origin"
     assert "$ttl" in zonefile_json.keys(), "Missing $ttl"
 
     user_zonefile_txt = blockstack_zones.make_zone_file( zonefile_json )
     data_hash = get_zonefile_data_hash( user_zonefile_txt )
-    return data_hash
+    return {'zonefile_text': user_zonefile_txt, 'zonefile_hash': data_hash}
+
+
+def hash_zonefile( zonefile_json ):
+    """
+    Given a JSON-ized zonefile, calculate its hash
+    """
+    return serialize_zonefile( zonefile_json )['zonefile_hash']
+
+
+def parse_zonefile( zonefile_txt ):
+    """
+    Parse a serialized zonefile into a dict, with blockstack_zones.parse_zone_file().
+    Parsed zonefiles are cached by hash, so each distinct zonefile is only parsed once.
+    Each call returns a fresh copy, which the caller is free to modify.
+
+    Return the zonefile dict on success
+    Raise whatever parse_zone_file() raises if it is not a valid zonefile
+    """
+    global zonefile_cache, zonefile_cache_lock, zonefile_cache_stats
+
+    zonefile_hash = get_zonefile_data_hash( zonefile_txt )
+
+    with zonefile_cache_lock:
+        entry = zonefile_cache.pop( zonefile_hash, None )
+        if entry is not None:
+            # most-recently used goes last
+            zonefile_cache[zonefile_hash] = entry
+            zonefile_cache_stats['hits'] += 1
+
+        else:
+            zonefile_cache_stats['misses'] += 1
+
+    if entry is None:
+        try:
+            # force dict, not defaultdict
+            entry = {'zonefile': dict(blockstack_zones.parse_zone_file( zonefile_txt ))}
+        except Exception, e:
+            # not a zonefile; remember that too
+            entry = {'exception': e}
+
+        with zonefile_cache_lock:
+            zonefile_cache[zonefile_hash] = entry
+            while len(zonefile_cache) > ZONEFILE_CACHE_SIZE:
+                zonefile_cache.popitem( last=False )
+                zonefile_cache_stats['evictions'] += 1
+
+    if entry.has_key('exception'):
+        raise entry['exception']
+
+    return copy.deepcopy( entry['zonefile'] )
+
+
+def get_zonefile_cache_stats():
+    """
+    Get the parsed-zonefile cache's counters.
+    Return {'hits': ..., 'misses': ..., 'evictions': ..., 'size': ..., 'hit_rate': ...}
+    """
+    with zonefile_cache_lock:
+        stats = dict(zonefile_cache_stats)
+        stats['size'] = len(zonefile_cache)
+
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = float(stats['hits']) / lookups if lookups > 0 else 0.0
+    return stats
 
 
 def verify_zonefile( zonefile_str, value_hash ):
@@ -141,12 +249,25 @@ def verify_zonefile( zonefile_str, value_hash ):
     return True
 
 
-def get_storage_handlers():
+def get_storage_handlers( drivers=None ):
    """
-   Get the list of loaded storage handler instances
+   Get the list of loaded storage handler instances.
+   If @drivers is given, then only get the ones named in it
+   (in the order given).
    """
    global storage_handlers
-   return storage_handlers
+
+   if drivers is None or len(drivers) == 0:
+       return storage_handlers
+
+   # whitelist of drivers to use
+   handlers_to_use = []
+   for d in drivers:
+       for h in storage_handlers:
+           if h.__name__ == d:
+               handlers_to_use.append(h)
+
+   return handlers_to_use
 
 
 def make_mutable_data_urls( data_id, use_only=None ):
@@ -223,7 +344,7 @@ def parse_mutable_data( mutable_data_json_txt, public_key, public_key_hash=None
 
    # try pubkey, if given 
    if public_key is not None:
-       mutable_data_json = blockstack_profiles.get_profile_from_tokens( mutable_data_jwt, public_key )
+       mutable_data_json = get_profile_from_tokens( mutable_data_jwt, public_key=public_key )
        if len(mutable_data_json) > 0:
            return mutable_data_json
        else:
@@ -233,7 +354,7 @@ def parse_mutable_data( mutable_data_json_txt, public_key, public_key_hash=None
    if public_key_hash is not None:
        # NOTE: these should always have version byte 0
        public_key_hash_0 = keylib.address_formatting.bin_hash160_to_address( keylib.address_formatting.address_to_bin_hash160( str(public_key_hash) ), version_byte=0 )
-       mutable_data_json = blockstack_profiles.get_profile_from_tokens( mutable_data_jwt, public_key_hash_0 )
+       mutable_data_json = get_profile_from_tokens( mutable_data_jwt, address=public_key_hash_0 )
        if len(mutable_data_json) > 0:
            log.debug("Verified with %s" % public_key_hash)
            return mutable_data_json
@@ -262,9 +383,7 @@ def register_storage( storage_impl ):
    storage_handlers.append( storage_impl )
 
    # sanity check
-   for expected_method in ["make_mutable_url", "get_immutable_handler", "get_mutable_handler", \
-                           "put_immutable_handler", "put_mutable_handler", \
-                           "delete_immutable_handler", "delete_mutable_handler" ]:
+   for expected_method in STORAGE_DRIVER_METHODS:
 
       if not hasattr( storage_impl, expected_method ):
          log.warning("Storage implementation is missing a '%s' method" % expected_method )
@@ -272,6 +391,86 @@ def register_storage( storage_impl ):
    return True
 
 
+def fetch_url_hint( data_url ):
+   """
+   Fetch data from a URL hint.  Use the storage drivers
+   that handle this kind of URL (so we get their connection pooling
+   and caching), and fall back to urlopen() only if none of them do.
+
+   Return the data on success
+   Return None on error
+   """
+
+   global storage_handlers
+
+   handled = False
+   for handler in storage_handlers:
+      if not hasattr(handler, "handles_url") or not hasattr(handler, "get_mutable_handler"):
+         continue
+
+      if not handler.handles_url( data_url ):
+         continue
+
+      handled = True
+      try:
+         data = handler.get_mutable_handler( data_url )
+      except Exception, e:
+         log.exception(e)
+         continue
+
+      if data is not None:
+         return data
+
+   if handled:
+      # a driver already tried (and failed) to fetch it
+      return None
+
+   try: 
+      # assume it's something we can urlopen 
+      urlh = urllib2.urlopen( data_url )
+      data = urlh.read()
+      urlh.close()
+      return data
+   except Exception, e:
+      log.exception(e)
+      return None
+
+
+def fetch_url_hint_stream( data_url ):
+   """
+   Open a stream to a URL hint, with a storage driver that
+   can stream this kind of URL.  Otherwise, fetch it
+   with fetch_url_hint() and buffer it.
+
+   Return a file-like object on success
+   Return None on error
+   """
+
+   global storage_handlers
+
+   for handler in storage_handlers:
+      if not hasattr(handler, "handles_url") or not hasattr(handler, "get_url_stream_handler"):
+         continue
+
+      if not handler.handles_url( data_url ):
+         continue
+
+      try:
+         stream = handler.get_url_stream_handler( data_url )
+      except Exception, e:
+         log.exception(e)
+         continue
+
+      if stream is not None:
+         return stream
+
+   data = fetch_url_hint( data_url )
+   if data is None:
+      return None
+
+   return StringIO(data)
+
+
 def get_immutable_data( data_hash, data_url=None, hash_func=get_data_hash, fqu=None, data_id=None, zonefile=False, deserialize=True, drivers=None ):
    """
    Given the hash of the data, go through the list of
@@ -283,22 +482,26 @@ def get_immutable_data( data_hash, data_url=None, hash_func=get_data_hash, fqu=N
    Return the data (as a dict) on success.
    Return None on failure
    """
+   data, error = get_immutable_data_status( data_hash, data_url=data_url, hash_func=hash_func, fqu=fqu, data_id=data_id, zonefile=zonefile, deserialize=deserialize, drivers=drivers )
+   return data
+
+
+def get_immutable_data_status( data_hash, data_url=None, hash_func=get_data_hash, fqu=None, data_id=None, zonefile=False, deserialize=True, drivers=None ):
+   """
+   Look up immutable data like get_immutable_data(), and say why if it can't be found.
+
+   Return (data, None) on success
+   Return (None, "not found") if every driver found nothing
+   Return (None, "error") if any driver failed, or gave us data that didn't match the hash
+   """
 
    global storage_handlers
    if len(storage_handlers) == 0:
        log.debug("No storage handlers registered")
-       return None
+       return (None, "error")
 
-   handlers_to_use = []
-   if drivers is not None and len(drivers) > 0:
-       # whitelist of drivers to try 
-       for d in drivers:
-           for h in storage_handlers:
-               if h.__name__ == d:
-                   handlers_to_use.append(h)
-
-   else:
-       handlers_to_use = storage_handlers
+   handlers_to_use = get_storage_handlers( drivers )
+   errored = False
 
    log.debug("get_immutable %s" % data_hash)
 
@@ -312,13 +515,8 @@ def get_immutable_data( data_hash, data_url=None, hash_func=get_data_hash, fqu=N
 
       if handler == data_url:
          # url hint
-         try: 
-            # assume it's something we can urlopen 
-            urlh = urllib2.urlopen( data_url )
-            data = urlh.read()
-            urlh.close()
-         except Exception, e:
-            log.exception(e)
+         data = fetch_url_hint( data_url )
+         if data is None:
             log.error("Failed to load profile from '%s'" % data_url)
             continue
 
@@ -334,6 +532,7 @@ def get_immutable_data( data_hash, data_url=None, hash_func=get_data_hash, fqu=N
          except Exception, e:
             log.exception( e )
             log.debug("Method failed: %s.get_immutable_handler(%s)" % (handler, data_hash))
+            errored = True
             continue
 
       if data is None:
@@ -348,6 +547,7 @@ def get_immutable_data( data_hash, data_url=None, hash_func=get_data_hash, fqu=N
              log.error("Invalid data hash from '%s'" % data_url)
          else:
              log.error("Invalid data hash from %s.get_immutable_handler" % (handler.__name__))
+             errored = True
 
          continue
 
@@ -357,17 +557,228 @@ def get_immutable_data( data_hash, data_url=None, hash_func=get_data_hash, fqu=N
               data_dict = json.loads(data)
           except ValueError:
               log.error("Invalid JSON for %s" % data_hash)
+              errored = True
               continue
 
       else:
           data_dict = data
 
       log.debug("loaded %s with %s" % (data_hash, handler.__name__))
-      return data_dict
+      return (data_dict, None)
 
-   return None
+   if errored:
+      return (None, "error")
+
+   return (None, "not found")
 
 
+def get_immutable_data_many( data_hashes, hash_func=get_data_hash, zonefile=False, deserialize=True, drivers=None, max_workers=DEFAULT_STORAGE_WORKERS, failed=None ):
+    """
+    Fetch many pieces of immutable data at once.
+
+    Drivers are tried in priority order, each with only the hashes that are
+    still missing.  Drivers that implement get_immutable_batch_handler()
+    are asked for all of them in one call; the others are asked for each
+    one with up to @max_workers concurrent get_immutable_handler() calls.
+
+    If @failed is given, the hashes that were not found and that some driver
+    failed to look up (or gave bad data for) are appended to it, so the
+    caller can tell them apart from definite misses.
+
+    Return {data hash: data} for each piece of data that was found and whose hash matched.
+    """
+
+    results = {}
+    errored = set()
+    pending = list(set(data_hashes))
+    handlers_to_use = get_storage_handlers( drivers )
+
+    log.debug("get_immutable_many %s items" % len(pending))
+
+    for handler in handlers_to_use:
+
+        if len(pending) == 0:
+            break
+
+        loaded = {}
+        if hasattr( handler, "get_immutable_batch_handler" ):
+            batch_failed = []
+            try:
+                loaded = handler.get_immutable_batch_handler( pending, zonefile=zonefile, failed=batch_failed )
+            except Exception, e:
+                log.exception(e)
+                log.debug("Method failed: %s.get_immutable_batch_handler" % handler.__name__)
+                batch_failed = pending
+
+            errored.update( batch_failed )
+            if loaded is None:
+                loaded = {}
+
+        elif hasattr( handler, "get_immutable_handler" ):
+            # calls that raise come back as None
+            fetched = run_parallel( lambda h: (handler.get_immutable_handler( h, zonefile=zonefile ),), [(h,) for h in pending], max_workers=max_workers )
+            for data_hash, res in zip(pending, fetched):
+                if res is None:
+                    errored.add( data_hash )
+                elif res[0] is not None:
+                    loaded[data_hash] = res[0]
+
+        else:
+            continue
+
+        for data_hash in pending:
+            data = loaded.get( data_hash, None )
+            if data is None:
+                continue
+
+            # validate
+            if hash_func(data) != data_hash:
+                log.error("Invalid data hash for %s from %s" % (data_hash, handler.__name__))
+                errored.add( data_hash )
+                continue
+
+            if deserialize:
+                try:
+                    data = json.loads(data)
+                except ValueError:
+                    log.error("Invalid JSON for %s" % data_hash)
+                    errored.add( data_hash )
+                    continue
+
+            results[data_hash] = data
+
+        log.debug("loaded %s item(s) with %s" % (len(loaded), handler.__name__))
+        pending = [h for h in pending if not results.has_key(h)]
+
+    if failed is not None:
+        failed.extend( [h for h in pending if h in errored] )
+
+    return results
+
+
+
+
+class HashVerifyingReader( object ):
+    """
+    File-like wrapper around a driver's data stream.
+    Hashes the data incrementally as it is read, and
+    raises IOError at EOF if it does not match the expected hash.
+    """
+
+    def __init__(self, stream, data_hash, hash_type="sha256", name=None):
+        assert hash_type in ["sha256", "hash160"], "Unsupported hash type %s" % hash_type
+
+        self.stream = stream
+        self.data_hash = str(data_hash)
+        self.hash_type = hash_type
+        self.hasher = hashlib.sha256()
+        self.name = name
+        self.verified = False
+        self.eof = False
+
+    def digest(self):
+        """
+        Get the hex digest of everything read so far
+        """
+        if self.hash_type == "sha256":
+            return self.hasher.hexdigest()
+        else:
+            return hashlib.new('ripemd160', self.hasher.digest()).hexdigest()
+
+    def read(self, numbytes=-1):
+        """
+        Read up to numbytes bytes (or everything, if negative).
+        Raise IOError if the stream ends and the hash does not match.
+        """
+        if self.eof:
+            return ""
+
+        if numbytes is None or numbytes < 0:
+            buf = self.stream.read()
+        else:
+            buf = self.stream.read(numbytes)
+
+        if len(buf) > 0:
+            self.hasher.update(buf)
+
+        if len(buf) == 0 or numbytes is None or numbytes < 0:
+            # end of stream
+            self.eof = True
+            dh = self.digest()
+            if dh != self.data_hash:
+                log.error("Invalid data hash from %s: expected %s, got %s" % (self.name, self.data_hash, dh))
+                raise IOError("Data hash mismatch: expected %s, got %s" % (self.data_hash, dh))
+
+            self.verified = True
+
+        return buf
+
+    def close(self):
+        if hasattr(self.stream, "close"):
+            self.stream.close()
+
+
+def get_immutable_data_stream( data_hash, data_url=None, hash_type="sha256", fqu=None, data_id=None, zonefile=False, drivers=None ):
+    """
+    Given the hash of the data, find a storage handler that has it
+    and open a stream to it.  If @data_url is given, it is tried
+    first (as in get_immutable_data()), and is streamed if a driver
+    that handles it implements get_url_stream_handler() (i.e. http).
+    Drivers that implement get_immutable_stream_handler() (disk, s3)
+    will be streamed from directly; the others' data (i.e. dht) will
+    be buffered once and read through the same verifying wrapper.
+
+    The data is verified incrementally as it is read; the returned
+    stream raises IOError at EOF if the data does not match @data_hash.
+
+    Return a HashVerifyingReader on success
+    Return None if no handler could open the data
+    """
+
+    handlers_to_use = get_storage_handlers( drivers )
+
+    log.debug("get_immutable_stream %s" % data_hash)
+
+    if data_url is not None:
+        # url hint
+        stream = fetch_url_hint_stream( data_url )
+        if stream is not None:
+            log.debug("streaming %s from %s" % (data_hash, data_url))
+            return HashVerifyingReader( stream, data_hash, hash_type=hash_type, name=data_url )
+
+        log.error("Failed to load data from '%s'" % data_url)
+
+    for handler in handlers_to_use:
+
+        stream = None
+
+        if hasattr( handler, "get_immutable_stream_handler" ):
+            try:
+                stream = handler.get_immutable_stream_handler( data_hash, data_id=data_id, zonefile=zonefile, fqu=fqu )
+            except Exception, e:
+                log.exception(e)
+                log.debug("Method failed: %s.get_immutable_stream_handler(%s)" % (handler.__name__, data_hash))
+                continue
+
+        elif hasattr( handler, "get_immutable_handler" ):
+            try:
+                data = handler.get_immutable_handler( data_hash, data_id=data_id, zonefile=zonefile, fqu=fqu )
+            except Exception, e:
+                log.exception(e)
+                log.debug("Method failed: %s.get_immutable_handler(%s)" % (handler.__name__, data_hash))
+                continue
+
+            if data is not None:
+                stream = StringIO(data)
+
+        if stream is None:
+            log.debug("No data: %s(%s)" % (handler.__name__, data_hash))
+            continue
+
+        log.debug("streaming %s with %s" % (data_hash, handler.__name__))
+        return HashVerifyingReader( stream, data_hash, hash_type=hash_type, name=handler.__name__ )
+
+    return None
 
 
 def sign_raw_data(raw_data, privatekey):
@@ -439,6 +850,100 @@ def secp256k1_compressed_pubkey_to_uncompressed_pubkey( pubkey ):
     return uncompressed_pubk
 
 
+def get_pubkey_forms( pubkey ):
+    """
+    Get both the compressed and uncompressed hex forms of a hex public key,
+    and the addresses of each.
+    Return {'public_keys': [compressed, uncompressed], 'addresses': [compressed, uncompressed]}
+    """
+    pubk = ECPublicKey(pubkey).to_hex()
+    pubkeys = [keylib.key_formatting.compress(pubk), keylib.key_formatting.decompress(pubk)]
+    addresses = [keylib.address_formatting.bin_hash160_to_address( keylib.hashing.bin_hash160( pk.decode('hex') ) ) for pk in pubkeys]
+    return {'public_keys': pubkeys, 'addresses': addresses}
+
+
+def get_secp256k1_backend():
+    """
+    Which secp256k1 implementation will verify signatures?
+    Returns "libsecp256k1" or "python"
+    """
+    if coincurve is not None:
+        return "libsecp256k1"
+    else:
+        return "python"
+
+
+def get_verifying_key( pubkey ):
+    """
+    Get a (cached) verifying key object for a hex public key.
+    The compressed-to-uncompressed conversion and key parsing
+    only happen the first time we see a given key.
+
+    Return a coincurve.PublicKey if libsecp256k1 is available
+    Return an ecdsa.VerifyingKey otherwise
+    """
+    global verifier_cache, verifier_cache_lock
+
+    pubkey = str(pubkey)
+    with verifier_cache_lock:
+        vk = verifier_cache.pop(pubkey, None)
+        if vk is not None:
+            # most-recently used goes last
+            verifier_cache[pubkey] = vk
+            return vk
+
+    pubk = ECPublicKey(pubkey).to_hex()
+    if coincurve is not None:
+        # libsecp256k1 handles both compressed and uncompressed keys
+        vk = coincurve.PublicKey( pubk.decode('hex') )
+
+    else:
+        if len(pubk) == 66:
+            pubk = keylib.key_formatting.decompress( pubk )
+
+        vk = ecdsa.VerifyingKey.from_string( pubk[2:].decode('hex'), curve=ecdsa.SECP256k1 )
+
+    with verifier_cache_lock:
+        verifier_cache[pubkey] = vk
+        while len(verifier_cache) > VERIFIER_CACHE_SIZE:
+            verifier_cache.popitem( last=False )
+
+    return vk
+
+
+def verify_digest( digest_bin, pubkey, sig_bin ):
+    """
+    Verify a DER-encoded signature over a sha256 digest,
+    using the cached verifying key for the given hex public key.
+    Return True on success.
+    Return False on error.
+    """
+    vk = get_verifying_key( pubkey )
+
+    if coincurve is not None:
+        # libsecp256k1 only accepts low-s signatures; (r, s) and (r, n-s) are equivalent
+        try:
+            sig_r, sig_s = ecdsa.util.sigdecode_der( sig_bin, ecdsa.SECP256k1.order )
+        except ecdsa.der.UnexpectedDER:
+            return False
+
+        if sig_s * 2 >= ecdsa.SECP256k1.order:
+            sig_s = ecdsa.SECP256k1.order - sig_s
+            sig_bin = ecdsa.util.sigencode_der( sig_r, sig_s, ecdsa.SECP256k1.order )
+
+        try:
+            return vk.verify( sig_bin, digest_bin, hasher=None )
+        except Exception, e:
+            # coincurve raises on signatures it can't parse
+            log.debug("Unparseable signature: %s" % e)
+            return False
+
+    try:
+        return vk.verify_digest(sig_bin, digest_bin, sigdecode=ecdsa.util.sigdecode_der)
+    except (ecdsa.BadSignatureError, ecdsa.der.UnexpectedDER):
+        return False
+
+
 def verify_raw_data(raw_data, pubkey, sigb64):
     """
     Verify the signature over a string, given the public key
@@ -448,13 +953,103 @@ def verify_raw_data(raw_data, pubkey, sigb64):
     """
 
     data_hash = get_data_hash(raw_data)
-    pubk = ECPublicKey(pubkey).to_hex()
-    if len(pubk) == 66:
-        pubk = secp256k1_compressed_pubkey_to_uncompressed_pubkey( pubkey )
-
     sig_bin = base64.b64decode(sigb64)
-    vk = ecdsa.VerifyingKey.from_string( pubk[2:].decode('hex'), curve=ecdsa.SECP256k1 )
-    return vk.verify_digest(sig_bin, data_hash.decode('hex'), sigdecode=ecdsa.util.sigdecode_der)
+    return verify_digest( data_hash.decode('hex'), pubkey, sig_bin )
+
+
+def base64url_decode( s ):
+    """
+    Decode unpadded URL-safe base64, as used in JWTs
+    """
+    s = str(s)
+    return base64.urlsafe_b64decode( s + '=' * (-len(s) % 4) )
+
+
+def verify_profile_token( token, public_key=None, address=None ):
+    """
+    Verify a signed (ES256K) profile token, and check that its
+    issuer is @public_key, or has the address @address.  Either
+    form (compressed or uncompressed) of the issuer's key matches.
+    The signature is checked with the cached verifying key for the issuer.
+
+    This accepts the same tokens as blockstack_profiles.verify_token().
+
+    Return the decoded token payload on success
+    Return None if it does not verify
+    """
+    try:
+        header_b64, payload_b64, sig_b64 = str(token).split('.')
+        header = json.loads( base64url_decode(header_b64) )
+        payload = json.loads( base64url_decode(payload_b64) )
+        sig_raw = base64url_decode( sig_b64 )
+
+        assert header.get('alg', None) == 'ES256K', "Unsupported algorithm"
+        assert len(sig_raw) == 64, "Invalid signature length"
+        for field in ['subject', 'issuer']:
+            assert type(payload.get(field, None)) == dict and 'publicKey' in payload[field], "Token has no %s public key" % field
+
+        assert 'claim' in payload, "Token has no claim"
+        issuer_public_key = str(payload['issuer']['publicKey'])
+
+    except Exception, e:
+        log.debug("Malformed token: %s" % e)
+        return None
+
+    try:
+        issuer_forms = get_pubkey_forms( issuer_public_key )
+        if public_key is not None:
+            if get_pubkey_forms( public_key )['public_keys'][0] != issuer_forms['public_keys'][0]:
+                return None
+
+        if address is not None:
+            if str(address) not in issuer_forms['addresses']:
+                return None
+
+        # JWTs carry a raw (r, s) signature over "header.payload"
+        sig_r = int(sig_raw[:32].encode('hex'), 16)
+        sig_s = int(sig_raw[32:].encode('hex'), 16)
+        sig_der = ecdsa.util.sigencode_der( sig_r, sig_s, ecdsa.SECP256k1.order )
+        digest = hashlib.sha256( header_b64 + '.' + payload_b64 ).digest()
+
+        if not verify_digest( digest, issuer_public_key, sig_der ):
+            return None
+
+    except Exception, e:
+        log.debug("Failed to verify token: %s" % e)
+        return None
+
+    return payload
+
+
+def get_profile_from_tokens( token_records, public_key=None, address=None ):
+    """
+    Merge the claims of the given profile token records that
+    verify against @public_key or @address.
+    This is blockstack_profiles.get_profile_from_tokens(), but
+    with verifying keys from the cache.
+
+    Return the merged claims (empty if none verified)
+    """
+    profile = {}
+    if type(token_records) != list:
+        return profile
+
+    for token_record in token_records:
+        if type(token_record) != dict or 'token' not in token_record:
+            continue
+
+        payload = verify_profile_token( token_record['token'], public_key=public_key, address=address )
+        if payload is None:
+            continue
+
+        if 'parentPublicKey' in token_record and payload['issuer']['publicKey'] != token_record['parentPublicKey']:
+            # keychain-signed tokens aren't supported
+            continue
+
+        if type(payload['claim']) == dict:
+            profile.update( payload['claim'] )
+
+    return profile
 
 
 def get_drivers_for_url( url ):
@@ -474,15 +1069,284 @@ def get_drivers_for_url( url ):
     return ret
 
 
+def run_parallel( func, args_list, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Call func(*args) for each args tuple in @args_list,
+    using at most @max_workers threads.
+
+    Return the list of results, in the same order as @args_list.
+    If a call raises, its exception is logged and its result is None.
+    """
+
+    results = [None] * len(args_list)
+    if len(args_list) == 0:
+        return results
+
+    work = Queue.Queue()
+    for i in xrange(0, len(args_list)):
+        work.put(i)
+
+    def worker():
+        while True:
+            try:
+                i = work.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                results[i] = func( *args_list[i] )
+            except Exception, e:
+                log.exception(e)
+                results[i] = None
+
+    num_workers = max(1, min(max_workers, len(args_list)))
+    if num_workers == 1:
+        worker()
+        return results
+
+    threads = [threading.Thread(target=worker) for i in xrange(0, num_workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return results
+
+
+def get_mutable_data_urls( storage_handler, fq_data_id, urls=None ):
+    """
+    Get the list of URLs a storage handler should try for a piece of mutable data.
+    If @urls is None, the handler will generate one.
+    Return the list of URLs (which may be empty)
+    """
+
+    if urls is None:
+        # make one on-the-fly
+        if not hasattr(storage_handler, "make_mutable_url"):
+            log.warning("Storage handler %s does not support `make_mutable_url`" % storage_handler.__name__)
+            return []
+
+        try:
+            new_url = storage_handler.make_mutable_url( fq_data_id )
+        except Exception, e:
+            log.exception(e)
+            return []
+
+        return [new_url]
+
+    else:
+        # find the set that this handler can manage
+        if not hasattr(storage_handler, "handles_url"):
+            log.warning("Storage handler %s does not support `handles_url`" % storage_handler.__name__)
+            return []
+
+        return [url for url in urls if storage_handler.handles_url( url )]
+
+
+def fetch_mutable_data_status( storage_handler, fqu, url ):
+    """
+    Fetch the serialized mutable data at a URL with a given storage handler,
+    and say why if there isn't any.
+    Return (serialized data, None) on success
+    Return (None, "not found") if the handler found no data there
+    Return (None, "error") if the handler failed (e.g. it raised on a transport error)
+    """
+
+    data_json = None
+
+    log.debug("Try %s (%s)" % (storage_handler.__name__, url))
+    try:
+        data_json = storage_handler.get_mutable_handler( url, fqu=fqu )
+    except UnhandledURLException, uue:
+        # handler doesn't handle this URL
+        log.debug("Storage handler %s does not handle URLs like %s" % (storage_handler.__name__, url ))
+        return (None, "error")
+
+    except Exception, e:
+        log.exception( e )
+        return (None, "error")
+
+    if data_json is None:
+        # no data
+        log.debug("No data from %s (%s)" % (storage_handler.__name__, url))
+        return (None, "not found")
+
+    return (data_json, None)
+
+
+def fetch_mutable_data( storage_handler, fqu, url ):
+    """
+    Fetch the serialized mutable data at a URL with a given storage handler.
+    Return the serialized data on success
+    Return None on error
+    """
+    data_json, error = fetch_mutable_data_status( storage_handler, fqu, url )
+    return data_json
+
+
+def dead_url_note( storage_handler, url ):
+    """
+    Remember that a storage handler found nothing at a URL,
+    so lookups skip it for the next DEAD_URL_CACHE_TTL seconds.
+    Only call this on a definite "not found", not on a failed request.
+    """
+    global dead_url_cache, dead_url_cache_lock
+
+    key = (storage_handler.__name__, url)
+    with dead_url_cache_lock:
+        dead_url_cache.pop( key, None )
+        dead_url_cache[key] = time.time() + DEAD_URL_CACHE_TTL
+        while len(dead_url_cache) > DEAD_URL_CACHE_SIZE:
+            dead_url_cache.popitem( last=False )
+
+
+def dead_url_forget( storage_handler, url ):
+    """
+    Forget that a storage handler found nothing at a URL
+    (i.e. because we just wrote to it).
+    """
+    global dead_url_cache, dead_url_cache_lock
+
+    with dead_url_cache_lock:
+        dead_url_cache.pop( (storage_handler.__name__, url), None )
+
+
+def dead_url_check( storage_handler, url ):
+    """
+    Did a storage handler recently get nothing from this URL?
+    """
+    global dead_url_cache, dead_url_cache_lock
+
+    key = (storage_handler.__name__, url)
+    with dead_url_cache_lock:
+        expires = dead_url_cache.get( key, None )
+        if expires is None:
+            return False
+
+        if expires < time.time():
+            del dead_url_cache[key]
+            return False
+
+        return True
+
+
+def fetch_mutable_data_first( candidates, fqu, verify=None, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Fetch serialized mutable data from a list of (storage handler, URL)
+    candidates at once, with up to @max_workers concurrent fetches.
+    Candidates are started in list order.  The first one to return data
+    that passes @verify (if given) wins, and no more candidates are started.
+    Candidates whose handlers find nothing are noted in the dead URL cache
+    (but not the ones that fail, which may just be unreachable for now).
+
+    Return (storage handler, url, data, None) on success, where data is the result of @verify (or the serialized data)
+    Return (None, None, None, "not found") if every candidate found nothing
+    Return (None, None, None, "error") if no candidate worked, and some failed (or had data that didn't verify)
+    """
+
+    if len(candidates) == 0:
+        return (None, None, None, "not found")
+
+    work = Queue.Queue()
+    for candidate in candidates:
+        work.put( candidate )
+
+    results = Queue.Queue()
+    done = threading.Event()
+
+    def worker():
+        while not done.is_set():
+            try:
+                storage_handler, url = work.get_nowait()
+            except Queue.Empty:
+                return
+
+            data = None
+            error = None
+            try:
+                data_json, error = fetch_mutable_data_status( storage_handler, fqu, url )
+                if data_json is None:
+                    if error == "not found":
+                        dead_url_note( storage_handler, url )
+
+                elif verify is not None:
+                    data = verify( data_json )
+                    if data is None:
+                        log.error("Unparseable data from '%s'" % url)
+                        error = "error"
+
+                else:
+                    data = data_json
+
+            except Exception, e:
+                log.exception(e)
+                data = None
+                error = "error"
+
+            results.put( (storage_handler, url, data, error) )
+
+    num_workers = max(1, min(max_workers, len(candidates)))
+    for i in xrange(0, num_workers):
+        t = threading.Thread( target=worker )
+        t.daemon = True
+        t.start()
+
+    status = "not found"
+    for i in xrange(0, len(candidates)):
+        storage_handler, url, data, error = results.get()
+        if data is not None:
+            done.set()
+            return (storage_handler, url, data, None)
+
+        if error != "not found":
+            status = "error"
+
+    return (None, None, None, status)
+
+
+def verify_mutable_data( data_json, data_pubkey, data_address=None, owner_address=None ):
+    """
+    Parse and authenticate serialized mutable data, first with the
+    data public key (and address), and then with the owner address.
+    Return the parsed data on success
+    Return None on error
+    """
+
+    data = parse_mutable_data( data_json, data_pubkey, public_key_hash=data_address )
+    if data is None:
+        # maybe try owner address?
+        # (don't re-try the public key; it already failed)
+        if owner_address is not None and owner_address != data_address:
+            data = parse_mutable_data( data_json, None, public_key_hash=owner_address )
+
+    return data
+
+
 def get_mutable_data( fq_data_id, data_pubkey, urls=None, data_address=None, owner_address=None, drivers=None, decode=True ):
    """
    Given a mutable data's zonefile, go fetch the data.
+   If @urls are given (e.g. from the zonefile), they are all tried at once
+   (see fetch_mutable_data_first()), and URLs that recently had no data are skipped.
+   Otherwise, each driver is tried in turn with the URL it generates.
 
    Return a mutable data dict on success
    Return None on error
    """
+   data, error = get_mutable_data_status( fq_data_id, data_pubkey, urls=urls, data_address=data_address, owner_address=owner_address, drivers=drivers, decode=decode )
+   return data
 
-   global storage_handlers
+
+def get_mutable_data_status( fq_data_id, data_pubkey, urls=None, data_address=None, owner_address=None, drivers=None, decode=True ):
+   """
+   Fetch mutable data like get_mutable_data(), and say why if it can't be found.
+   URLs skipped because they recently had no data count as not found.
+
+   Return (data, None) on success
+   Return (None, "not found") if every driver found nothing
+   Return (None, "error") if any driver failed, or gave us data that didn't verify
+   """
 
    fq_data_id = str(fq_data_id)
    assert is_fq_data_id( fq_data_id ) or is_name_valid( fq_data_id ), "Need either a fully-qualified data ID or a blockchain ID: '%s'" % fq_data_id
@@ -493,95 +1357,183 @@ def get_mutable_data( fq_data_id, data_pubkey, urls=None, data_address=None, own
    else:
        fqu = fq_data_id
 
-   handlers_to_use = []
-   if drivers is not None and len(drivers) > 0:
-       # whitelist of drivers to try 
-       for d in drivers:
-           for h in storage_handlers:
-               if h.__name__ == d:
-                   handlers_to_use.append(h)
-
-   else:
-       handlers_to_use = storage_handlers
+   handlers_to_use = get_storage_handlers( drivers )
 
    log.debug("get_mutable %s" % fq_data_id)
-   for storage_handler in handlers_to_use:
-
-      if not hasattr(storage_handler, "get_mutable_handler"):
-         continue
 
-      # which URLs to attempt?
-      try_urls = []
-      if urls is None:
-        
-          # make one on-the-fly
-          if not hasattr(storage_handler, "make_mutable_url"):
-             log.warning("Storage handler %s does not support `make_mutable_url`" % storage_handler.__name__)
-             continue
+   if urls is not None:
+      # try all of the given URLs at once, skipping the ones that recently had nothing.
+      # the first one to give us valid data wins.
+      candidates = []
+      for storage_handler in handlers_to_use:
+         if not hasattr(storage_handler, "get_mutable_handler"):
+            continue
 
-          new_url = None
+         for url in get_mutable_data_urls( storage_handler, fq_data_id, urls=urls ):
+            if dead_url_check( storage_handler, url ):
+               log.debug("Skip %s (%s): recently had no data" % (storage_handler.__name__, url))
+               continue
 
-          try:
-              new_url = storage_handler.make_mutable_url( fq_data_id )
-          except Exception, e:
-              log.exception(e)
-              continue
-          
-          try_urls = [new_url]
+            candidates.append( (storage_handler, url) )
 
-      else:
-          # find the set that this handler can manage 
-          for url in urls:
-              if not hasattr(storage_handler, "handles_url"):
-                  log.warning("Storage handler %s does not support `handles_url`" % storage_handler.__name__)
-                  continue
+      verify = None
+      if decode:
+         verify = lambda data_json: verify_mutable_data( data_json, data_pubkey, data_address=data_address, owner_address=owner_address )
 
-              if storage_handler.handles_url( url ):
-                  try_urls.append(url)
+      storage_handler, url, data, error = fetch_mutable_data_first( candidates, fqu, verify=verify )
+      if data is None:
+         return (None, error)
 
-      for url in try_urls:
+      log.debug("loaded '%s' with %s" % (url, storage_handler.__name__))
+      return (data, None)
 
-         data_json = None
-         data = None
+   errored = False
+   for storage_handler in handlers_to_use:
 
-         log.debug("Try %s (%s)" % (storage_handler.__name__, url))
-         try:
+      if not hasattr(storage_handler, "get_mutable_handler"):
+         continue
 
-            data_json = storage_handler.get_mutable_handler( url, fqu=fqu )
-         except UnhandledURLException, uue:
-            # handler doesn't handle this URL
-            log.debug("Storage handler %s does not handle URLs like %s" % (storage_handler.__name__, url ))
-            continue
+      # which URLs to attempt?
+      try_urls = get_mutable_data_urls( storage_handler, fq_data_id, urls=urls )
 
-         except Exception, e:
-            log.exception( e )
-            continue
+      for url in try_urls:
 
+         data = None
+         data_json, error = fetch_mutable_data_status( storage_handler, fqu, url )
          if data_json is None:
-            # no data
-            log.debug("No data from %s (%s)" % (storage_handler.__name__, url))
+            if error != "not found":
+               errored = True
+
             continue
 
          # parse it, if desired
          if decode:
-             data = parse_mutable_data( data_json, data_pubkey, public_key_hash=data_address )
+             data = verify_mutable_data( data_json, data_pubkey, data_address=data_address, owner_address=owner_address )
              if data is None:
-                # maybe try owner address?
-                if owner_address is not None:
-                    data = parse_mutable_data( data_json, data_pubkey, public_key_hash=owner_address )
-
-                if data is None:
-                    log.error("Unparseable data from '%s'" % url)
-                    continue
+                log.error("Unparseable data from '%s'" % url)
+                errored = True
+                continue
 
              log.debug("loaded '%s' with %s" % (url, storage_handler.__name__))
          else:
              data = data_json
              log.debug("fetched (but did not decode) '%s' with '%s'" % (url, storage_handler.__name__))
 
-         return data
+         return (data, None)
 
-   return None
+   if errored:
+      return (None, "error")
+
+   return (None, "not found")
+
+
+def get_mutable_data_many( requests, drivers=None, decode=True, max_workers=DEFAULT_STORAGE_WORKERS ):
+    """
+    Fetch many pieces of mutable data at once.
+
+    @requests is a list of dicts, each with:
+    * fq_data_id: the fully-qualified data ID (or blockchain ID)
+    * data_pubkey: the public key to verify with (may be None)
+    and optionally 'urls', 'data_address', and 'owner_address', with the
+    same meanings as in get_mutable_data().
+
+    Drivers are tried in priority order.  Each driver is given all of the
+    requests that are still unresolved at once, which it serves with up
+    to @max_workers concurrent fetches.  The fetched data is then verified
+    in a pool of @max_workers threads.  Requests that fail on one driver
+    fall through to the next.
+
+    Return {fq_data_id: data} on success, where each data is either the
+    mutable data, or {'error': ...} if it could not be fetched or verified.
+    The error is 'No data found' only if every driver found nothing.
+    """
+
+    results = {}
+    pending = []
+    for req in requests:
+        fq_data_id = str(req['fq_data_id'])
+        assert is_fq_data_id( fq_data_id ) or is_name_valid( fq_data_id ), "Need either a fully-qualified data ID or a blockchain ID: '%s'" % fq_data_id
+
+        req = dict(req)
+        req['fq_data_id'] = fq_data_id
+        if is_fq_data_id(fq_data_id):
+            req['fqu'] = fq_data_id.split(":")[0]
+        else:
+            req['fqu'] = fq_data_id
+
+        results[fq_data_id] = {'error': 'No data found'}
+        pending.append(req)
+
+    handlers_to_use = get_storage_handlers( drivers )
+
+    log.debug("get_mutable_many %s items" % len(pending))
+
+    def fetch_one( storage_handler, req ):
+        """
+        Find the first URL this handler can load the request from.
+        Return (url, serialized data, None), or (None, None, "not found"),
+        or (None, None, "error") if any URL failed
+        """
+        status = "not found"
+        try_urls = get_mutable_data_urls( storage_handler, req['fq_data_id'], urls=req.get('urls', None) )
+        for url in try_urls:
+            if req.get('urls', None) is not None and dead_url_check( storage_handler, url ):
+                log.debug("Skip %s (%s): recently had no data" % (storage_handler.__name__, url))
+                continue
+
+            data_json, error = fetch_mutable_data_status( storage_handler, req['fqu'], url )
+            if data_json is not None:
+                return (url, data_json, None)
+
+            if error != "not found":
+                status = "error"
+
+            elif req.get('urls', None) is not None:
+                dead_url_note( storage_handler, url )
+
+        return (None, None, status)
+
+    def verify_one( req, data_json ):
+        return verify_mutable_data( data_json, req.get('data_pubkey', None), data_address=req.get('data_address', None), owner_address=req.get('owner_address', None) )
+
+    for storage_handler in handlers_to_use:
+
+        if len(pending) == 0:
+            break
+
+        if not hasattr(storage_handler, "get_mutable_handler"):
+            continue
+
+        fetched = run_parallel( fetch_one, [(storage_handler, req) for req in pending], max_workers=max_workers )
+
+        loaded = []
+        still_pending = []
+        for req, res in zip(pending, fetched):
+            if res is None or res[1] is None:
+                if res is None or res[2] != "not found":
+                    results[req['fq_data_id']] = {'error': 'Failed to fetch data'}
+
+                still_pending.append(req)
+            else:
+                loaded.append( (req, res[0], res[1]) )
+
+        if decode:
+            verified = run_parallel( verify_one, [(req, data_json) for (req, url, data_json) in loaded], max_workers=max_workers )
+        else:
+            verified = [data_json for (req, url, data_json) in loaded]
+
+        for (req, url, data_json), data in zip(loaded, verified):
+            if data is None:
+                log.error("Unparseable data from '%s'" % url)
+                results[req['fq_data_id']] = {'error': 'Failed to verify data'}
+                still_pending.append(req)
+            else:
+                log.debug("loaded '%s' with %s" % (url, storage_handler.__name__))
+                results[req['fq_data_id']] = data
+
+        pending = still_pending
+
+    return results
 
 
 def serialize_immutable_data( data_json ):
@@ -592,10 +1544,22 @@ def serialize_immutable_data( data_json ):
     return json.dumps(data_json, sort_keys=True)
 
 
-def put_immutable_data( data_json, txid, data_hash=None, data_text=None, required=None ):
+def serialize_immutable_data_hashed( data_json ):
+    """
+    Serialize a piece of immutable data and calculate its hash
+    in one pass.  Pass both to put_immutable_data() so it doesn't
+    have to serialize and hash the data again.
+    Return {'data_text': serialized data, 'data_hash': hash}
+    """
+    data_text = serialize_immutable_data( data_json )
+    return {'data_text': data_text, 'data_hash': get_data_hash( data_text )}
+
+
+def put_immutable_data( data_json, txid, data_hash=None, data_text=None, required=None, config_path=CONFIG_PATH ):
    """
    Given a string of data (which can either be data or a zonefile), store it into our immutable data stores.
    Do so in a best-effort manner--this method only fails if *all* storage providers fail.
+   Providers that fail are remembered, so the repair worker can fill them in later.
 
    Return the hash of the data on success
    Return None on error
@@ -617,6 +1581,8 @@ def put_immutable_data( data_json, txid, data_hash=None, data_text=None, require
       data_hash = str(data_hash)
 
    successes = 0
+   succeeded = []
+   failed = []
    log.debug("put_immutable_data(%s), required=%s" % (data_hash, ",".join(required)))
 
    for handler in storage_handlers:
@@ -643,13 +1609,16 @@ def put_immutable_data( data_json, txid, data_hash=None, data_text=None, require
              log.debug("Failed to replicate to required storage provider '%s'" % handler.__name__)
              return None
          else:
+             failed.append( handler.__name__ )
              continue
 
       if not rc:
          log.debug("Failed to replicate with '%s'" % handler.__name__)
+         failed.append( handler.__name__ )
 
       else:
          log.debug("Replication succeeded with '%s'" % handler.__name__)
+         succeeded.append( handler.__name__ )
          successes += 1
 
    if successes == 0:
@@ -658,10 +1627,161 @@ def put_immutable_data( data_json, txid, data_hash=None, data_text=None, require
 
    else:
        # succeeded somewhere
+       note_replicas( "immutable", data_hash, data_text, succeeded, failed, txid=txid, config_path=config_path )
        return data_hash
 
 
-def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only=None ):
+def get_mutable_data_fingerprint( data_json, privatekey ):
+    """
+    Calculate the fingerprint of a piece of mutable data, as it would be signed by @privatekey.
+    Used to tell whether or not a put would store what is already there.
+    Return the hex string.
+    """
+    data_txt = json.dumps(data_json, sort_keys=True)
+    return hmac.new( str(privatekey), data_txt, hashlib.sha256 ).hexdigest()
+
+
+def get_mutable_data_fingerprint_path( fq_data_id, metadata_dir ):
+    """
+    Get the path to the file that records the fingerprints of
+    the last-written copies of a piece of mutable data.
+    """
+    serialized_data_id = urllib.quote(fq_data_id.replace("\0", "\\0")).replace("/", r"\x2f")
+    return os.path.join( metadata_dir, serialized_data_id + ".puts" )
+
+
+def load_mutable_data_fingerprints( fq_data_id, metadata_dir ):
+    """
+    Load the fingerprints of the last-written copies of a piece of
+    mutable data, for each storage driver we put it to.
+
+    Return {'driver name': fingerprint} on success (empty if there are none)
+    """
+    if metadata_dir is None or not os.path.isdir(metadata_dir):
+        return {}
+
+    path = get_mutable_data_fingerprint_path( fq_data_id, metadata_dir )
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path, "r") as f:
+            fingerprints = json.loads(f.read())
+
+        assert type(fingerprints) == dict
+        return fingerprints
+
+    except Exception, e:
+        log.warn("Failed to read '%s'" % path)
+        return {}
+
+
+def store_mutable_data_fingerprints( fq_data_id, fingerprints, metadata_dir ):
+    """
+    Store the fingerprints of the last-written copies of a piece of mutable data.
+    Return True if stored
+    Return False if not
+    """
+    if metadata_dir is None or not os.path.isdir(metadata_dir):
+        log.warning("No metadata directory found; cannot store fingerprints for '%s'" % fq_data_id)
+        return False
+
+    path = get_mutable_data_fingerprint_path( fq_data_id, metadata_dir )
+    tmppath = path + ".tmp"
+
+    try:
+        with open(tmppath, "w") as f:
+            f.write( json.dumps(fingerprints, sort_keys=True) )
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename( tmppath, path )
+        return True
+
+    except Exception, e:
+        log.exception(e)
+        log.warn("Failed to store fingerprints for '%s' to '%s'" % (fq_data_id, path))
+        return False
+
+
+def delete_mutable_data_fingerprints( fq_data_id, metadata_dir ):
+    """
+    Forget the fingerprints of a piece of mutable data, so the next put stores it everywhere.
+    Return True if deleted (or if there was nothing to delete)
+    Return False if not
+    """
+    if metadata_dir is None or not os.path.isdir(metadata_dir):
+        return True
+
+    path = get_mutable_data_fingerprint_path( fq_data_id, metadata_dir )
+    if not os.path.exists(path):
+        return True
+
+    try:
+        os.unlink(path)
+        return True
+
+    except Exception, e:
+        log.warn("Failed to remove '%s'" % path)
+        return False
+
+
+def note_replicas( object_type, object_key, data_text, succeeded, failed, txid=None, fqu=None, fingerprint=None, config_path=CONFIG_PATH ):
+    """
+    Remember which storage providers have a copy of something we just wrote,
+    so the repair worker can fill in the ones that failed.
+    Best-effort: failing to remember does not fail the write.
+    """
+    try:
+        from .backend.repair import note_put
+        note_put( object_type, object_key, data_text, succeeded, failed, txid=txid, fqu=fqu, fingerprint=fingerprint, config_path=config_path )
+    except Exception, e:
+        log.exception(e)
+        log.warn("Failed to record replicas of %s" % object_key)
+
+
+def forget_replicas( object_type, object_key, config_path=CONFIG_PATH ):
+    """
+    Stop repairing the replicas of something we deleted.
+    """
+    try:
+        from .backend.repair import forget
+        forget( object_type, object_key, config_path=config_path )
+    except Exception, e:
+        log.exception(e)
+        log.warn("Failed to forget replicas of %s" % object_key)
+
+
+def set_metadata_dir( metadata_dir, config_path=CONFIG_PATH ):
+    """
+    Remember the client's metadata directory for a config file
+    (i.e. when the storage drivers are initialized), so writes
+    don't have to re-read the config file to find it.
+    """
+    global metadata_dirs
+    metadata_dirs[config_path] = metadata_dir
+
+
+def get_metadata_dir( config_path=CONFIG_PATH ):
+    """
+    Get the client's metadata directory.
+    The config file is only read the first time.
+    Return None if not configured
+    """
+    global metadata_dirs
+    if metadata_dirs.has_key( config_path ):
+        return metadata_dirs[config_path]
+
+    conf = get_config( config_path )
+    if conf is None:
+        return None
+
+    metadata_dir = conf.get('metadata', None)
+    metadata_dirs[config_path] = metadata_dir
+    return metadata_dir
+
+
+def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only=None, force=False, fingerprint_data=None, config_path=CONFIG_PATH ):
    """
    Given the unserialized data, store it into our mutable data stores.
    Do so in a best-effort way.  This method only fails if all storage providers fail.
@@ -669,6 +1789,11 @@ def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only
    @fq_data_id is the fully-qualified data id.  It must be prefixed with the username,
    to avoid collisions in shared mutable storage.
 
+   We remember what we last wrote to each storage provider, and will not
+   re-sign and re-upload data to a provider that already has it unless @force is True.
+   If given, @fingerprint_data is used instead of @data_json to decide whether or
+   not the data has changed (e.g. a profile without its timestamp).
+
    Return True on success
    Return False on error
    """
@@ -693,8 +1818,19 @@ def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only
    else:
        fqu = fq_data_id
 
-   serialized_data = serialize_mutable_data( data_json, privatekey )
+   if fingerprint_data is None:
+       fingerprint_data = data_json
+
+   metadata_dir = get_metadata_dir( config_path )
+   fingerprint = get_mutable_data_fingerprint( fingerprint_data, privatekey )
+   fingerprints = load_mutable_data_fingerprints( fq_data_id, metadata_dir )
+   old_fingerprints = fingerprints.copy()
+
+   # only serialize and sign if we have to
+   serialized_data = None
    successes = 0
+   succeeded = []
+   failed = []
 
    log.debug("put_mutable_data(%s), required=%s" % (fq_data_id, ",".join(required)))
 
@@ -711,6 +1847,15 @@ def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only
           log.debug("Skipping storage driver '%s'" % handler.__name__)
           continue
 
+      if not force and fingerprints.get(handler.__name__, None) == fingerprint:
+          log.debug("Unchanged: '%s' already has %s" % (handler.__name__, fq_data_id))
+          succeeded.append( handler.__name__ )
+          successes += 1
+          continue
+
+      if serialized_data is None:
+          serialized_data = serialize_mutable_data( data_json, privatekey )
+
       rc = False
 
       try:
@@ -722,6 +1867,7 @@ def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only
              log.debug("Failed to replicate with required storage provider '%s'" % handler.__name__)
              return None 
          else:
+             failed.append( handler.__name__ )
              continue
 
       if not rc:
@@ -730,21 +1876,36 @@ def put_mutable_data( fq_data_id, data_json, privatekey, required=None, use_only
              return None 
          else:
              log.debug("Failed to replicate with '%s'" % handler.__name__)
+             failed.append( handler.__name__ )
              continue
 
       else:
+         fingerprints[handler.__name__] = fingerprint
+         succeeded.append( handler.__name__ )
          successes += 1
 
+         # readers can find it there now
+         try:
+            dead_url_forget( handler, handler.make_mutable_url( fq_data_id ) )
+         except Exception, e:
+            log.exception(e)
+
+   if fingerprints != old_fingerprints:
+       store_mutable_data_fingerprints( fq_data_id, fingerprints, metadata_dir )
+
    if successes == 0:
        # failed everywhere
        return False
 
    else:
        # succeeded somewhere
+       if serialized_data is not None:
+           note_replicas( "mutable", fq_data_id, serialized_data, succeeded, failed, fqu=fqu, fingerprint=fingerprint, config_path=config_path )
+
        return True
 
 
-def delete_immutable_data( data_hash, txid, privkey ):
+def delete_immutable_data( data_hash, txid, privkey, config_path=CONFIG_PATH ):
    """
    Given the hash of the data, the private key of the user,
    and the txid that deleted the data's hash from the blockchain,
@@ -762,6 +1923,9 @@ def delete_immutable_data( data_hash, txid, privkey ):
    txid = str(txid)
    sigb64 = sign_raw_data( data_hash + txid, privkey )
 
+   # don't re-push it
+   forget_replicas( "immutable", data_hash, config_path=config_path )
+
    for handler in storage_handlers:
 
       if not hasattr( handler, "delete_immutable_handler" ):
@@ -778,7 +1942,7 @@ def delete_immutable_data( data_hash, txid, privkey ):
    return True
 
 
-def delete_mutable_data( fq_data_id, privatekey, only_use=None ):
+def delete_mutable_data( fq_data_id, privatekey, only_use=None, config_path=CONFIG_PATH ):
    """
    Given the data ID and private key of a user,
    go and delete the associated mutable data.
@@ -798,6 +1962,10 @@ def delete_mutable_data( fq_data_id, privatekey, only_use=None ):
 
    sigb64 = sign_raw_data( fq_data_id, privatekey )
 
+   # subsequent puts must go everywhere, and the old data must not be re-pushed
+   delete_mutable_data_fingerprints( fq_data_id, get_metadata_dir( config_path ) )
+   forget_replicas( "mutable", fq_data_id, config_path=config_path )
+
    # remove data
    for handler in storage_handlers:
 
@@ -1113,20 +2281,30 @@ def blockstack_data_url( field_dict ):
 class BlockstackURLHandle( object ):
     """
     A file-like object that handles reads on blockstack URLs
+
+    If @stream is True, immutable data is read from the storage
+    drivers as it is consumed (and hashed and verified as it goes),
+    instead of being loaded into RAM first.  Mutable data must be
+    fetched in full to verify its signature, so it is always buffered.
     """
 
-    def __init__(self, url, data=None, full_response=False, config_path=CONFIG_PATH, wallet_keys=None ):
+    STREAM_CHUNK_SIZE = 65536
+
+    def __init__(self, url, data=None, full_response=False, config_path=CONFIG_PATH, wallet_keys=None, stream=False ):
         self.name = url
         self.data = data
         self.full_response = full_response
         self.fetched = False
         self.config_path = config_path
         self.wallet_keys = wallet_keys
+        self.stream = None
+        self.streaming = stream and not full_response
+        self.linebuf = ""
 
         if data is not None:
             self.data_len = len(data)
             self.fetched = True
-            self.newlines = make_newlines(data)
+            self.newlines = self.make_newlines(data)
 
         else:
             self.newlines = None
@@ -1149,6 +2327,37 @@ class BlockstackURLHandle( object ):
         return tuple(newline_list)
 
 
+    def fetch_stream(self):
+        """
+        Open a verifying stream to the immutable data named by this URL.
+        Return True if we're streaming
+        Return False if this URL can't be streamed (i.e. it's mutable data)
+        Raise on error
+        """
+        import data as data_mod
+        from .proxy import get_default_proxy
+
+        try:
+            blockchain_id, data_id, data_hash = blockstack_immutable_data_url_parse( self.name )
+        except ValueError:
+            # mutable; not streamable
+            return False
+
+        if data_id is None:
+            # listing; not streamable
+            return False
+
+        proxy = get_default_proxy( config_path=self.config_path )
+        res = data_mod.get_immutable( blockchain_id, data_hash, data_id=data_id, proxy=proxy, stream=True )
+        if 'error' in res:
+            raise urllib2.URLError("Failed to fetch '%s': %s" % (self.name, res['error']))
+
+        self.stream = res['stream']
+        self.data_len = None
+        self.fetched = True
+        return True
+
+
     def fetch(self):
         """
         Lazily fetch the data on read
@@ -1157,6 +2366,12 @@ class BlockstackURLHandle( object ):
             import data as data_mod
             from .proxy import get_default_proxy
 
+            if self.streaming:
+                if self.fetch_stream():
+                    return
+
+                self.streaming = False
+
             proxy = get_default_proxy( config_path=self.config_path )
             data = data_mod.blockstack_url_fetch( self.name, proxy=proxy, wallet_keys=self.wallet_keys )
             if data is None:
@@ -1172,13 +2387,18 @@ class BlockstackURLHandle( object ):
                 if type(self.data) not in [str,unicode]:
                     self.data = json.dumps(data['data'])
 
-            self.newlines = self.make_newlines(data)
+            self.newlines = self.make_newlines(self.data)
             self.data_len = len(self.data)
             self.fetched = True
 
 
     def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
         self.data = None
+        self.linebuf = ""
         self.closed = True
 
 
@@ -1198,10 +2418,75 @@ class BlockstackURLHandle( object ):
             return line
 
 
+    def read_stream(self, numbytes=None):
+        """
+        Read from the verifying stream, draining any buffered line data first
+        """
+        if numbytes is None or numbytes < 0:
+            ret = self.linebuf + self.stream.read()
+            self.linebuf = ""
+
+        else:
+            ret = self.linebuf[:numbytes]
+            self.linebuf = self.linebuf[numbytes:]
+            if len(ret) < numbytes:
+                ret += self.stream.read( numbytes - len(ret) )
+
+        self.offset += len(ret)
+        return ret
+
+
+    def readline_stream(self, numbytes=None):
+        """
+        Read a line from the verifying stream, buffering only up to the next newline
+        """
+        # search each chunk only once as it arrives, and join them once,
+        # so long lines cost linear time
+        chunks = [self.linebuf]
+        buffered = len(self.linebuf)
+        next_newline_offset = self.linebuf.find("\n")
+
+        while next_newline_offset < 0:
+            if numbytes is not None and buffered >= numbytes:
+                break
+
+            buf = self.stream.read( self.STREAM_CHUNK_SIZE )
+            if len(buf) == 0:
+                break
+
+            chunk_newline_offset = buf.find("\n")
+            if chunk_newline_offset >= 0:
+                next_newline_offset = buffered + chunk_newline_offset
+
+            chunks.append(buf)
+            buffered += len(buf)
+
+        self.linebuf = "".join(chunks)
+
+        if next_newline_offset >= 0:
+            line_len = next_newline_offset + 1
+            if numbytes is not None and numbytes < line_len:
+                line_len = numbytes
+
+            ret = self.linebuf[:line_len]
+            self.linebuf = self.linebuf[line_len:]
+            self.offset += len(ret)
+            return ret
+
+        if numbytes is not None and buffered >= numbytes:
+            return self.read_stream(numbytes)
+
+        # no more newlines
+        return self.read_stream()
+
+
     def read(self, numbytes=None):
 
         self.fetch()
-        if self.offset >= self.data_len:
+        if self.stream is not None:
+            return self.read_stream(numbytes)
+
+        if self.data is None or self.offset >= self.data_len:
             return ""
 
         if numbytes is not None:
@@ -1220,27 +2505,36 @@ class BlockstackURLHandle( object ):
 
 
     def readline(self, numbytes=None):
+
+        self.fetch()
+        if self.stream is not None:
+            return self.readline_stream(numbytes)
+
         if self.data is None:
             return ""
 
-        next_newline_offset = self.data[self.offset:].find("\n")
+        next_newline_offset = self.data.find("\n", self.offset)
         if next_newline_offset < 0:
             # no more newlines 
-            return self.read()
+            return self.read(numbytes)
 
         else:
-            line_data = self.read( next_newline_offset+1 )
+            line_len = next_newline_offset - self.offset + 1
+            if numbytes is not None and numbytes < line_len:
+                line_len = numbytes
+
+            line_data = self.read( line_len )
             return line_data
 
 
     def readlines(self, sizehint=None):
         lines = []
-        if sizehint is None:
-            sizehint = self.data_len
-
         total_len = 0
-        while total_len < sizehint:
+        while sizehint is None or total_len < sizehint:
             line = self.readline()
+            if len(line) == 0:
+                break
+
             lines.append(line)
             total_len += len(line)
 
@@ -1253,14 +2547,15 @@ class BlockstackHandler( urllib2.BaseHandler ):
     Usable with urllib2.
     """
 
-    def __init__(self, full_response=False, config_path=CONFIG_PATH):
+    def __init__(self, full_response=False, config_path=CONFIG_PATH, stream=False):
         self.full_response = full_response
         self.config_path = config_path
+        self.stream = stream
 
     def blockstack_open( self, req ):
         """
         Open a blockstack URL
         """
-        bh = BlockstackURLHandle( req.get_full_url(), full_response=self.full_response, config_path=self.config_path )
+        bh = BlockstackURLHandle( req.get_full_url(), full_response=self.full_response, config_path=self.config_path, stream=self.stream )
         return bh
 
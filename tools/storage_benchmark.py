@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+"""
+    Blockstack-client
+    ~~~~~
+    copyright: (c) 2014-2015 by Halfmoon Labs, Inc.
+    copyright: (c) 2016 by Blockstack.org
+
+    This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Storage driver conformance checks and benchmarks.
+#
+# Runs each storage driver against a local stand-in for its backend:
+# * disk, sqlite:       a temporary directory
+# * http:               a local HTTP server on a temporary directory (read-only driver)
+# * blockstack_server:  a local XML-RPC stub of the zonefile/profile API
+# * s3:                 a local S3-compatible server (e.g. moto_server), given with --s3-endpoint
+# * dht:                a local DHT node, given with --dht-endpoint
+#
+# For each driver, it checks the API contract that storage.register_storage()
+# expects, and then measures put/get/delete latency percentiles and throughput
+# for each object size and concurrency level.  Results are printed as JSON.
+
+import os
+import sys
+import json
+import time
+import imp
+import shutil
+import base64
+import random
+import hashlib
+import tempfile
+import threading
+import argparse
+import traceback
+import Queue
+import SimpleHTTPServer
+import SocketServer
+import SimpleXMLRPCServer
+
+# hack around absolute paths
+current_dir = os.path.abspath(os.path.join( os.path.dirname(__file__), ".."))
+sys.path.insert(0, current_dir)
+
+import pybitcoin
+from blockstack_client.storage import STORAGE_DRIVER_METHODS
+
+DRIVERS_DIR = os.path.join( current_dir, "blockstack_client", "backend", "drivers" )
+sys.path.insert(0, DRIVERS_DIR)
+
+ALL_DRIVERS = ["disk", "sqlite", "http", "blockstack_server", "s3", "dht"]
+
+
+def load_driver( driver_name ):
+    """
+    Load a fresh copy of a storage driver module
+    """
+    path = os.path.join( DRIVERS_DIR, driver_name + ".py" )
+    return imp.load_source( "blockstack_benchmark_driver_%s" % driver_name, path )
+
+
+class ThreadingHTTPServer( SocketServer.ThreadingMixIn, SimpleHTTPServer.BaseHTTPServer.HTTPServer ):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingXMLRPCServer( SocketServer.ThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer ):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server( srv ):
+    """
+    Serve requests in a background thread
+    """
+    t = threading.Thread( target=srv.serve_forever )
+    t.daemon = True
+    t.start()
+    return srv
+
+
+def make_zonefile( name, size ):
+    """
+    Make a zonefile for a name that is about @size bytes long
+    """
+    zonefile = "$ORIGIN %s\n$TTL 3600\n" % name
+    i = 0
+    while len(zonefile) < size:
+        zonefile += 'pad%s IN TXT "%s"\n' % (i, "".join(random.choice("abcdef0123456789") for j in xrange(0, 200)))
+        i += 1
+
+    return zonefile
+
+
+# ---------------------------------------------------------
+# stand-in backends.
+# each setup function returns a dict with:
+#   'driver': the driver module
+#   'make_immutable': function(i, size) -> (key, data)
+#   'put_immutable': function(key, data) -> True/False (default: the driver's)
+#   'mutable': True if the driver's mutable handlers should be exercised
+#   'put_mutable': function(data_id, data) -> True/False (default: the driver's)
+#   'delete_removes': True if delete handlers actually remove data
+#   'teardown': function()
+# or {'skipped': reason}
+# ---------------------------------------------------------
+
+def make_random_immutable( i, size ):
+    data = os.urandom(size)
+    return (hashlib.sha256(data).hexdigest(), data)
+
+
+def setup_disk( tmpdir, args ):
+    driver = load_driver("disk")
+    driver.DISK_ROOT = os.path.join(tmpdir, "disk")
+    driver.IMMUTABLE_STORAGE_ROOT = driver.DISK_ROOT + "/immutable"
+    driver.MUTABLE_STORAGE_ROOT = driver.DISK_ROOT + "/mutable"
+    assert driver.storage_init({})
+
+    return {'driver': driver, 'make_immutable': make_random_immutable, 'mutable': True, 'delete_removes': True}
+
+
+def setup_sqlite( tmpdir, args ):
+    driver = load_driver("sqlite")
+    driver.SQLITE_PATH = os.path.join(tmpdir, "sqlite", "storage.db")
+    assert driver.storage_init({})
+
+    return {'driver': driver, 'make_immutable': make_random_immutable, 'mutable': True, 'delete_removes': True}
+
+
+def setup_http( tmpdir, args ):
+    # read-only driver: "puts" write files into the served directory
+    driver = load_driver("http")
+    driver.HTTP_CACHE_DIR = os.path.join(tmpdir, "http-cache")
+    assert driver.storage_init({})
+
+    docroot = os.path.join(tmpdir, "http")
+    os.makedirs(docroot)
+
+    class Handler( SimpleHTTPServer.SimpleHTTPRequestHandler ):
+        def translate_path(self, path):
+            return os.path.join( docroot, os.path.basename(path) )
+
+        def log_message(self, *args):
+            pass
+
+    srv = start_server( ThreadingHTTPServer( ("127.0.0.1", 0), Handler ) )
+    base_url = "http://127.0.0.1:%s" % srv.server_address[1]
+
+    def put_mutable( data_id, data ):
+        with open( os.path.join(docroot, data_id), "w" ) as f:
+            f.write(data)
+
+        return True
+
+    driver.make_mutable_url = lambda data_id: "%s/%s" % (base_url, data_id)
+
+    return {'driver': driver, 'make_immutable': None, 'mutable': True, 'put_mutable': put_mutable, 'delete_removes': False, 'teardown': srv.shutdown}
+
+
+def setup_blockstack_server( tmpdir, args ):
+    # stub of the blockstack server's zonefile API.
+    # (profile puts need a wallet to sign with, so only zonefiles are exercised)
+    zonefiles = {}
+
+    def get_zonefiles( zonefile_hashes ):
+        ret = {}
+        for zfh in zonefile_hashes:
+            if zonefiles.has_key(zfh):
+                ret[zfh] = base64.b64encode( zonefiles[zfh] )
+
+        return json.dumps({'status': True, 'zonefiles': ret})
+
+    def put_zonefiles( zonefiles_b64 ):
+        saved = []
+        for zf_b64 in zonefiles_b64:
+            zf = base64.b64decode( zf_b64 )
+            zonefiles[pybitcoin.hex_hash160(zf)] = zf
+            saved.append(1)
+
+        return json.dumps({'status': True, 'saved': saved})
+
+    srv = ThreadingXMLRPCServer( ("127.0.0.1", 0), logRequests=False, allow_none=True )
+    srv.register_function( get_zonefiles, "get_zonefiles" )
+    srv.register_function( put_zonefiles, "put_zonefiles" )
+    start_server( srv )
+
+    driver = load_driver("blockstack_server")
+    driver.SERVER_NAME = "127.0.0.1"
+    driver.SERVER_PORT = srv.server_address[1]
+
+    def make_immutable( i, size ):
+        zonefile = make_zonefile( "benchmark%s.id" % i, size )
+        return (pybitcoin.hex_hash160(zonefile), zonefile)
+
+    return {'driver': driver, 'make_immutable': make_immutable, 'mutable': False, 'delete_removes': False, 'teardown': srv.shutdown}
+
+
+def setup_s3( tmpdir, args ):
+    if args.s3_endpoint is None:
+        return {'skipped': 'no local S3-compatible endpoint given (--s3-endpoint)'}
+
+    driver = load_driver("s3")
+    host, port = args.s3_endpoint.rsplit(":", 1)
+    driver.S3_HOST = host
+    driver.S3_PORT = int(port)
+    driver.S3_IS_SECURE = False
+    driver.AWS_ACCESS_KEY_ID = "benchmark"
+    driver.AWS_SECRET_ACCESS_KEY = "benchmark"
+    driver.AWS_BUCKET = "blockstack-benchmark"
+
+    return {'driver': driver, 'make_immutable': make_random_immutable, 'mutable': True, 'delete_removes': True}
+
+
+def setup_dht( tmpdir, args ):
+    if args.dht_endpoint is None:
+        return {'skipped': 'no local DHT node given (--dht-endpoint)'}
+
+    driver = load_driver("dht")
+    host, port = args.dht_endpoint.rsplit(":", 1)
+    driver.DHT_ENDPOINTS = [(host, int(port))]
+
+    def make_immutable( i, size ):
+        data = os.urandom(size).encode('hex')[:size]
+        return (pybitcoin.hex_hash160(data), data)
+
+    return {'driver': driver, 'make_immutable': make_immutable, 'mutable': True, 'delete_removes': True}
+
+
+SETUP = {
+    "disk": setup_disk,
+    "sqlite": setup_sqlite,
+    "http": setup_http,
+    "blockstack_server": setup_blockstack_server,
+    "s3": setup_s3,
+    "dht": setup_dht,
+}
+
+
+# ---------------------------------------------------------
+# conformance checks
+# ---------------------------------------------------------
+
+def try_call( func, *args, **kw ):
+    """
+    Call a handler.  Return (result, error string or None)
+    """
+    try:
+        return (func(*args, **kw), None)
+    except Exception, e:
+        return (None, "%s: %s" % (e.__class__.__name__, e))
+
+
+def check_conformance( backend ):
+    """
+    Check a driver against the storage driver API contract.
+    Return {check name: {'ok': True/False, 'error': ...}}
+    """
+    driver = backend['driver']
+    checks = {}
+
+    def record( name, ok, error=None ):
+        checks[name] = {'ok': ok}
+        if error is not None:
+            checks[name]['error'] = error
+
+    for method in STORAGE_DRIVER_METHODS + ["storage_init", "handles_url"]:
+        record( "has_%s" % method, callable(getattr(driver, method, None)) )
+
+    url, err = try_call( driver.make_mutable_url, "conformance.id:test" )
+    if url is not None or err is not None:
+        handled, err2 = try_call( driver.handles_url, url )
+        record( "handles_own_mutable_url", handled is True, err or err2 )
+
+    if backend.get('make_immutable', None) is not None:
+        key, data = backend['make_immutable']( 0, 1024 )
+
+        rc, err = try_call( backend.get('put_immutable', driver.put_immutable_handler), key, data, "unused" )
+        record( "put_immutable", bool(rc), err )
+
+        rd, err = try_call( driver.get_immutable_handler, key, zonefile=True )
+        record( "get_immutable_roundtrip", rd == data, err )
+
+        rd, err = try_call( driver.get_immutable_handler, "00" * 32, zonefile=True )
+        record( "get_immutable_missing_is_none", rd is None )
+
+        rc, err = try_call( driver.delete_immutable_handler, key, "unused", "unused" )
+        record( "delete_immutable", bool(rc), err )
+
+        if backend.get('delete_removes', False):
+            rd, err = try_call( driver.get_immutable_handler, key, zonefile=True )
+            record( "delete_immutable_removes", rd is None )
+
+    if backend.get('mutable', False):
+        data_id = "conformance.id:mutable"
+        data = '{"conformance": true}'
+
+        rc, err = try_call( backend.get('put_mutable', driver.put_mutable_handler), data_id, data )
+        record( "put_mutable", bool(rc), err )
+
+        rd, err = try_call( driver.get_mutable_handler, driver.make_mutable_url(data_id) )
+        record( "get_mutable_roundtrip", rd == data, err )
+
+        rc, err = try_call( driver.delete_mutable_handler, data_id, "unused" )
+        record( "delete_mutable", bool(rc), err )
+
+        if backend.get('delete_removes', False):
+            rd, err = try_call( driver.get_mutable_handler, driver.make_mutable_url(data_id) )
+            record( "delete_mutable_removes", rd is None )
+
+    return checks
+
+
+# ---------------------------------------------------------
+# benchmarks
+# ---------------------------------------------------------
+
+def percentile( sorted_values, p ):
+    """
+    Get the p-th percentile of a sorted list
+    """
+    if len(sorted_values) == 0:
+        return None
+
+    i = int(round( (p / 100.0) * (len(sorted_values) - 1) ))
+    return sorted_values[i]
+
+
+def run_op( op_name, func, args_list, concurrency, size ):
+    """
+    Run func(*args) for each args in args_list, with @concurrency threads.
+    Return the op's statistics
+    """
+    work = Queue.Queue()
+    for args in args_list:
+        work.put(args)
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                args = work.get_nowait()
+            except Queue.Empty:
+                return
+
+            begin = time.time()
+            try:
+                rc = func(*args)
+            except Exception, e:
+                rc = None
+
+            end = time.time()
+            with lock:
+                if rc:
+                    latencies.append(end - begin)
+                else:
+                    errors[0] += 1
+
+    begin = time.time()
+    threads = [threading.Thread(target=worker) for i in xrange(0, concurrency)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    elapsed = time.time() - begin
+    latencies.sort()
+
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'op': op_name,
+        'size': size,
+        'concurrency': concurrency,
+        'count': len(args_list),
+        'errors': errors[0],
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if len(latencies) > 0 else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if len(latencies) > 0 else None,
+        },
+        'ops_per_sec': round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        'bytes_per_sec': round(len(latencies) * size / elapsed, 3) if elapsed > 0 else None,
+    }
+
+
+def benchmark_driver( backend, sizes, concurrencies, num_ops ):
+    """
+    Benchmark a driver's handlers.
+    Return the list of op statistics
+    """
+    driver = backend['driver']
+    results = []
+
+    for size in sizes:
+        for concurrency in concurrencies:
+
+            if backend.get('make_immutable', None) is not None:
+                objs = [backend['make_immutable']( i, size ) for i in xrange(0, num_ops)]
+                put = backend.get('put_immutable', driver.put_immutable_handler)
+
+                results.append( run_op( "put_immutable", lambda k, d: put(k, d, "unused"), objs, concurrency, size ) )
+                results.append( run_op( "get_immutable", lambda k, d: driver.get_immutable_handler(k, zonefile=True) == d, objs, concurrency, size ) )
+                results.append( run_op( "delete_immutable", lambda k, d: driver.delete_immutable_handler(k, "unused", "unused"), objs, concurrency, size ) )
+
+            if backend.get('mutable', False):
+                objs = [("benchmark.id:%s-%s-%s" % (size, concurrency, i), os.urandom(size / 2 + 1).encode('hex')[:size]) for i in xrange(0, num_ops)]
+                put = backend.get('put_mutable', driver.put_mutable_handler)
+
+                results.append( run_op( "put_mutable", put, objs, concurrency, size ) )
+                results.append( run_op( "get_mutable", lambda i, d: driver.get_mutable_handler( driver.make_mutable_url(i) ) == d, objs, concurrency, size ) )
+                results.append( run_op( "delete_mutable", lambda i, d: driver.delete_mutable_handler(i, "unused"), objs, concurrency, size ) )
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser( description="Check and benchmark Blockstack storage drivers against local stand-in backends" )
+    parser.add_argument( "--drivers", default=",".join(ALL_DRIVERS), help="comma-separated list of drivers (default: %(default)s)" )
+    parser.add_argument( "--sizes", default="1024,65536,1048576", help="comma-separated object sizes in bytes (default: %(default)s)" )
+    parser.add_argument( "--concurrency", default="1,8", help="comma-separated concurrency levels (default: %(default)s)" )
+    parser.add_argument( "--ops", type=int, default=50, help="operations per size, concurrency level, and op (default: %(default)s)" )
+    parser.add_argument( "--s3-endpoint", default=None, help="host:port of a local S3-compatible server" )
+    parser.add_argument( "--dht-endpoint", default=None, help="host:port of a local DHT node" )
+    parser.add_argument( "--output", default=None, help="write the JSON results here instead of stdout" )
+    parser.add_argument( "--conformance-only", action="store_true", help="only run the conformance checks" )
+
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    concurrencies = [int(c) for c in args.concurrency.split(",")]
+    driver_names = args.drivers.split(",")
+
+    for driver_name in driver_names:
+        if driver_name not in SETUP.keys():
+            print >> sys.stderr, "Unknown driver '%s' (expected one of %s)" % (driver_name, ",".join(ALL_DRIVERS))
+            sys.exit(1)
+
+    report = {
+        'params': {
+            'sizes': sizes,
+            'concurrency': concurrencies,
+            'ops': args.ops,
+        },
+        'drivers': {}
+    }
+
+    tmpdir = tempfile.mkdtemp( prefix="blockstack-storage-benchmark-" )
+    try:
+        for driver_name in driver_names:
+            print >> sys.stderr, "%s..." % driver_name
+
+            try:
+                backend = SETUP[driver_name]( tmpdir, args )
+            except Exception, e:
+                traceback.print_exc()
+                backend = {'skipped': 'failed to set up: %s' % e}
+
+            if backend.has_key('skipped'):
+                report['drivers'][driver_name] = {'skipped': backend['skipped']}
+                continue
+
+            driver_report = {}
+            driver_report['conformance'] = check_conformance( backend )
+            driver_report['conformant'] = all([c['ok'] for c in driver_report['conformance'].values()])
+
+            if not args.conformance_only:
+                driver_report['results'] = benchmark_driver( backend, sizes, concurrencies, args.ops )
+
+            if backend.has_key('teardown'):
+                backend['teardown']()
+
+            report['drivers'][driver_name] = driver_report
+
+    finally:
+        shutil.rmtree( tmpdir, ignore_errors=True )
+
+    report_json = json.dumps( report, indent=4, sort_keys=True )
+    if args.output is not None:
+        with open( args.output, "w" ) as f:
+            f.write( report_json )
+
+    else:
+        print report_json
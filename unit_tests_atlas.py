@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+
+    copyright: (c) 2014 by Halfmoon Labs, Inc.
+    copyright: (c) 2015 by Blockstack.org
+
+This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Offline tests for blockstack_client.atlas (no server or network needed)
+
+import os
+import sys
+import unittest
+
+from blockstack_client import atlas
+
+
+def make_inv( bits, length ):
+    """
+    Make an inventory of @length bytes with the given bits set
+    """
+    inv = bytearray( length )
+    for bit in bits:
+        inv[bit / 8] |= 1 << (7 - (bit % 8))
+
+    return str(inv)
+
+
+class InventoryDiffTest(unittest.TestCase):
+
+    def test_diff(self):
+        """ Check that only the bits set remotely but not locally are reported
+        """
+        remote = make_inv( [0, 3, 9, 15, 23], 3 )
+        local = make_inv( [3, 15], 3 )
+        self.assertEqual( atlas.inventory_diff( remote, local ), [0, 9, 23] )
+
+    def test_nothing_missing(self):
+        """ Check that identical inventories, or a local superset, have no differences
+        """
+        remote = make_inv( [1, 2, 30], 4 )
+        self.assertEqual( atlas.inventory_diff( remote, remote ), [] )
+        self.assertEqual( atlas.inventory_diff( remote, make_inv( range(0, 32), 4 ) ), [] )
+        self.assertEqual( atlas.inventory_diff( "", remote ), [] )
+
+    def test_uneven_lengths(self):
+        """ Check that a short local inventory is padded, and a long one is truncated
+        """
+        remote = make_inv( [0, 12, 17], 3 )
+        self.assertEqual( atlas.inventory_diff( remote, make_inv( [0], 1 ) ), [12, 17] )
+        self.assertEqual( atlas.inventory_diff( remote, "" ), [0, 12, 17] )
+        self.assertEqual( atlas.inventory_diff( remote, make_inv( [12, 40], 6 ) ), [0, 17] )
+
+    def test_leading_zero_bytes(self):
+        """ Check that bit positions are right when the difference starts past the first bytes
+        """
+        remote = make_inv( [70], 10 )
+        self.assertEqual( atlas.inventory_diff( remote, "" ), [70] )
+
+    def test_matches_bitwise(self):
+        """ Check the result against a bit-by-bit comparison
+        """
+        remote = make_inv( [i for i in xrange(0, 200) if i % 3 == 0 or i % 7 == 0], 25 )
+        local = make_inv( [i for i in xrange(0, 200) if i % 5 == 0], 25 )
+
+        expected = []
+        for i in xrange(0, 200):
+            remote_bit = ord(remote[i / 8]) & (1 << (7 - (i % 8)))
+            local_bit = ord(local[i / 8]) & (1 << (7 - (i % 8)))
+            if remote_bit and not local_bit:
+                expected.append( i )
+
+        self.assertEqual( atlas.inventory_diff( remote, local ), expected )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+
+    copyright: (c) 2014 by Halfmoon Labs, Inc.
+    copyright: (c) 2015 by Blockstack.org
+
+This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Offline tests for the storage drivers (no server or network needed)
+
+import os
+import sys
+import json
+import base64
+import hashlib
+import zlib
+import time
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import requests
+
+from blockstack_client.backend.drivers import s3, http, dht, disk, blockstack_server
+
+
+class S3ChunkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_compression = s3.S3_COMPRESSION
+        self.data = "".join( "line %s of some compressible data\n" % i for i in xrange(0, 20000) )
+
+    def tearDown(self):
+        s3.S3_COMPRESSION = self.old_compression
+
+    def test_chunk_round_trip(self):
+        """ Check that compress_chunk() and decompress_chunk() round-trip, for every codec and size
+        """
+        for codec in s3.CHUNK_CODECS.keys():
+            s3.S3_COMPRESSION = codec
+            for data in ["", "a", os.urandom(1000), self.data]:
+                chunk = s3.compress_chunk( data )
+                self.assertTrue( chunk.startswith( s3.CHUNK_HEADER_MAGIC ) )
+                self.assertEqual( s3.decompress_chunk( chunk ), data, "codec %s" % codec )
+
+        # legacy chunks have no header
+        self.assertEqual( s3.decompress_chunk( zlib.compress(self.data) ), self.data )
+
+    def test_chunk_stream(self):
+        """ Check that compress_chunk_stream() yields full, non-empty parts that decompress to the data
+        """
+        part_size = 1000
+        for codec in s3.CHUNK_CODECS.keys():
+            s3.S3_COMPRESSION = codec
+
+            # with "none", this makes the chunk an exact multiple of the part size
+            data = self.data[:10 * part_size - len(s3.CHUNK_HEADER_MAGIC) - 1]
+            for data in [data, self.data, "a"]:
+                parts = list( s3.compress_chunk_stream( StringIO(data), part_size ) )
+                for part in parts[:-1]:
+                    self.assertEqual( len(part), part_size )
+
+                self.assertTrue( 0 < len(parts[-1]) <= part_size )
+                self.assertEqual( s3.decompress_chunk( "".join(parts) ), data, "codec %s" % codec )
+
+    def test_compression_level(self):
+        """ Check that storage_init() rejects compression levels the codec doesn't support
+        """
+        saved = dict( (k, getattr(s3, k)) for k in dir(s3) if k.startswith("AWS_") or k.startswith("S3_") )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            config_path = os.path.join( tmpdir, "client.ini" )
+            for codec, level, expected in [("bz2", 0, False), ("bz2", 9, True), ("zlib", 0, True), ("zlib", 10, False), ("none", 100, True)]:
+                with open( config_path, "w" ) as f:
+                    f.write("[s3]\nbucket = test\napi_key_id = id\napi_key_secret = secret\n")
+                    f.write("compression = %s\ncompression_level = %s\n" % (codec, level))
+
+                self.assertEqual( s3.storage_init( {'path': config_path} ), expected, "%s level %s" % (codec, level) )
+
+        finally:
+            shutil.rmtree( tmpdir )
+            for k, v in saved.items():
+                setattr( s3, k, v )
+
+    def test_chunk_reader(self):
+        """ Check that streamed chunks decompress to the original data, for every codec
+        """
+        for codec in s3.CHUNK_CODECS.keys():
+            s3.S3_COMPRESSION = codec
+            chunk = s3.compress_chunk( self.data )
+
+            reader = s3.ChunkReader( StringIO(chunk) )
+            reader.READ_SIZE = 1000
+            parts = []
+            while True:
+                buf = reader.read(4096)
+                if len(buf) == 0:
+                    break
+
+                parts.append(buf)
+
+            self.assertEqual( "".join(parts), self.data, "codec %s" % codec )
+
+            reader = s3.ChunkReader( StringIO(chunk) )
+            self.assertEqual( reader.read(), self.data, "codec %s" % codec )
+
+    def test_chunk_reader_legacy(self):
+        """ Check that chunks written without a header are read as zlib
+        """
+        reader = s3.ChunkReader( StringIO(zlib.compress(self.data)) )
+        self.assertEqual( reader.read(10), self.data[:10] )
+        self.assertEqual( reader.read(), self.data[10:] )
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content="", headers={}):
+        self.status_code = status_code
+        self.content = content
+        self.headers = requests.structures.CaseInsensitiveDict( headers )
+
+
+class FakeSession(object):
+    """
+    Serves one object, with byte ranges.  If @encoding is given,
+    ranged responses claim that content-coding regardless of what was asked for.
+    """
+
+    def __init__(self, data, encoding=None):
+        self.data = data
+        self.encoding = encoding
+        self.requests = []
+
+    def get(self, url, headers={}, timeout=None):
+        self.requests.append( dict(headers) )
+        if 'Range' not in headers:
+            return FakeResponse( 200, self.data )
+
+        start, end = [int(x) for x in headers['Range'][len('bytes='):].split('-')]
+        end = min(end, len(self.data) - 1)
+        resp_headers = {'Content-Range': 'bytes %s-%s/%s' % (start, end, len(self.data))}
+        if self.encoding is not None:
+            resp_headers['Content-Encoding'] = self.encoding
+
+        return FakeResponse( 206, self.data[start:end+1], resp_headers )
+
+
+class HTTPRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (http.get_session, http.HTTP_CACHE, http.HTTP_RANGE_SIZE)
+        http.HTTP_CACHE = False
+        http.HTTP_RANGE_SIZE = 1000
+        self.data = os.urandom(3500)
+
+    def tearDown(self):
+        http.get_session, http.HTTP_CACHE, http.HTTP_RANGE_SIZE = self.saved
+
+    def test_ranges_ask_for_identity(self):
+        """ Check that every ranged request asks for the unencoded object
+        """
+        session = FakeSession( self.data )
+        http.get_session = lambda: session
+
+        self.assertEqual( http.get_url( "http://example.com/foo" ), self.data )
+        self.assertEqual( len(session.requests), 4 )
+        for headers in session.requests:
+            self.assertEqual( headers.get('Accept-Encoding', None), 'identity' )
+
+    def test_encoded_range_refetched(self):
+        """ Check that a ranged response with a content-coding isn't used, and the whole object is fetched instead
+        """
+        session = FakeSession( self.data, encoding='gzip' )
+        http.get_session = lambda: session
+
+        self.assertEqual( http.get_url( "http://example.com/foo" ), self.data )
+        self.assertNotIn( 'Range', session.requests[-1] )
+
+
+class DHTTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (dht.DHT_ENDPOINTS, dht.DHT_TIMEOUT, dht.dht_endpoint_get)
+        dht.DHT_TIMEOUT = 0.5
+        self.data = "hello world"
+        self.data_key = dht.dht_data_hash( self.data )
+
+    def tearDown(self):
+        dht.DHT_ENDPOINTS, dht.DHT_TIMEOUT, dht.dht_endpoint_get = self.saved
+
+    def slow_endpoints(self, delays, value=None):
+        """
+        Make endpoints that each take the given time to reply with @value
+        """
+        dht.DHT_ENDPOINTS = [("host%s" % i, i) for i in xrange(0, len(delays))]
+
+        def endpoint_get( endpoint, data_key ):
+            time.sleep( delays[endpoint[1]] )
+            return value
+
+        dht.dht_endpoint_get = endpoint_get
+
+    def test_overall_deadline(self):
+        """ Check that slow misses can't stretch a get past DHT_TIMEOUT in total
+        """
+        self.slow_endpoints( [0.3, 0.6, 0.9, 1.2] )
+        begin = time.time()
+        self.assertRaises( Exception, dht.dht_get_key, self.data_key )
+        self.assertLess( time.time() - begin, 0.8 )
+
+    def test_single_endpoint(self):
+        """ Check that a single endpoint gets the same timeout and validation as several
+        """
+        self.slow_endpoints( [2.0], value=self.data )
+        begin = time.time()
+        self.assertRaises( Exception, dht.dht_get_key, self.data_key )
+        self.assertLess( time.time() - begin, 1.0 )
+
+        self.slow_endpoints( [0.0], value="not the data" )
+        self.assertRaises( Exception, dht.dht_get_key, self.data_key )
+
+        self.slow_endpoints( [0.0], value=self.data )
+        self.assertEqual( dht.dht_get_key( self.data_key ), self.data )
+
+
+class FakeZonefileSession(object):
+    """
+    Serves zonefiles by hash, and fails any batch with a hash in @bad_hashes
+    """
+
+    def __init__(self, zonefiles, bad_hashes):
+        self.zonefiles = zonefiles
+        self.bad_hashes = bad_hashes
+
+    def get_zonefiles(self, zonefile_hashes):
+        if len(set(zonefile_hashes).intersection(self.bad_hashes)) > 0:
+            raise Exception("connection reset")
+
+        found = dict( [(h, base64.b64encode(self.zonefiles[h])) for h in zonefile_hashes if self.zonefiles.has_key(h)] )
+        return json.dumps( {'status': True, 'zonefiles': found} )
+
+
+class ServerZonefileBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (blockstack_server.get_session, blockstack_server.MAX_ZONEFILES_PER_REQUEST)
+        blockstack_server.MAX_ZONEFILES_PER_REQUEST = 3
+
+        self.zonefiles = {}
+        for i in xrange(0, 8):
+            zonefile = "$ORIGIN name%s.id\n" % i
+            self.zonefiles[hashlib.new('ripemd160', hashlib.sha256(zonefile).digest()).hexdigest()] = zonefile
+
+        self.hashes = sorted(self.zonefiles.keys())
+
+    def tearDown(self):
+        blockstack_server.get_session, blockstack_server.MAX_ZONEFILES_PER_REQUEST = self.saved
+
+    def test_failed_batch(self):
+        """ Check that a failed batch keeps the other batches' zonefiles, and reports its own hashes
+        """
+        session = FakeZonefileSession( self.zonefiles, [self.hashes[4]] )
+        blockstack_server.get_session = lambda: session
+
+        failed = []
+        res = blockstack_server.get_immutable_batch_handler( self.hashes, zonefile=True, failed=failed )
+        self.assertEqual( sorted(failed), self.hashes[3:6] )
+        self.assertEqual( res, dict( [(h, self.zonefiles[h]) for h in self.hashes if h not in failed] ) )
+
+    def test_missing_is_not_failed(self):
+        """ Check that zonefiles the server doesn't have are not reported as failed
+        """
+        session = FakeZonefileSession( dict( [(h, self.zonefiles[h]) for h in self.hashes[:5]] ), [] )
+        blockstack_server.get_session = lambda: session
+
+        res = blockstack_server.get_zonefiles( self.hashes )
+        self.assertEqual( res['failed'], [] )
+        self.assertEqual( sorted(res['zonefiles'].keys()), self.hashes[:5] )
+
+
+class DiskLayoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (disk.IMMUTABLE_STORAGE_ROOT, disk.FSYNC_MODE)
+        disk.IMMUTABLE_STORAGE_ROOT = self.tmpdir
+        disk.FSYNC_MODE = "none"
+
+    def tearDown(self):
+        disk.IMMUTABLE_STORAGE_ROOT, disk.FSYNC_MODE = self.saved
+        shutil.rmtree( self.tmpdir )
+
+    def write_flat( self, name, data ):
+        with open( os.path.join(self.tmpdir, name), "w" ) as f:
+            f.write( data )
+
+    def test_shard_path(self):
+        """ Check that objects are spread over SHARD_DEPTH levels of SHARD_WIDTH-character directories
+        """
+        path = disk.get_shard_path( self.tmpdir, "foo" )
+        h = hashlib.sha256("foo").hexdigest()
+        self.assertEqual( path, os.path.join( self.tmpdir, h[0:2], h[2:4], "foo" ) )
+
+    def test_flat_layout_readable(self):
+        """ Check that objects in the old flat layout are still found, and are superseded by new writes
+        """
+        self.write_flat( "foo", "old" )
+        self.assertEqual( disk.get_immutable_handler( "foo" ), "old" )
+
+        self.assertTrue( disk.put_immutable_handler( "foo", "new", "txid" ) )
+        self.assertEqual( disk.get_immutable_handler( "foo" ), "new" )
+        self.assertFalse( os.path.exists( os.path.join(self.tmpdir, "foo") ) )
+
+    def test_migrate(self):
+        """ Check that migration moves flat objects into their shards, keeps newer sharded copies, and skips torn writes
+        """
+        self.write_flat( "foo", "foo data" )
+        self.write_flat( "bar", "stale bar data" )
+        self.write_flat( disk.TEMPFILE_PREFIX + "torn", "partial" )
+        self.assertTrue( disk.write_object( self.tmpdir, "bar", "bar data" ) )
+        self.write_flat( "bar", "stale bar data" )
+
+        self.assertEqual( disk.migrate_flat_layout( self.tmpdir ), 2 )
+        self.assertEqual( sorted(f for f in os.listdir(self.tmpdir) if os.path.isfile(os.path.join(self.tmpdir, f))), [disk.TEMPFILE_PREFIX + "torn"] )
+        self.assertEqual( disk.get_object_path( self.tmpdir, "foo" ), disk.get_shard_path( self.tmpdir, "foo" ) )
+        self.assertEqual( disk.get_immutable_handler( "foo" ), "foo data" )
+        self.assertEqual( disk.get_immutable_handler( "bar" ), "bar data" )
+
+        # nothing left to do
+        self.assertEqual( disk.migrate_flat_layout( self.tmpdir ), 0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+
+    copyright: (c) 2014 by Halfmoon Labs, Inc.
+    copyright: (c) 2015 by Blockstack.org
+
+This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Offline tests for blockstack_client.prewarm (no server or network needed)
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+from blockstack_client import prewarm
+
+
+class FakeProxy(object):
+    """
+    Stands in for a connection to blockstack-server
+    """
+    def __init__(self, config_path):
+        self.conf = {'path': config_path}
+
+
+class PrewarmBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict( [(attr, getattr(prewarm, attr)) for attr in
+                           ['get_name_blockchain_record', 'atlas_mirror_get_zonefiles', 'atlas_mirror_put_zonefiles',
+                            'load_name_zonefiles', 'get_name_profiles']] )
+
+    def tearDown(self):
+        for attr, value in self.saved.items():
+            setattr( prewarm, attr, value )
+
+    def test_missing_vs_errors(self):
+        """ Check that names with no zonefile or profile are counted as missing, not as errors
+        """
+        name_records = {
+            'good.id': {'value_hash': '11' * 20},
+            'nozonefile.id': {'value_hash': None},
+            'noprofile.id': {'value_hash': '22' * 20},
+            'failedprofile.id': {'value_hash': '33' * 20},
+            'failedrecord.id': {'error': 'Connection refused'},
+        }
+
+        profiles = {
+            'good.id': {'profile': {}, 'zonefile': {}},
+            'noprofile.id': {'error': 'Failed to load user profile', 'missing': True},
+            'failedprofile.id': {'error': 'Failed to load user profile'},
+        }
+
+        prewarm.get_name_blockchain_record = lambda name, proxy=None: name_records[name]
+        prewarm.atlas_mirror_get_zonefiles = lambda zonefile_hashes, config_path=None: {}
+        prewarm.atlas_mirror_put_zonefiles = lambda zonefiles, config_path=None: True
+        prewarm.load_name_zonefiles = lambda zonefile_hashes, proxy=None, max_workers=None: dict( [(zfh, 'zonefile') for zfh in zonefile_hashes] )
+        prewarm.get_name_profiles = lambda names, **kw: {'status': True, 'profiles': dict( [(name, profiles[name]) for name in names] )}
+
+        res = prewarm.prewarm_batch( name_records.keys(), FakeProxy('/tmp/client.ini') )
+        self.assertEqual( res['names'], 5 )
+        self.assertEqual( res['zonefiles_fetched'], 3 )
+        self.assertEqual( res['profiles'], 1 )
+        self.assertEqual( res['missing'], 2 )
+        self.assertEqual( res['errors'], 2 )
+
+
+class PrewarmCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_path = os.path.join( self.tmpdir, 'client.ini' )
+        self.proxy = FakeProxy( self.config_path )
+        self.saved = dict( [(attr, getattr(prewarm, attr)) for attr in
+                           ['get_num_names_in_namespace', 'get_names_in_namespace_page', 'prewarm_batch']] )
+
+        self.num_names = 3 * prewarm.PREWARM_BATCH_SIZE
+        self.failing = set()
+        self.warmed = []
+        self.lock = threading.Lock()
+
+        def get_names_in_namespace_page( namespace_id, offset, count, proxy=None ):
+            return ['name{}.test'.format(i) for i in xrange(offset, offset + count)]
+
+        def prewarm_batch( names, proxy, max_workers=None ):
+            if names[0] in self.failing:
+                raise Exception("Failed to warm {}".format(names[0]))
+
+            with self.lock:
+                self.warmed.append( names[0] )
+
+            return {'names': len(names), 'zonefiles_cached': 0, 'zonefiles_fetched': len(names),
+                    'profiles': len(names), 'missing': 0, 'errors': 0}
+
+        prewarm.get_num_names_in_namespace = lambda namespace_id, proxy=None: self.num_names
+        prewarm.get_names_in_namespace_page = get_names_in_namespace_page
+        prewarm.prewarm_batch = prewarm_batch
+
+    def tearDown(self):
+        for attr, value in self.saved.items():
+            setattr( prewarm, attr, value )
+
+        shutil.rmtree( self.tmpdir )
+
+    def test_failed_batch_stalls_checkpoint(self):
+        """ Check that a failed middle batch holds the checkpoint at its offset, and a later run resumes from there
+        """
+        checkpoint_path = prewarm.get_prewarm_checkpoint_path( 'test', config_path=self.config_path )
+        middle = 'name{}.test'.format(prewarm.PREWARM_BATCH_SIZE)
+        self.failing.add( middle )
+
+        res = prewarm.prewarm_namespace( 'test', config_path=self.config_path, proxy=self.proxy )
+        self.assertIn( 'error', res )
+        self.assertEqual( res['partial']['offset'], prewarm.PREWARM_BATCH_SIZE )
+        self.assertEqual( sorted(self.warmed), ['name0.test', 'name{}.test'.format(2 * prewarm.PREWARM_BATCH_SIZE)] )
+
+        checkpoint = prewarm.prewarm_checkpoint_load( checkpoint_path )
+        self.assertEqual( checkpoint, {'namespace_id': 'test', 'offset': prewarm.PREWARM_BATCH_SIZE, 'total': self.num_names} )
+
+        # next run starts at the failed batch, and finishes the namespace
+        self.failing.clear()
+        self.warmed = []
+        res = prewarm.prewarm_namespace( 'test', config_path=self.config_path, proxy=self.proxy )
+        self.assertNotIn( 'error', res )
+        self.assertEqual( res['offset'], self.num_names )
+        self.assertEqual( res['names'], 2 * prewarm.PREWARM_BATCH_SIZE )
+        self.assertEqual( sorted(self.warmed), [middle, 'name{}.test'.format(2 * prewarm.PREWARM_BATCH_SIZE)] )
+        self.assertFalse( os.path.exists( checkpoint_path ) )
+
+    def test_restart(self):
+        """ Check that a restart ignores the checkpoint
+        """
+        checkpoint_path = prewarm.get_prewarm_checkpoint_path( 'test', config_path=self.config_path )
+        prewarm.prewarm_checkpoint_store( checkpoint_path, {'namespace_id': 'test', 'offset': 2 * prewarm.PREWARM_BATCH_SIZE, 'total': self.num_names} )
+
+        res = prewarm.prewarm_namespace( 'test', config_path=self.config_path, proxy=self.proxy, restart=True )
+        self.assertEqual( res['names'], self.num_names )
+        self.assertEqual( len(self.warmed), 3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+
+    copyright: (c) 2014 by Halfmoon Labs, Inc.
+    copyright: (c) 2015 by Blockstack.org
+
+This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Offline tests for blockstack_client.profile (no server or network needed)
+
+import os
+import sys
+import time
+import unittest
+
+from blockstack_client import profile, storage
+
+
+class NegativeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (profile.NEGATIVE_CACHE_SIZE, dict(profile.NEGATIVE_CACHE_TTL), storage.get_mutable_data_status)
+        profile.negative_cache.clear()
+        profile.negative_cache_block['height'] = 100
+
+        # don't ask a server for the current block
+        profile.negative_cache_block['checked'] = time.time()
+
+    def tearDown(self):
+        profile.NEGATIVE_CACHE_SIZE, ttl, storage.get_mutable_data_status = self.saved
+        profile.NEGATIVE_CACHE_TTL.update( ttl )
+        profile.negative_cache.clear()
+
+    def test_put_get_forget(self):
+        """ Check that entries are remembered (with their values) until forgotten
+        """
+        self.assertEqual( profile.negative_cache_get( 'name', 'foo.id' ), (False, None) )
+
+        profile.negative_cache_put( 'name', 'foo.id', {'error': 'No such name'} )
+        self.assertEqual( profile.negative_cache_get( 'name', 'foo.id' ), (True, {'error': 'No such name'}) )
+        self.assertEqual( profile.negative_cache_get( 'profile', 'foo.id' ), (False, None) )
+
+        profile.negative_cache_forget( 'name', 'foo.id' )
+        self.assertEqual( profile.negative_cache_get( 'name', 'foo.id' ), (False, None) )
+
+    def test_expiry(self):
+        """ Check that entries expire after their type's TTL
+        """
+        profile.NEGATIVE_CACHE_TTL['profile'] = -1
+        profile.negative_cache_put( 'profile', 'foo.id' )
+        self.assertEqual( profile.negative_cache_get( 'profile', 'foo.id' ), (False, None) )
+
+    def test_new_block(self):
+        """ Check that a new block drops every entry
+        """
+        profile.negative_cache_put( 'profile', 'foo.id' )
+        profile.negative_cache_new_block( 100 )
+        self.assertTrue( profile.negative_cache_get( 'profile', 'foo.id' )[0] )
+
+        profile.negative_cache_new_block( 101 )
+        self.assertFalse( profile.negative_cache_get( 'profile', 'foo.id' )[0] )
+
+    def test_bounded(self):
+        """ Check that the least recently added entries are evicted first
+        """
+        profile.NEGATIVE_CACHE_SIZE = 2
+        for name in ['a.id', 'b.id', 'c.id']:
+            profile.negative_cache_put( 'profile', name )
+
+        self.assertFalse( profile.negative_cache_get( 'profile', 'a.id' )[0] )
+        self.assertTrue( profile.negative_cache_get( 'profile', 'b.id' )[0] )
+        self.assertTrue( profile.negative_cache_get( 'profile', 'c.id' )[0] )
+
+    def test_only_definite_misses(self):
+        """ Check that a profile is only remembered as missing if every driver said so
+        """
+        storage.get_mutable_data_status = lambda *args, **kw: (None, "error")
+        self.assertIsNone( profile.load_name_profile( 'foo.id', {}, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", None, use_zonefile_urls=False ) )
+        self.assertFalse( profile.negative_cache_get( 'profile', 'foo.id' )[0] )
+
+        storage.get_mutable_data_status = lambda *args, **kw: (None, "not found")
+        self.assertIsNone( profile.load_name_profile( 'foo.id', {}, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", None, use_zonefile_urls=False ) )
+        self.assertTrue( profile.negative_cache_get( 'profile', 'foo.id' )[0] )
+
+
+if __name__ == '__main__':
+    unittest.main()
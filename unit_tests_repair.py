@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+
+    copyright: (c) 2014 by Halfmoon Labs, Inc.
+    copyright: (c) 2015 by Blockstack.org
+
+This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Offline tests for blockstack_client.backend.repair (no server or network needed)
+
+import os
+import sys
+import time
+import types
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from blockstack_client import storage
+from blockstack_client.backend import repair
+
+
+def make_driver( name, objects ):
+    """
+    Make a storage driver that keeps immutable data in @objects
+    """
+    driver = types.ModuleType( name )
+    driver.get_immutable_handler = lambda key, **kw: objects.get( key, None )
+
+    def put_immutable_handler( key, data, txid, **kw ):
+        objects[key] = data
+        return True
+
+    driver.put_immutable_handler = put_immutable_handler
+    return driver
+
+
+class RepairDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join( self.tmpdir, "repair.db" )
+        self.config_path = os.path.join( self.tmpdir, "client.ini" )
+        repair.repair_confs[self.config_path] = {
+            'replica_repair': True,
+            'storage_drivers': 'a,b',
+            'repair_path': self.path,
+        }
+
+        self.old_handlers = storage.storage_handlers
+        self.replicas = {'a': {}, 'b': {}}
+        storage.storage_handlers = [make_driver( name, self.replicas[name] ) for name in ['a', 'b']]
+
+        self.data = '{"hello": "world"}'
+        self.data_hash = storage.get_data_hash( self.data )
+
+    def tearDown(self):
+        storage.storage_handlers = self.old_handlers
+        del repair.repair_confs[self.config_path]
+        shutil.rmtree( self.tmpdir )
+
+    def query(self, sql):
+        db = repair.repairdb_open( self.path )
+        rows = list( db.cursor().execute( sql ) )
+        db.close()
+        return rows
+
+    def note_put(self, succeeded, failed):
+        for name in succeeded:
+            self.replicas[name][self.data_hash] = self.data
+
+        self.assertTrue( repair.note_put( 'immutable', self.data_hash, self.data, succeeded, failed, txid="00" * 32, config_path=self.config_path ) )
+
+    def test_tracks_every_write(self):
+        """ Check that every write is remembered, but its data only while a replica is missing
+        """
+        self.note_put( ['a', 'b'], [] )
+        written = self.query( "SELECT * FROM written" )
+        self.assertEqual( len(written), 1 )
+        self.assertEqual( written[0]['drivers'], 'a,b' )
+        self.assertEqual( self.query( "SELECT * FROM objects" ), [] )
+
+        self.note_put( ['a'], ['b'] )
+        due = repair.repairdb_find_due( int(time.time()), path=self.path )
+        self.assertEqual( [(row['driver'], row['data']) for row in due], [('b', self.data)] )
+
+        # a later write that reaches every replica makes the re-push unnecessary
+        self.note_put( ['a', 'b'], [] )
+        self.assertEqual( self.query( "SELECT * FROM replicas" ), [] )
+        self.assertEqual( self.query( "SELECT * FROM objects" ), [] )
+        self.assertEqual( len(self.query( "SELECT * FROM written" )), 1 )
+
+    def test_forget(self):
+        """ Check that forgetting an object drops all of its rows
+        """
+        self.note_put( ['a'], ['b'] )
+        self.assertTrue( repair.forget( 'immutable', self.data_hash, config_path=self.config_path ) )
+        for table in ['written', 'objects', 'replicas']:
+            self.assertEqual( self.query( "SELECT * FROM %s" % table ), [] )
+
+    def test_repair(self):
+        """ Check that a failed replica is re-pushed, and its data dropped afterwards
+        """
+        self.note_put( ['a'], ['b'] )
+        res = repair.RepairWorker.repair_due( self.path, config_path=self.config_path )
+        self.assertEqual( res, {'status': True, 'repaired': 1, 'failed': 0} )
+        self.assertEqual( self.replicas['b'][self.data_hash], self.data )
+        self.assertEqual( self.query( "SELECT * FROM objects" ), [] )
+
+    def test_audit_finds_lost_replica(self):
+        """ Check that an audit finds a replica lost after a successful write, and repairs it from another
+        """
+        self.note_put( ['a', 'b'], [] )
+        del self.replicas['b'][self.data_hash]
+
+        res = repair.RepairWorker.audit_sample( self.path, ['a', 'b'], 10 )
+        self.assertEqual( res, {'status': True, 'audited': 1, 'missing': 1, 'lost': 0} )
+
+        res = repair.RepairWorker.repair_due( self.path, config_path=self.config_path )
+        self.assertEqual( res['repaired'], 1 )
+        self.assertEqual( self.replicas['b'][self.data_hash], self.data )
+
+        # corrupt replicas count as missing too
+        self.replicas['a'][self.data_hash] = "garbage"
+        res = repair.RepairWorker.audit_sample( self.path, ['a', 'b'], 10 )
+        self.assertEqual( res['missing'], 1 )
+
+    def test_audit_lost_object(self):
+        """ Check that an object with no good replica left is reported, and not queued
+        """
+        self.note_put( ['a', 'b'], [] )
+        self.replicas['a'].clear()
+        self.replicas['b'].clear()
+
+        res = repair.RepairWorker.audit_sample( self.path, ['a', 'b'], 10 )
+        self.assertEqual( res, {'status': True, 'audited': 1, 'missing': 2, 'lost': 1} )
+        self.assertEqual( self.query( "SELECT * FROM replicas" ), [] )
+
+    def test_audit_order(self):
+        """ Check that audits start with the least recently audited objects
+        """
+        self.note_put( ['a', 'b'], [] )
+        repair.repairdb_note_written( 'immutable', 'older', ['a', 'b'], ['a', 'b'], path=self.path )
+
+        db = repair.repairdb_open( self.path )
+        db.cursor().execute( "UPDATE written SET audited_at = 0 WHERE object_key = 'older';" )
+        db.cursor().execute( "UPDATE written SET audited_at = 1 WHERE object_key = ?;", (self.data_hash,) )
+        db.close()
+
+        self.assertEqual( [row['object_key'] for row in repair.repairdb_sample( 1, path=self.path )], ['older'] )
+
+        repair.RepairWorker.audit_sample( self.path, ['a', 'b'], 1 )
+        self.assertEqual( [row['object_key'] for row in repair.repairdb_sample( 1, path=self.path )], [self.data_hash] )
+
+    def test_upgrade(self):
+        """ Check that a database from before the 'written' table gets one
+        """
+        db = sqlite3.connect( self.path, isolation_level=None )
+        for line in [l + ";" for l in repair.REPAIR_SQL.split(";")]:
+            db.execute(line)
+
+        db.close()
+
+        repair.repairdb_upgraded.discard( self.path )
+        self.note_put( ['a', 'b'], [] )
+        self.assertEqual( len(self.query( "SELECT * FROM written" )), 1 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Blockstack-client
+    ~~~~~
+
+    copyright: (c) 2014 by Halfmoon Labs, Inc.
+    copyright: (c) 2015 by Blockstack.org
+
+This file is part of Blockstack-client.
+
+    Blockstack-client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Blockstack-client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Blockstack-client. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Offline tests for blockstack_client.storage (no server or network needed)
+
+import os
+import sys
+import json
+import base64
+import types
+import hashlib
+import unittest
+from cStringIO import StringIO
+
+import ecdsa
+
+import keylib
+import blockstack_profiles
+
+from blockstack_client import storage
+
+
+def tamper_signature( token ):
+    """
+    Flip a bit in a token's signature
+    """
+    header_b64, payload_b64, sig_b64 = token.split('.')
+    sig = bytearray( storage.base64url_decode(sig_b64) )
+    sig[10] ^= 0x01
+    return "%s.%s.%s" % (header_b64, payload_b64, base64.urlsafe_b64encode(str(sig)).rstrip('='))
+
+
+class ProfileTokenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.privkey = keylib.ECPrivateKey()
+        self.privkey_hex = self.privkey.to_hex()
+        if len(self.privkey_hex) == 64:
+            # signs with the compressed public key
+            self.privkey_hex += '01'
+
+        self.pubkey = keylib.ECPrivateKey( self.privkey_hex ).public_key().to_hex()
+        self.forms = storage.get_pubkey_forms( self.pubkey )
+        self.token_records = blockstack_profiles.sign_token_records( [{'name': 'alice'}], self.privkey_hex )
+        self.token = self.token_records[0]['token']
+
+    def test_valid_token(self):
+        """ Check that a token verifies against its issuer's key and addresses
+        """
+        for pubkey in self.forms['public_keys']:
+            payload = storage.verify_profile_token( self.token, public_key=pubkey )
+            self.assertIsNotNone( payload )
+            self.assertEqual( payload['claim'], {'name': 'alice'} )
+
+        for address in self.forms['addresses']:
+            self.assertIsNotNone( storage.verify_profile_token( self.token, address=address ) )
+
+    def test_same_as_blockstack_profiles(self):
+        """ Check that we accept the same tokens as blockstack_profiles
+        """
+        for key in self.forms['public_keys'] + self.forms['addresses']:
+            expected = blockstack_profiles.get_profile_from_tokens( self.token_records, key )
+            if key in self.forms['public_keys']:
+                profile = storage.get_profile_from_tokens( self.token_records, public_key=key )
+            else:
+                profile = storage.get_profile_from_tokens( self.token_records, address=key )
+
+            self.assertEqual( profile, expected )
+
+    def test_tampered_signature(self):
+        """ Check that a token with a modified signature is rejected
+        """
+        self.assertIsNone( storage.verify_profile_token( tamper_signature(self.token), public_key=self.pubkey ) )
+        self.assertIsNone( storage.verify_profile_token( "not.a.token", public_key=self.pubkey ) )
+        self.assertIsNone( storage.verify_profile_token( "garbage", public_key=self.pubkey ) )
+
+    def test_wrong_issuer(self):
+        """ Check that a token signed by someone else is rejected
+        """
+        other_pubkey = keylib.ECPrivateKey().public_key().to_hex()
+        self.assertIsNone( storage.verify_profile_token( self.token, public_key=other_pubkey ) )
+        self.assertEqual( storage.get_profile_from_tokens( self.token_records, public_key=other_pubkey ), {} )
+
+    def test_wrong_address(self):
+        """ Check that a token is rejected for an address that isn't its issuer's
+        """
+        other_address = keylib.ECPrivateKey().public_key().address()
+        self.assertIsNone( storage.verify_profile_token( self.token, address=other_address ) )
+
+    def test_raw_data_signature(self):
+        """ Check that verify_raw_data() accepts a good signature, and rejects other data
+        """
+        sk = ecdsa.SigningKey.from_string( self.privkey_hex[:64].decode('hex'), curve=ecdsa.SECP256k1 )
+        sig = sk.sign_digest( hashlib.sha256("hello world").digest(), sigencode=ecdsa.util.sigencode_der )
+        sigb64 = base64.b64encode( sig )
+
+        self.assertTrue( storage.verify_raw_data( "hello world", self.pubkey, sigb64 ) )
+        self.assertFalse( storage.verify_raw_data( "hello world!", self.pubkey, sigb64 ) )
+        self.assertFalse( storage.verify_raw_data( "hello world", self.pubkey, base64.b64encode("garbage") ) )
+
+    def test_verifier_cache_is_lru(self):
+        """ Check that the verifying key cache keeps the most recently used keys
+        """
+        old_size = storage.VERIFIER_CACHE_SIZE
+        storage.VERIFIER_CACHE_SIZE = 2
+        try:
+            keys = [keylib.ECPrivateKey().public_key().to_hex() for i in xrange(0, 3)]
+            storage.get_verifying_key( keys[0] )
+            storage.get_verifying_key( keys[1] )
+            storage.get_verifying_key( keys[0] )
+            storage.get_verifying_key( keys[2] )
+
+            self.assertIn( keys[0], storage.verifier_cache )
+            self.assertNotIn( keys[1], storage.verifier_cache )
+            self.assertIn( keys[2], storage.verifier_cache )
+
+        finally:
+            storage.VERIFIER_CACHE_SIZE = old_size
+
+
+class URLHandleStreamTest(unittest.TestCase):
+
+    def open_stream(self, data, chunk_size=7):
+        """
+        Make a streaming URL handle over @data, read in small chunks
+        """
+        urlh = storage.BlockstackURLHandle( "blockstack://foo.id/bar#" + hashlib.sha256(data).hexdigest(), stream=True )
+        urlh.STREAM_CHUNK_SIZE = chunk_size
+        urlh.stream = storage.HashVerifyingReader( StringIO(data), hashlib.sha256(data).hexdigest() )
+        urlh.data_len = None
+        urlh.fetched = True
+        return urlh
+
+    def test_readline(self):
+        """ Check that streamed lines match the data's lines, including long ones
+        """
+        data = "a\n" + "b" * 1000 + "\n\nlast line without newline"
+        urlh = self.open_stream( data )
+        self.assertEqual( list(urlh), StringIO(data).readlines() )
+        self.assertTrue( urlh.stream.verified )
+
+    def test_readline_limit(self):
+        """ Check that readline() honors a byte limit, and read() picks up the rest
+        """
+        data = "abcdefghij\nklm\n"
+        urlh = self.open_stream( data, chunk_size=3 )
+        self.assertEqual( urlh.readline(4), "abcd" )
+        self.assertEqual( urlh.readline(), "efghij\n" )
+        self.assertEqual( urlh.read(), "klm\n" )
+        self.assertEqual( urlh.offset, len(data) )
+
+    def test_hash_mismatch(self):
+        """ Check that a stream that doesn't match its hash raises at EOF
+        """
+        urlh = self.open_stream( "hello\nworld\n" )
+        urlh.stream.data_hash = hashlib.sha256("something else").hexdigest()
+        self.assertEqual( urlh.readline(), "hello\n" )
+        self.assertRaises( IOError, urlh.read )
+
+
+class MetadataDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_get_config = storage.get_config
+        self.old_metadata_dirs = storage.metadata_dirs
+        self.config_reads = 0
+        storage.metadata_dirs = {}
+
+        def get_config( config_path ):
+            self.config_reads += 1
+            return {'metadata': '/tmp/metadata-for-%s' % os.path.basename(config_path)}
+
+        storage.get_config = get_config
+
+    def tearDown(self):
+        storage.get_config = self.old_get_config
+        storage.metadata_dirs = self.old_metadata_dirs
+
+    def test_config_read_once(self):
+        """ Check that the metadata dir is looked up once per config file
+        """
+        for i in xrange(0, 3):
+            self.assertEqual( storage.get_metadata_dir( "/tmp/a.ini" ), "/tmp/metadata-for-a.ini" )
+
+        self.assertEqual( self.config_reads, 1 )
+
+        storage.set_metadata_dir( "/tmp/other", config_path="/tmp/b.ini" )
+        self.assertEqual( storage.get_metadata_dir( "/tmp/b.ini" ), "/tmp/other" )
+        self.assertEqual( self.config_reads, 1 )
+
+
+def make_driver( name, data=None, fail=False ):
+    """
+    Make a storage driver that serves @data ({key: data}) for both
+    immutable hashes and mutable URLs, or fails every request if @fail is True.
+    """
+    driver = types.ModuleType( name )
+
+    def get_handler( key, **kw ):
+        if fail:
+            raise Exception("%s is unreachable" % name)
+
+        return (data or {}).get( key, None )
+
+    driver.get_immutable_handler = get_handler
+    driver.get_mutable_handler = get_handler
+    driver.make_mutable_url = lambda data_id: data_id
+    driver.handles_url = lambda url: True
+    return driver
+
+
+class LookupStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_handlers = storage.storage_handlers
+        self.data = "hello world"
+        self.data_hash = storage.get_data_hash( self.data )
+
+    def tearDown(self):
+        storage.storage_handlers = self.old_handlers
+
+    def test_immutable_status(self):
+        """ Check that data is only reported missing if every driver said so
+        """
+        storage.storage_handlers = [make_driver("a"), make_driver("b")]
+        self.assertEqual( storage.get_immutable_data_status( self.data_hash, deserialize=False ), (None, "not found") )
+
+        storage.storage_handlers = [make_driver("a"), make_driver("b", fail=True)]
+        self.assertEqual( storage.get_immutable_data_status( self.data_hash, deserialize=False ), (None, "error") )
+
+        # bad data isn't a miss either
+        storage.storage_handlers = [make_driver("a", {self.data_hash: "something else"})]
+        self.assertEqual( storage.get_immutable_data_status( self.data_hash, deserialize=False ), (None, "error") )
+
+        storage.storage_handlers = [make_driver("a", fail=True), make_driver("b", {self.data_hash: self.data})]
+        self.assertEqual( storage.get_immutable_data_status( self.data_hash, deserialize=False ), (self.data, None) )
+        self.assertEqual( storage.get_immutable_data( self.data_hash, deserialize=False ), self.data )
+
+    def test_immutable_many_failed(self):
+        """ Check that get_immutable_data_many() reports the hashes a driver failed on, but not plain misses
+        """
+        other_hash = storage.get_data_hash( "other" )
+        failing = make_driver("a", fail=True)
+        storage.storage_handlers = [failing, make_driver("b", {self.data_hash: self.data})]
+
+        failed = []
+        res = storage.get_immutable_data_many( [self.data_hash, other_hash], deserialize=False, failed=failed )
+        self.assertEqual( res, {self.data_hash: self.data} )
+        self.assertEqual( failed, [other_hash] )
+
+        storage.storage_handlers = [make_driver("b", {self.data_hash: self.data})]
+        failed = []
+        res = storage.get_immutable_data_many( [self.data_hash, other_hash], deserialize=False, failed=failed )
+        self.assertEqual( res, {self.data_hash: self.data} )
+        self.assertEqual( failed, [] )
+
+    def test_mutable_status(self):
+        """ Check that mutable data is only reported missing if every driver said so
+        """
+        for urls in [None, ["foo.id"]]:
+            storage.storage_handlers = [make_driver("a"), make_driver("b")]
+            self.assertEqual( storage.get_mutable_data_status( "foo.id", None, urls=urls, decode=False ), (None, "not found") )
+
+            storage.storage_handlers = [make_driver("c", fail=True), make_driver("d")]
+            self.assertEqual( storage.get_mutable_data_status( "foo.id", None, urls=urls, decode=False ), (None, "error") )
+
+            storage.storage_handlers = [make_driver("e", fail=True), make_driver("f", {"foo.id": "data"})]
+            self.assertEqual( storage.get_mutable_data_status( "foo.id", None, urls=urls, decode=False ), ("data", None) )
+
+    def test_mutable_many_errors(self):
+        """ Check that get_mutable_data_many() only says 'No data found' if every driver said so
+        """
+        storage.storage_handlers = [make_driver("g"), make_driver("h", fail=True)]
+        res = storage.get_mutable_data_many( [{'fq_data_id': 'foo.id', 'data_pubkey': None}], decode=False )
+        self.assertEqual( res['foo.id'], {'error': 'Failed to fetch data'} )
+
+        storage.storage_handlers = [make_driver("i"), make_driver("j")]
+        res = storage.get_mutable_data_many( [{'fq_data_id': 'foo.id', 'data_pubkey': None}], decode=False )
+        self.assertEqual( res['foo.id'], {'error': 'No data found'} )
+
+
+if __name__ == '__main__':
+    unittest.main()